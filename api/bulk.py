@@ -0,0 +1,109 @@
+import random
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from scraper.cache import bump_data_version
+from scraper.feeds import schedule_feed_update
+from scraper.models import News
+from .serializers import INVALID_TYPE, INVALID_URL, NewsItemSerializer, POSTED_TYPES, URL_SCHEMES
+
+# Writable fields of posted items, with whether they are required on creation
+ITEM_FIELDS = {name: not News._meta.get_field(name).blank for name in NewsItemSerializer.Meta.fields}
+
+
+def validate_items(items, stored):
+    """
+    Validate a batch of posted items in one pass, with the field rules of NewsItemSerializer.
+    Items with an `id` update that posted item (only the given fields), the others are created.
+    :param items: Parsed request body
+    :param stored: {pk: is_posted} of the items named by an `id`, loaded in one query
+    :return: One error dict per item, empty for valid items, like a list serializer's errors
+    """
+    errors = []
+    for item in items:
+        if not isinstance(item, dict):
+            errors.append({"error": ["Expected an object."]})
+            continue
+        item_errors = {}
+        creating = "id" not in item
+        if not creating:
+            pk = item["id"]
+            if not isinstance(pk, int) or isinstance(pk, bool) or pk not in stored:
+                item_errors["id"] = ["Not found."]
+            elif not stored[pk]:
+                item_errors["error"] = ["You can only update news that are posted."]
+
+        for name, required in ITEM_FIELDS.items():
+            if name not in item:
+                if creating and required:
+                    item_errors[name] = ["This field is required."]
+                continue
+            value = item[name]
+            field = News._meta.get_field(name)
+            if value is None:
+                if not field.null:
+                    item_errors[name] = ["This field may not be null."]
+            elif not isinstance(value, str):
+                item_errors[name] = ["Not a valid string."]
+            elif not value and not field.blank:
+                item_errors[name] = ["This field may not be blank."]
+            elif field.max_length and len(value) > field.max_length:
+                item_errors[name] = [f"Ensure this field has no more than {field.max_length} characters."]
+
+        if "type" not in item_errors and (creating or "type" in item) and item.get("type") not in POSTED_TYPES:
+            item_errors.setdefault("error", []).append(INVALID_TYPE)
+        url = item.get("url")
+        if "url" not in item_errors and isinstance(url, str) and url and not url.startswith(URL_SCHEMES):
+            item_errors.setdefault("error", []).append(INVALID_URL)
+        errors.append(item_errors)
+    return errors
+
+
+def stored_items(items):
+    """
+    {pk: is_posted} of the stored items named by the `id` of `items`.
+    """
+    pks = {item["id"] for item in items if isinstance(item, dict) and isinstance(item.get("id"), int)}
+    return dict(News.objects.filter(pk__in=pks).values_list("pk", "is_posted")) if pks else {}
+
+
+def write_items(items):
+    """
+    Create and update validated posted items in one transaction, then invalidate the cached
+    pages and queue the feed update once for the whole batch. Updates of items deleted or no
+    longer posted since they were validated are dropped.
+    :param items: Items accepted by validate_items
+    :return: (pks of the created items, pks of the updated items)
+    """
+    now = timezone.now()
+    creates = [item for item in items if "id" not in item]
+    updates = {item["id"]: item for item in items if "id" in item}
+    batch_size = settings.API_BULK_BATCH_SIZE
+
+    with transaction.atomic():
+        created = News.objects.bulk_create([
+            News(
+                **{name: item[name] for name in ITEM_FIELDS if name in item},
+                is_posted=True, date_created=now, score=random.randint(1, 100),
+            )
+            for item in creates
+        ], batch_size=batch_size)
+
+        changed, fields = [], {"date_created"}
+        for news in News.objects.filter(pk__in=updates, is_posted=True).select_for_update():
+            for name in ITEM_FIELDS:
+                if name in updates[news.pk]:
+                    setattr(news, name, updates[news.pk][name])
+                    fields.add(name)
+            news.date_created = now
+            changed.append(news)
+        if changed:
+            News.objects.bulk_update(changed, sorted(fields), batch_size=batch_size)
+
+    created_pks = [news.pk for news in created]
+    updated_pks = [news.pk for news in changed]
+    if created_pks or updated_pks:
+        bump_data_version()
+        schedule_feed_update(created_pks + updated_pks)
+    return created_pks, updated_pks
@@ -0,0 +1,58 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from core.profiling import profile_section
+from scraper.cache import get_data_version
+
+
+class CachedListMixin:
+    """
+    Read-through cache for JSON list responses.
+
+    The rendered page is cached under the view name, the origin, the path, the
+    query parameters and the data version, so a sync or an API write (which bump the version)
+    invalidates every cached page at once. Responses carry an ETag and a
+    matching If-None-Match gets a 304. Other renderers (e.g. the browsable
+    API) are not cached.
+    """
+    cache_timeout = None
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != "json":
+            return super().list(request, *args, **kwargs)
+
+        key = self.get_cache_key(request)
+        entry = cache.get(key)
+        if entry is None:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            with profile_section("render"):
+                content = response.rendered_content
+            entry = {
+                "content": content,
+                "content_type": response["Content-Type"],
+                "etag": f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"',
+            }
+            timeout = self.cache_timeout if self.cache_timeout is not None else settings.API_CACHE_TIMEOUT
+            cache.set(key, entry, timeout)
+
+        if entry["etag"] in request.headers.get("If-None-Match", ""):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(entry["content"], content_type=entry["content_type"])
+        response["ETag"] = entry["etag"]
+        return response
+
+    def get_cache_key(self, request):
+        # The path tells apart views serving several URLs, like the feeds, and the
+        # scheme and host those of the absolute links in the pages
+        params = sorted(request.query_params.lists())
+        origin = (request.scheme, request.get_host())
+        digest = hashlib.blake2b(repr((origin, request.path, params)).encode(), digest_size=16).hexdigest()
+        return f"api:{type(self).__name__}:{get_data_version()}:{digest}"
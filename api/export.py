@@ -0,0 +1,47 @@
+import csv
+from datetime import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class Echo:
+    """
+    File-like object whose write() returns the written line instead of storing it,
+    so csv.writer can produce lines for a streaming response.
+    """
+
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(rows, fields, chunk_size):
+    """
+    Encode value rows as one JSON object per line, yielding `chunk_size` lines at a time.
+    """
+    encode = DjangoJSONEncoder().encode
+    for chunk in chunked(rows, chunk_size):
+        yield "".join(encode(dict(zip(fields, row))) + "\n" for row in chunk)
+
+
+def csv_lines(rows, fields, chunk_size):
+    """
+    Encode value rows as CSV with a header line, yielding `chunk_size` lines at a time.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for chunk in chunked(rows, chunk_size):
+        yield "".join(
+            writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+            for row in chunk
+        )
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
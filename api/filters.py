@@ -0,0 +1,62 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from scraper.search import search
+
+
+def filter_news(queryset, params):
+    """
+    Apply the `type` and `search` filters of the news list.
+    Searching orders the results by relevance.
+    """
+    type_filter = params.get('type', '')
+    if type_filter:
+        queryset = queryset.filter(type=type_filter)
+
+    search_query = params.get('search', '')
+    if search_query:
+        queryset = search(queryset, search_query)
+    return queryset
+
+
+def filter_bounds(queryset, params, key_field, time_field):
+    """
+    Apply the `since_id`, `created_after` and `created_before` filters.
+    :param key_field: Field holding the Hacker News ID, compared with since_id (exclusive)
+    :param time_field: Field compared with the time bounds, given as ISO 8601 or Unix timestamps
+    :raises ValueError: If a bound cannot be parsed
+    """
+    since_id = params.get('since_id')
+    if since_id:
+        if not since_id.isdigit():
+            raise ValueError("since_id must be an integer.")
+        queryset = queryset.filter(**{f'{key_field}__gt': int(since_id)})
+
+    created_after = params.get('created_after')
+    if created_after:
+        queryset = queryset.filter(**{f'{time_field}__gte': parse_time(created_after, 'created_after')})
+
+    created_before = params.get('created_before')
+    if created_before:
+        queryset = queryset.filter(**{f'{time_field}__lt': parse_time(created_before, 'created_before')})
+    return queryset
+
+
+def parse_time(value, name):
+    """
+    Parse an ISO 8601 time or a Unix timestamp, naive times being UTC.
+    :raises ValueError: With a message for the client naming the `name` parameter
+    """
+    error = ValueError(f"{name} must be an ISO 8601 time or a Unix timestamp.")
+    try:
+        if value.isdigit():
+            return datetime.fromtimestamp(int(value), tz=dt_timezone.utc)
+        parsed = parse_datetime(value)
+    except (ValueError, OverflowError, OSError):
+        raise error
+    if parsed is None:
+        raise error
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
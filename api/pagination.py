@@ -0,0 +1,131 @@
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from scraper.pagination import InvalidCursor, KeysetPaginator
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over `ordering_field` (newest first), backed by KeysetPaginator.
+    Deep pages cost the same as the first one and no count is returned.
+    """
+    ordering_field = None
+    cursor_query_param = "cursor"
+    page_size = api_settings.PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginator = KeysetPaginator(queryset, self.page_size, self.ordering_field)
+        try:
+            self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        except InvalidCursor as e:
+            raise NotFound(str(e))
+        return self.page.object_list
+
+    def get_next_link(self):
+        if not self.page.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.page.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class OptInKeysetPagination(BasePagination):
+    """
+    Page number pagination by default. Requests with `?pagination=cursor` (or a
+    `cursor` from a previous page) are paginated with KeysetPagination instead.
+    """
+    ordering_field = None
+
+    def __init__(self):
+        self.keyset = KeysetPagination()
+        self.keyset.ordering_field = self.ordering_field
+        self.paginator = PageNumberPagination()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if params.get("pagination") == "cursor" or self.keyset.cursor_query_param in params:
+            self.paginator = self.keyset
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.paginator.get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        return self.paginator.get_schema_operation_parameters(view)
+
+
+class NewsPagination(OptInKeysetPagination):
+    ordering_field = "date_created"
+
+
+class CommentPagination(OptInKeysetPagination):
+    ordering_field = "date_posted"
+
+
+class FeedPagination(BasePagination):
+    """
+    Page number pagination over the stored positions of a ranked feed: a page is the
+    range of positions it covers, so any page is read from the (feed, position) index
+    without OFFSET or COUNT(*).
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_query_param = "page"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            self.page_number = 0
+        if self.page_number < 1:
+            raise NotFound("Invalid page.")
+
+        start = (self.page_number - 1) * self.page_size
+        # One extra position tells whether there is a next page
+        rows = list(queryset.filter(
+            feed_entries__feed=view.kwargs["feed"],
+            feed_entries__position__gt=start,
+            feed_entries__position__lte=start + self.page_size + 1,
+        ).order_by("feed_entries__position"))
+        self.has_next = len(rows) > self.page_size
+        return rows[:self.page_size]
+
+    def get_page_link(self, page_number):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, page_number)
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_page_link(self.page_number + 1) if self.has_next else None,
+            "previous": self.get_page_link(self.page_number - 1) if self.page_number > 1 else None,
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
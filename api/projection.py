@@ -0,0 +1,57 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from core.profiling import profile_section
+
+
+class ValuesListMixin:
+    """
+    Fast read path for list views: rows are fetched with `.values()` and returned
+    as plain dicts, without model instances or serializer fields. The output matches
+    the ModelSerializer that documents the view: every concrete field but the ones in
+    its `Meta.exclude`.
+
+    Clients can narrow the response with `?fields=id,title` (a sparse fieldset) and
+    leave out fields with `?omit=text,kids`.
+    """
+    fields_query_param = "fields"
+    omit_query_param = "omit"
+
+    def get_list_fields(self):
+        """
+        Return the output fields of this request, in model order.
+        :raises ValidationError: On unknown fields or an empty selection
+        """
+        excluded = getattr(self.get_serializer_class().Meta, "exclude", ())
+        all_fields = [
+            field.name for field in self.get_queryset().model._meta.concrete_fields if field.name not in excluded
+        ]
+        params = self.request.query_params
+        fields = all_fields
+        for param in (self.fields_query_param, self.omit_query_param):
+            names = [name.strip() for name in params.get(param, "").split(",") if name.strip()]
+            unknown = [name for name in names if name not in all_fields]
+            if unknown:
+                raise ValidationError({param: f"Unknown fields: {', '.join(unknown)}"})
+            if names and param == self.fields_query_param:
+                fields = [field for field in fields if field in names]
+            elif names:
+                fields = [field for field in fields if field not in names]
+        if not fields:
+            raise ValidationError({self.fields_query_param: "Select at least one field."})
+        return fields
+
+    def list(self, request, *args, **kwargs):
+        fields = self.get_list_fields()
+        # Cursor pagination needs the ordering field and the primary key of each row
+        ordering_field = getattr(self.paginator, "ordering_field", None)
+        selected = list(dict.fromkeys([*fields, *filter(None, [ordering_field, "id"])]))
+        queryset = self.filter_queryset(self.get_queryset()).values(*selected)
+
+        page = self.paginate_queryset(queryset)
+        with profile_section("serialize"):
+            rows = list(page if page is not None else queryset)
+            if len(selected) > len(fields):
+                rows = [{field: row[field] for field in fields} for row in rows]
+        if page is not None:
+            return self.get_paginated_response(rows)
+        return Response(rows)
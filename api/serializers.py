@@ -1,9 +1,39 @@
 from rest_framework import serializers
 from django.utils import timezone
 import random
+from core.profiling import profile_section
 from scraper.models import News, Comment
 
-class NewsItemSerializer(serializers.ModelSerializer):
+# Rules for posted items, shared with the bulk endpoint
+POSTED_TYPES = ('story', 'job')
+URL_SCHEMES = ('http://', 'https://')
+INVALID_TYPE = "Type must be either 'story' or 'job'"
+INVALID_URL = "URL must start with 'http://' or 'https://'"
+
+class ProfiledListSerializer(serializers.ListSerializer):
+    """
+    List serializer whose output time is recorded as "serialize" in profiled requests.
+    """
+
+    @property
+    def data(self):
+        with profile_section("serialize"):
+            return super().data
+
+
+class ProfiledSerializerMixin:
+    """
+    Record the output time of a serializer as "serialize" in profiled requests.
+    Serializers used with many=True also need `list_serializer_class = ProfiledListSerializer`.
+    """
+
+    @property
+    def data(self):
+        with profile_section("serialize"):
+            return super().data
+
+
+class NewsItemSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = News
         fields = ['title', 'url', 'author', 'text', 'type']
@@ -18,13 +48,13 @@ class NewsItemSerializer(serializers.ModelSerializer):
         """
         # Validate the 'type' field
         item_type = data.get('type', '')
-        if item_type not in ['story', 'job']:
-            raise serializers.ValidationError({"error": "Type must be either 'story' or 'job'"})
+        if item_type not in POSTED_TYPES:
+            raise serializers.ValidationError({"error": INVALID_TYPE})
 
         # Validate the 'url' field
         url = data.get('url', '')
-        if url and not url.startswith(('http://', 'https://')):
-            raise serializers.ValidationError({"error": "URL must start with 'http://' or 'https://'"})
+        if url and not url.startswith(URL_SCHEMES):
+            raise serializers.ValidationError({"error": INVALID_URL})
 
         return data
 
@@ -37,21 +67,45 @@ class NewsItemSerializer(serializers.ModelSerializer):
         validated_data['score'] = random.randint(1, 100)  
         return super().create(validated_data)
 
-class NewsListSerializer(serializers.ModelSerializer):
+# Change detection of the sync, not item data
+INTERNAL_FIELDS = ['fingerprint']
+
+class NewsListSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = News
-        fields = '__all__'
+        exclude = INTERNAL_FIELDS
+        list_serializer_class = ProfiledListSerializer
 
-class NewsDetailSerializer(serializers.ModelSerializer):
+class NewsDetailSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = News
-        fields = '__all__'
+        exclude = INTERNAL_FIELDS
         read_only_fields = [
             'item_id', 'deleted', 'dead', 'kids', 'descendants', 
-            'is_posted', 'score', 'date_created'
+            'is_posted', 'score', 'date_created', 'fingerprint'
         ]
         
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Comment
-        fields = '__all__'
+        # The thread path only orders the tree; the story and depth are set by the sync
+        exclude = INTERNAL_FIELDS + ['path']
+        read_only_fields = ['news', 'depth']
+        list_serializer_class = ProfiledListSerializer
+
+
+class CommentPageSerializer(CommentSerializer):
+    reply_count = serializers.IntegerField(read_only=True)
+
+
+class CommentThreadSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
+    replies = serializers.SerializerMethodField()
+    more_replies = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'comment_id', 'parent', 'author', 'text', 'date_posted', 'depth', 'replies', 'more_replies']
+        list_serializer_class = ProfiledListSerializer
+
+    def get_replies(self, comment):
+        return CommentThreadSerializer(comment.replies, many=True).data
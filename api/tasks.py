@@ -0,0 +1,17 @@
+import logging
+
+from celery import shared_task
+from .bulk import write_items
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name="write_news_items")
+def write_news_items(items):
+    """
+    Write a batch of posted items accepted by the bulk endpoint in async mode.
+    :param items: Items accepted by validate_items
+    """
+    created, updated = write_items(items)
+    logger.info(f"Bulk write created {len(created)} and updated {len(updated)} posted items")
+    return {"created": created, "updated": updated}
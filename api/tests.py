@@ -1,12 +1,30 @@
-from django.test import TestCase
+import csv
+import io
+import json
+from datetime import datetime, timezone as dt_timezone
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from unittest import mock
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
+from core.celery import app as celery_app
+from core.profiling import SLOWEST_KEY
+from .serializers import CommentSerializer, NewsListSerializer
+from .views import NewsItemDetailView
+from scraper.feeds import update_feeds
 from scraper.models import News, Comment
+from scraper.tests import EagerCeleryMixin
 from django.utils.timezone import now
 
 
-class NewsAPITestCase(TestCase):
+class NewsAPITestCase(EagerCeleryMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.client = APIClient()
         self.news_item = News.objects.create(
             item_id=1,
@@ -30,6 +48,21 @@ class NewsAPITestCase(TestCase):
         response = self.client.get(f"/api/item/detail/{self.news_item.id}/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_news_detail_with_comments(self):
+        """?include=comments adds the first page of direct replies and their reply counts"""
+        Comment.objects.create(comment_id=10, parent=1, news_id=1, author="a", text="First")
+        Comment.objects.create(comment_id=11, parent=10, news_id=1, author="b", text="Reply")
+        with self.assertNumQueries(3):
+            response = self.client.get(f"/api/item/detail/{self.news_item.id}/", {"include": "comments"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["title"], "Test News")
+        self.assertEqual(response.data["comment_count"], 1)
+        self.assertEqual([(c["comment_id"], c["reply_count"]) for c in response.data["comments"]], [(10, 1)])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/item/detail/{self.news_item.id}/")
+        self.assertNotIn("comments", response.data)
+
     def test_news_create(self):
         """Test creating a news item"""
         data = {
@@ -62,6 +95,7 @@ class NewsAPITestCase(TestCase):
 
 class CommentAPITestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.news_item = News.objects.create(
             item_id=1,
@@ -88,7 +122,418 @@ class CommentAPITestCase(TestCase):
         response = self.client.get("/api/item/comment/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_comment_list_by_story(self):
+        """item_id lists the comments linked to a story, newest first"""
+        self.comment.news = self.news_item
+        self.comment.save()
+        other = News.objects.create(item_id=2, type="story", author="a", title="Other", date_created=now())
+        for comment_id in (201, 202):
+            Comment.objects.create(comment_id=comment_id, parent=2, news=other, date_posted=now(), author="a")
+
+        data = self.client.get("/api/item/comment/?item_id=2", HTTP_ACCEPT="application/json").json()
+        self.assertEqual([comment["comment_id"] for comment in data["results"]], [202, 201])
+        self.assertEqual(data["results"][0]["news"], 2)
+        data = self.client.get("/api/item/comment/?item_id=2&pagination=cursor", HTTP_ACCEPT="application/json").json()
+        self.assertEqual(len(data["results"]), 2)
+        response = self.client.get("/api/item/comment/?item_id=abc", HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_comment_detail(self):
         """Test retrieving a single comment"""
         response = self.client.get(f"/api/item/comment/detail/{self.comment.comment_id}/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class CachedListTestCase(EagerCeleryMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.news_item = News.objects.create(
+            item_id=1,
+            type="story",
+            author="test_author",
+            date_created=now(),
+            is_posted=True,
+            title="Test News",
+        )
+
+    def test_list_is_served_from_cache(self):
+        """A repeated request does not hit the database"""
+        first = self.client.get("/api/item/", HTTP_ACCEPT="application/json")
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/item/", HTTP_ACCEPT="application/json")
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+
+    def test_query_params_are_cached_separately(self):
+        """Different filters get different cache entries"""
+        self.client.get("/api/item/?type=story", HTTP_ACCEPT="application/json")
+        response = self.client.get("/api/item/?type=job", HTTP_ACCEPT="application/json")
+        self.assertEqual(response.json()["count"], 0)
+
+    def test_writes_invalidate_cache(self):
+        """Creating an item through the API bumps the data version"""
+        self.client.get("/api/item/", HTTP_ACCEPT="application/json")
+        data = {"item_id": 2, "type": "story", "author": "new_author", "date_created": now(), "is_posted": True}
+        self.client.post("/api/item/create/", data, format="json")
+        response = self.client.get("/api/item/", HTTP_ACCEPT="application/json")
+        self.assertEqual(response.json()["count"], 2)
+
+    def test_not_modified(self):
+        """A matching If-None-Match gets a 304 without a body"""
+        etag = self.client.get("/api/item/", HTTP_ACCEPT="application/json")["ETag"]
+        response = self.client.get("/api/item/", HTTP_ACCEPT="application/json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+
+
+class CursorPaginationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        for item_id in range(1, 26):
+            News.objects.create(item_id=item_id, type="story", author="a", title=f"Item {item_id}", date_created=now())
+
+    def test_page_numbers_by_default(self):
+        """Without the opt-in the list keeps its page number format"""
+        response = self.client.get("/api/item/", HTTP_ACCEPT="application/json")
+        self.assertEqual(response.json()["count"], 25)
+
+    def test_cursor_pages(self):
+        """Following the next links returns every item once, without a count"""
+        url, item_ids = "/api/item/?pagination=cursor", []
+        while url:
+            data = self.client.get(url, HTTP_ACCEPT="application/json").json()
+            self.assertNotIn("count", data)
+            item_ids += [item["id"] for item in data["results"]]
+            url = data["next"]
+        self.assertEqual(sorted(item_ids), sorted(News.objects.values_list("id", flat=True)))
+
+    def test_invalid_cursor(self):
+        """A malformed cursor is a 404"""
+        response = self.client.get("/api/item/?cursor=garbage", HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FieldSelectionTestCase(EagerCeleryMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        for item_id in range(1, 16):
+            News.objects.create(item_id=item_id, type="story", author="a", title=f"Item {item_id}", text="Long text",
+                                kids=[item_id * 100], url="https://example.com", date_created=now())
+        Comment.objects.create(comment_id=100, parent=1, author="c", text="A comment", kids=[], date_posted=now())
+
+    def get(self, url):
+        return self.client.get(url, HTTP_ACCEPT="application/json")
+
+    def test_default_output_matches_the_model_serializer(self):
+        data = self.get("/api/item/").json()
+        expected = NewsListSerializer(News.objects.order_by("-date_created", "-id")[:10], many=True).data
+        self.assertEqual(data["results"], json.loads(JSONRenderer().render(expected)))
+
+        data = self.get("/api/item/comment/").json()
+        expected = CommentSerializer(Comment.objects.all(), many=True).data
+        self.assertEqual(data["results"], json.loads(JSONRenderer().render(expected)))
+
+    def test_sparse_fieldset(self):
+        data = self.get("/api/item/?fields=title,id").json()
+        self.assertEqual(list(data["results"][0]), ["id", "title"])
+
+    def test_omit_text_and_kids(self):
+        data = self.get("/api/item/comment/?omit=text,kids").json()
+        self.assertNotIn("text", data["results"][0])
+        self.assertNotIn("kids", data["results"][0])
+        self.assertEqual(data["results"][0]["comment_id"], 100)
+
+    def test_unknown_or_empty_fields_are_rejected(self):
+        self.assertEqual(self.get("/api/item/?fields=title,secret").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get("/api/item/?fields=title&omit=title").status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_pages_without_the_ordering_field(self):
+        url, titles = "/api/item/?pagination=cursor&fields=title", []
+        while url:
+            data = self.get(url).json()
+            self.assertEqual({key for item in data["results"] for key in item}, {"title"})
+            titles += [item["title"] for item in data["results"]]
+            url = data["next"]
+        self.assertEqual(len(titles), len(set(titles)))
+        self.assertEqual(len(titles), 15)
+
+    def test_fingerprint_is_not_exposed(self):
+        """The sync's change detection fingerprint is neither returned nor writable"""
+        News.objects.filter(item_id=1).update(fingerprint="abc", is_posted=True)
+        news = News.objects.get(item_id=1)
+        self.assertNotIn("fingerprint", self.get("/api/item/").json()["results"][0])
+        self.assertNotIn("fingerprint", self.get("/api/item/comment/").json()["results"][0])
+        self.assertNotIn("fingerprint", self.get(f"/api/item/detail/{news.pk}/").json())
+        self.assertEqual(self.get("/api/item/?fields=fingerprint").status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.patch(f"/api/item/detail/{news.pk}/", {"fingerprint": "forged"}, format="json")
+        news.refresh_from_db()
+        self.assertEqual(news.fingerprint, "abc")
+
+    def test_thread_path_is_not_exposed(self):
+        data = self.get("/api/item/comment/").json()["results"][0]
+        self.assertNotIn("path", data)
+        self.assertIn("depth", data)
+        self.assertNotIn("path", self.get("/api/item/comment/detail/100/").json())
+        self.assertEqual(self.get("/api/item/comment/?fields=path").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(CommentSerializer().fields["news"].read_only)
+
+    def test_search_with_fields(self):
+        News.objects.create(item_id=99, type="story", author="a", title="Rust compiler", date_created=now())
+        data = self.get("/api/item/?search=rust&fields=item_id").json()
+        self.assertEqual(data["results"], [{"item_id": 99}])
+
+
+class FeedTestCase(EagerCeleryMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        for item_id in range(1, 26):
+            News.objects.create(item_id=item_id, type="story", author="a", title=f"Item {item_id}",
+                                score=item_id * 10, descendants=25 - item_id, date_created=now())
+        update_feeds()
+
+    def get(self, url):
+        return self.client.get(url, HTTP_ACCEPT="application/json")
+
+    def test_feeds_are_served_in_ranked_order(self):
+        data = self.get("/api/item/feed/top/").json()
+        self.assertEqual([item["item_id"] for item in data["results"]], list(range(25, 15, -1)))
+        data = self.get("/api/item/feed/discussed/?fields=item_id").json()
+        self.assertEqual(data["results"][0], {"item_id": 1})
+
+    def test_feeds_are_cached_apart(self):
+        """Feeds requested with the same parameters are not served from each other's cache entry"""
+        top = [item["item_id"] for item in self.get("/api/item/feed/top/").json()["results"]]
+        discussed = [item["item_id"] for item in self.get("/api/item/feed/discussed/").json()["results"]]
+        self.assertEqual(top[0], 25)
+        self.assertEqual(discussed[0], 1)
+
+    def test_feed_pages(self):
+        item_ids, url = [], "/api/item/feed/hot/"
+        while url:
+            data = self.get(url).json()
+            item_ids += [item["item_id"] for item in data["results"]]
+            url = data["next"]
+        self.assertEqual(len(item_ids), 25)
+        self.assertEqual(item_ids[:3], [25, 24, 23])
+        self.assertIsNotNone(data["previous"])
+
+    def test_feed_page_reads_one_range(self):
+        # One range of positions, without a count
+        with self.assertNumQueries(1):
+            self.get("/api/item/feed/top/?page=2")
+
+    def test_unknown_feed_or_page(self):
+        self.assertEqual(self.get("/api/item/feed/new/").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.get("/api/item/feed/top/?page=0").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_api_writes_update_the_feeds(self):
+        News.objects.filter(item_id=1).update(is_posted=True)
+        news = News.objects.get(item_id=1)
+        self.client.delete(f"/api/item/detail/{news.pk}/")
+        data = self.get("/api/item/feed/discussed/").json()
+        self.assertEqual(data["results"][0]["item_id"], 2)
+
+    def test_api_writes_queue_the_feed_update(self):
+        """The request only queues the reranking of the feeds"""
+        with mock.patch("scraper.tasks.update_ranked_feeds.delay") as delay, \
+                mock.patch("scraper.feeds.update_feeds") as update:
+            self.client.post("/api/item/create/", {"type": "story", "author": "a", "title": "New"}, format="json")
+        delay.assert_called_once_with([News.objects.get(title="New").pk])
+        update.assert_not_called()
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for item_id in range(1, 8):
+            News.objects.create(
+                item_id=item_id,
+                type="job" if item_id == 7 else "story",
+                author="a",
+                title=f"Story {item_id}",
+                kids=[item_id * 10],
+                date_created=datetime(2024, 1, item_id, tzinfo=dt_timezone.utc),
+            )
+        Comment.objects.create(comment_id=70, parent=7, text="A comment", date_posted=now(), type="comment")
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        """Every row is one JSON object, in Hacker News ID order"""
+        lines = self.export("/api/item/export/").splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row["item_id"] for row in rows], list(range(1, 8)))
+        self.assertEqual(rows[0]["kids"], [10])
+        self.assertEqual(rows[0]["date_created"], "2024-01-01T00:00:00Z")
+
+    def test_csv(self):
+        """CSV output starts with a header line"""
+        rows = list(csv.reader(io.StringIO(self.export("/api/item/export/", format="csv"))))
+        self.assertEqual(rows[0][:3], ["item_id", "type", "author"])
+        self.assertEqual(len(rows), 8)
+
+    def test_filters(self):
+        """type, since_id and the time bounds narrow the export"""
+        lines = self.export("/api/item/export/", type="story", since_id=2, created_before="2024-01-05T00:00:00Z")
+        self.assertEqual([json.loads(line)["item_id"] for line in lines.splitlines()], [3, 4])
+        lines = self.export("/api/item/export/", created_after=int(datetime(2024, 1, 6, tzinfo=dt_timezone.utc).timestamp()))
+        self.assertEqual([json.loads(line)["item_id"] for line in lines.splitlines()], [6, 7])
+
+    def test_comments(self):
+        """Comments are exported with their thread fields"""
+        rows = [json.loads(line) for line in self.export("/api/item/comment/export/", search="comment").splitlines()]
+        self.assertEqual([(row["comment_id"], row["parent"]) for row in rows], [(70, 7)])
+
+    def test_invalid_parameters(self):
+        """Unknown formats and unparsable bounds are rejected"""
+        self.assertEqual(self.client.get("/api/item/export/", {"format": "xml"}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get("/api/item/export/", {"created_after": "yesterday"}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        response = self.client.get("/api/item/export/", {"since_id": "abc"})
+        self.assertEqual((response.status_code, response.json()), (status.HTTP_400_BAD_REQUEST,
+                                                                   {"detail": "since_id must be an integer."}))
+        response = self.client.get("/api/item/comment/export/", {"created_before": "2024-13-01T00:00:00"})
+        self.assertEqual(response.json(), {"detail": "created_before must be an ISO 8601 time or a Unix timestamp."})
+        self.assertEqual(self.client.get("/api/item/export/", {"created_after": "9" * 30}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(PROFILING_TOKEN="secret", PROFILING_SAMPLE_RATE=0.0)
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        News.objects.create(item_id=1, type="story", author="a", title="First", date_created=now())
+        News.objects.create(item_id=2, type="story", author="b", title="Second", date_created=now())
+
+    def timings(self, response):
+        return {metric.split(";")[0]: metric for metric in response["Server-Timing"].split(", ")}
+
+    def test_requests_are_not_profiled_by_default(self):
+        response = self.client.get("/api/item/", HTTP_X_PROFILE="wrong")
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(cache.get(SLOWEST_KEY), None)
+
+    def test_api_request_with_token_is_profiled(self):
+        response = self.client.get("/api/item/", HTTP_X_PROFILE="secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {"sql", "serialize", "render", "total"})
+        self.assertIn('queries (0 repeated)"', timings["sql"])
+
+        entry, = cache.get(SLOWEST_KEY)
+        self.assertEqual((entry["path"], entry["view"], entry["status"]), ("/api/item/", "item_list", 200))
+        self.assertEqual(entry["queries"], 2)
+
+    def test_html_views_time_template_rendering(self):
+        response = self.client.get(reverse("item_list"), HTTP_X_PROFILE="secret")
+        self.assertIn("render", self.timings(response))
+
+    def test_sampled_requests_are_profiled(self):
+        with override_settings(PROFILING_SAMPLE_RATE=1.0):
+            response = self.client.get("/api/item/")
+        self.assertIn("Server-Timing", response)
+
+    def test_slowest_requests_are_kept(self):
+        with override_settings(PROFILING_SLOWEST=2):
+            for _ in range(4):
+                self.client.get("/api/item/", HTTP_X_PROFILE="secret")
+        slowest = cache.get(SLOWEST_KEY)
+        self.assertEqual(len(slowest), 2)
+        self.assertGreaterEqual(slowest[0]["total_ms"], slowest[1]["total_ms"])
+
+    def test_staff_can_profile_and_view_slow_requests(self):
+        staff = User.objects.create_user("staff", password="pw", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get("/api/item/", HTTP_X_PROFILE="1")
+        self.assertIn("Server-Timing", response)
+
+        response = self.client.get(reverse("slow_requests"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, "GET /api/item/")
+
+    def test_slow_requests_page_requires_staff(self):
+        response = self.client.get(reverse("slow_requests"))
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+
+
+class BulkWriteTestCase(EagerCeleryMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.posted = News.objects.create(type="story", author="a", title="Posted", is_posted=True, date_created=now())
+        self.scraped = News.objects.create(item_id=7, type="story", author="hn", title="Scraped", date_created=now())
+        update_feeds()
+
+    def items(self, count):
+        return [{"type": "story", "author": f"partner{n}", "title": f"Bulk {n}", "url": "https://example.com"}
+                for n in range(count)]
+
+    def test_bulk_create_and_update(self):
+        """A batch is written in one transaction, with the same number of queries whatever its size"""
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.post("/api/item/bulk/", self.items(2), format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.post("/api/item/bulk/", self.items(50), format="json")
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(len(response.data["created"]), 50)
+
+        response = self.client.post("/api/item/bulk/", [{"id": self.posted.pk, "title": "Renamed"}], format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"created": [], "updated": [self.posted.pk]})
+        self.assertEqual(News.objects.filter(is_posted=True, title__startswith="Bulk").count(), 52)
+        self.posted.refresh_from_db()
+        self.assertEqual((self.posted.title, self.posted.author), ("Renamed", "a"))
+
+    def test_invalid_batch_is_rejected(self):
+        """Errors are reported per item with the rules of the create endpoint, and nothing is written"""
+        items = self.items(1) + [
+            {"type": "poll", "author": "b"},
+            {"type": "job", "url": "ftp://example.com"},
+            {"id": self.scraped.pk, "title": "Mine now"},
+            {"id": 999999, "title": 5},
+        ]
+        response = self.client.post("/api/item/bulk/", items, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual(response.data[1], {"error": ["Type must be either 'story' or 'job'"]})
+        self.assertEqual(response.data[2], {"author": ["This field is required."],
+                                            "error": ["URL must start with 'http://' or 'https://'"]})
+        self.assertEqual(response.data[3], {"error": ["You can only update news that are posted."]})
+        self.assertEqual(set(response.data[4]), {"id", "title"})
+        self.assertFalse(News.objects.filter(title__startswith="Bulk").exists())
+        self.assertEqual(self.client.post("/api/item/bulk/", {"type": "story"}, format="json").status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_async_acknowledge(self):
+        """With ?async=true the validated batch is queued and acknowledged with 202"""
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, "task_always_eager", False)
+        response = self.client.post("/api/item/bulk/?async=true", self.items(3), format="json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["accepted"], 3)
+        self.assertEqual(News.objects.filter(title__startswith="Bulk").count(), 3)
+
+    def test_detail_writes_load_the_item_once(self):
+        """Update and delete check and write the same loaded item"""
+        with mock.patch.object(NewsItemDetailView, "get_object", autospec=True,
+                               side_effect=NewsItemDetailView.get_object) as get_object:
+            response = self.client.patch(f"/api/item/detail/{self.posted.pk}/", {"title": "Edited"}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(get_object.call_count, 1)
+            self.assertEqual(self.client.delete(f"/api/item/detail/{self.scraped.pk}/").status_code,
+                             status.HTTP_403_FORBIDDEN)
+            self.assertEqual(self.client.delete(f"/api/item/detail/{self.posted.pk}/").status_code,
+                             status.HTTP_204_NO_CONTENT)
+            self.assertEqual(get_object.call_count, 3)
+        self.assertFalse(News.objects.filter(pk=self.posted.pk).exists())
@@ -3,8 +3,13 @@ from .import views
 
 urlpatterns = [
     path('item/', views.NewsListAPIView.as_view(), name='item_list'),
+    path('item/feed/<str:feed>/', views.NewsFeedView.as_view(), name='item_feed'),
     path('item/create/', views.NewsItemCreateView.as_view(), name='create_item'),
+    path('item/bulk/', views.NewsBulkView.as_view(), name='bulk_items'),
     path('item/detail/<int:pk>/', views.NewsItemDetailView.as_view(), name='item_detail'),
+    path('item/detail/<int:pk>/thread/', views.NewsThreadView.as_view(), name='item_thread'),
+    path('item/export/', views.NewsExportView.as_view(), name='item_export'),
     path('item/comment/', views.CommentListAPIView.as_view(), name='comment_list'),
+    path('item/comment/export/', views.CommentExportView.as_view(), name='comment_export'),
     path("item/comment/detail/<int:comment_id>/", views.CommentDetailView.as_view(), name="comment-detail"),
 ]
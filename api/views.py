@@ -3,78 +3,222 @@ from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from rest_framework.response import Response
 from rest_framework import status
-from scraper.models import Comment, News
-from .serializers import NewsItemSerializer, NewsListSerializer, NewsDetailSerializer,CommentSerializer
-from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from scraper.models import Comment, FeedEntry, News
+from .serializers import NewsItemSerializer, NewsListSerializer, NewsDetailSerializer,CommentSerializer, CommentPageSerializer, CommentThreadSerializer
 from django.utils import timezone
-from django.http import Http404
+from django.conf import settings
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views import View
+from scraper.cache import bump_data_version
+from scraper.detail import load_comment_page
+from scraper.feeds import schedule_feed_update
+from scraper.search import record_search, search
+from scraper.tree import build_thread
+from .bulk import ITEM_FIELDS, stored_items, validate_items, write_items
+from .cache import CachedListMixin
+from .export import csv_lines, ndjson_lines
+from .filters import filter_bounds, filter_news
+from .pagination import CommentPagination, FeedPagination, NewsPagination
+from .projection import ValuesListMixin
+from .tasks import write_news_items
 
 
-class NewsListAPIView(generics.ListAPIView):
+class NewsListAPIView(CachedListMixin, ValuesListMixin, generics.ListAPIView):
     queryset = News.objects.all()
     serializer_class = NewsListSerializer
+    pagination_class = NewsPagination
 
     @swagger_auto_schema(
         manual_parameters=[
             openapi.Parameter('search', openapi.IN_QUERY, description="Search term", type=openapi.TYPE_STRING),
             openapi.Parameter('type', openapi.IN_QUERY, description="Type of item", type=openapi.TYPE_STRING),
+            openapi.Parameter('pagination', openapi.IN_QUERY, description="Set to 'cursor' for cursor pagination", type=openapi.TYPE_STRING),
+            openapi.Parameter('cursor', openapi.IN_QUERY, description="Cursor of the next page", type=openapi.TYPE_STRING),
+            openapi.Parameter('fields', openapi.IN_QUERY, description="Comma separated fields to return, e.g. id,title,score", type=openapi.TYPE_STRING),
+            openapi.Parameter('omit', openapi.IN_QUERY, description="Comma separated fields to leave out, e.g. text,kids", type=openapi.TYPE_STRING),
         ]
     )
     def get(self, request, *args, **kwargs):
+        if request.GET.get('search'):
+            record_search(request.GET['search'])
         return super().get(request, *args, **kwargs)
 
     def get_queryset(self):
         """
         Return the filtered queryset based on search and type filters.
         """
-        queryset = News.objects.all()
+        queryset = filter_news(News.objects.all(), self.request.GET)
 
-        # Filter by search term using Q objects to combine the conditions with OR
-        search_query = self.request.GET.get('search', '')
-        if search_query:
-            queryset = queryset.filter(
-                Q(title__icontains=search_query) | Q(text__icontains=search_query)
-            )
+        # Searches are ordered by relevance
+        if self.request.GET.get('search', ''):
+            return queryset
+        return queryset.order_by('-date_created', '-id')
 
-        # Filter by type
-        type_filter = self.request.GET.get('type', '')
-        if type_filter:
-            queryset = queryset.filter(type=type_filter)
 
-        return queryset
+class NewsFeedView(CachedListMixin, ValuesListMixin, generics.ListAPIView):
+    """
+    Stories in the order of a ranked feed kept up to date by the sync: "hot" (score decayed
+    by age), "top" (score) or "discussed" (comment count).
+    """
+    queryset = News.objects.all()
+    serializer_class = NewsListSerializer
+    pagination_class = FeedPagination
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('page', openapi.IN_QUERY, description="Page number", type=openapi.TYPE_INTEGER),
+            openapi.Parameter('fields', openapi.IN_QUERY, description="Comma separated fields to return, e.g. id,title,score", type=openapi.TYPE_STRING),
+            openapi.Parameter('omit', openapi.IN_QUERY, description="Comma separated fields to leave out, e.g. text,kids", type=openapi.TYPE_STRING),
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        if kwargs['feed'] not in dict(FeedEntry.FEEDS):
+            raise Http404("Unknown feed")
+        return super().get(request, *args, **kwargs)
 
 
 class NewsItemCreateView(generics.CreateAPIView):
     serializer_class = NewsItemSerializer
 
     def perform_create(self, serializer):
-        serializer.save()
+        news = serializer.save()
+        bump_data_version()
+        schedule_feed_update([news.pk])
+
+
+class NewsBulkView(generics.GenericAPIView):
+    """
+    Create and update posted items in batches: items with an `id` update that posted item,
+    the others are created. The batch is validated in one pass and written in one
+    transaction, or queued for a Celery worker with `?async=true`.
+    """
+
+    @swagger_auto_schema(
+        request_body=openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'id': openapi.Schema(type=openapi.TYPE_INTEGER, description="Posted item to update"),
+                **{name: openapi.Schema(type=openapi.TYPE_STRING) for name in ITEM_FIELDS},
+            },
+        )),
+        manual_parameters=[
+            openapi.Parameter('async', openapi.IN_QUERY, description="Set to 'true' to queue the write and return 202", type=openapi.TYPE_STRING),
+        ],
+    )
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError({"error": ["Expected a non-empty list of items."]})
+        if len(items) > settings.API_BULK_MAX_ITEMS:
+            raise ValidationError({"error": [f"Send at most {settings.API_BULK_MAX_ITEMS} items per request."]})
+
+        errors = validate_items(items, stored_items(items))
+        if any(errors):
+            raise ValidationError(errors)
+
+        if request.query_params.get('async') == 'true':
+            result = write_news_items.delay(items)
+            return Response({"task_id": result.id, "accepted": len(items)}, status=status.HTTP_202_ACCEPTED)
+        created, updated = write_items(items)
+        return Response({"created": created, "updated": updated}, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 
 class NewsItemDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = News.objects.all()
     serializer_class = NewsDetailSerializer
 
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('include', openapi.IN_QUERY, description="Set to 'comments' to add the first page of direct replies and their reply counts", type=openapi.TYPE_STRING),
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        data = self.get_serializer(instance).data
+        if request.query_params.get('include') == 'comments':
+            comments, data['comment_count'] = load_comment_page(instance)
+            data['comments'] = CommentPageSerializer(comments, many=True).data
+        return Response(data)
+
     def update(self, request, *args, **kwargs):
+        # The checked instance is updated as is: super().update() would load it a second time
         instance = self.get_object()
         if not instance.is_posted:
             return Response({"detail": "You can only update news that are posted."}, status=status.HTTP_403_FORBIDDEN)
         instance.date_created = timezone.now()
-        return super().update(request, *args, **kwargs)
+        serializer = self.get_serializer(instance, data=request.data, partial=kwargs.pop('partial', False))
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        return Response(serializer.data)
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         if not instance.is_posted:
             return Response({"detail": "You can only delete news that are posted."}, status=status.HTTP_403_FORBIDDEN)
-        return super().destroy(request, *args, **kwargs)
-    
-class CommentListAPIView(generics.ListAPIView):
+        self.perform_destroy(instance)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def perform_update(self, serializer):
+        news = serializer.save()
+        bump_data_version()
+        schedule_feed_update([news.pk])
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        bump_data_version()
+        # Refill the positions the deleted entries left in the feeds
+        schedule_feed_update([])
+
+
+class NewsThreadView(generics.RetrieveAPIView):
+    queryset = News.objects.all()
+
+    @swagger_auto_schema(
+        tags=['Comments'],
+        manual_parameters=[
+            openapi.Parameter('depth', openapi.IN_QUERY, description="Levels of replies to return", type=openapi.TYPE_INTEGER),
+            openapi.Parameter('breadth', openapi.IN_QUERY, description="Replies to return per comment", type=openapi.TYPE_INTEGER),
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Return a story with its comment thread as nested replies.
+        """
+        news = self.get_object()
+        try:
+            depth = int(request.GET.get('depth', 0))
+            breadth = int(request.GET.get('breadth', 0))
+        except ValueError:
+            return Response({"detail": "depth and breadth must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        comments, more_replies = build_thread(news.item_id, max_depth=depth, max_breadth=breadth)
+        return Response({
+            "item": NewsDetailSerializer(news).data,
+            "comments": CommentThreadSerializer(comments, many=True).data,
+            "more_replies": more_replies,
+        })
+
+
+class CommentListAPIView(CachedListMixin, ValuesListMixin, generics.ListAPIView):
     serializer_class = CommentSerializer
+    pagination_class = CommentPagination
 
     @swagger_auto_schema(
         tags=['Comments'],
         manual_parameters=[
+            openapi.Parameter('item_id', openapi.IN_QUERY, description="Hacker News ID of the story", type=openapi.TYPE_INTEGER),
             openapi.Parameter('text', openapi.IN_QUERY, description="Comment text", type=openapi.TYPE_STRING),
+            openapi.Parameter('pagination', openapi.IN_QUERY, description="Set to 'cursor' for cursor pagination", type=openapi.TYPE_STRING),
+            openapi.Parameter('cursor', openapi.IN_QUERY, description="Cursor of the next page", type=openapi.TYPE_STRING),
+            openapi.Parameter('fields', openapi.IN_QUERY, description="Comma separated fields to return, e.g. comment_id,author", type=openapi.TYPE_STRING),
+            openapi.Parameter('omit', openapi.IN_QUERY, description="Comma separated fields to leave out, e.g. text,kids", type=openapi.TYPE_STRING),
         ]
     )
     def get(self, request, *args, **kwargs):
@@ -89,11 +233,15 @@ class CommentListAPIView(generics.ListAPIView):
 
         filters = {}
         if item_id:
-            filters['news_id'] = item_id
-        if text_query:
-            filters['text__icontains'] = text_query
+            # Comments link to their story by its Hacker News ID, indexed with date_posted
+            if not item_id.isdigit():
+                raise ValidationError({"item_id": "Must be a Hacker News item ID."})
+            filters['news_id'] = int(item_id)
 
-        return Comment.objects.filter(**filters)
+        queryset = Comment.objects.filter(**filters)
+        if text_query:
+            return search(queryset, text_query)
+        return queryset.order_by('-date_posted', '-id')
 
 
 class CommentDetailView(generics.RetrieveAPIView):
@@ -111,3 +259,63 @@ class CommentDetailView(generics.RetrieveAPIView):
             return Comment.objects.get(comment_id=comment_id)
         except Comment.DoesNotExist:
             raise Http404("Comment not found")
+
+
+class ExportView(View):
+    """
+    Stream every matching row as NDJSON (default) or CSV (?format=csv).
+
+    Rows are read as tuples through a server-side cursor, EXPORT_CHUNK_SIZE at a
+    time, and sent as they are read, so memory use stays flat however large the
+    export is. They are ordered by Hacker News ID, so an interrupted export can be
+    resumed with ?since_id=<last ID received>.
+    """
+    model = None
+    key_field = None
+    time_field = None
+    fields = ()
+
+    def get_queryset(self):
+        return filter_bounds(self.model.objects.all(), self.request.GET, self.key_field, self.time_field)
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format', 'ndjson')
+        if export_format not in ('ndjson', 'csv'):
+            return JsonResponse({"detail": "format must be 'ndjson' or 'csv'."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            queryset = self.get_queryset()
+        except ValueError as e:
+            return JsonResponse({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        chunk_size = settings.EXPORT_CHUNK_SIZE
+        rows = queryset.order_by(self.key_field).values_list(*self.fields).iterator(chunk_size=chunk_size)
+        if export_format == 'csv':
+            response = StreamingHttpResponse(csv_lines(rows, self.fields, chunk_size), content_type='text/csv')
+        else:
+            response = StreamingHttpResponse(ndjson_lines(rows, self.fields, chunk_size), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="{self.model._meta.model_name}.{export_format}"'
+        return response
+
+
+class NewsExportView(ExportView):
+    model = News
+    key_field = 'item_id'
+    time_field = 'date_created'
+    fields = ('item_id', 'type', 'author', 'title', 'url', 'text', 'score', 'descendants', 'kids', 'date_created')
+
+    def get_queryset(self):
+        return filter_news(super().get_queryset(), self.request.GET)
+
+
+class CommentExportView(ExportView):
+    model = Comment
+    key_field = 'comment_id'
+    time_field = 'date_posted'
+    fields = ('comment_id', 'parent', 'news', 'depth', 'author', 'text', 'kids', 'date_posted')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        search_query = self.request.GET.get('search', '')
+        if search_query:
+            queryset = search(queryset, search_query)
+        return queryset
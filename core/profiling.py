@@ -0,0 +1,173 @@
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.db import connections
+from django.shortcuts import render
+from django.utils import timezone
+
+SLOWEST_KEY = "profiling:slowest"
+
+_current = ContextVar("request_profile", default=None)
+
+
+class RequestProfile:
+    """
+    Timings of one profiled request. `sections` holds seconds per named section
+    ("serialize", "render", ...); SQL time overlaps the sections it ran in.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.sections = Counter()
+        self.total = 0.0
+        self._open = set()
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    @property
+    def repeated_queries(self):
+        """
+        Queries whose SQL already ran in this request, the mark of an N+1 pattern.
+        """
+        return self.queries - len(self.statements)
+
+    def server_timing(self):
+        metrics = [f'sql;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries ({self.repeated_queries} repeated)"']
+        metrics += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.sections.items()]
+        metrics.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+@contextmanager
+def profile_section(name):
+    """
+    Add the time spent in the block to the current request's profile, if it is profiled.
+    Nested sections of the same name count once.
+    """
+    profile = _current.get()
+    if profile is None or name in profile._open:
+        yield
+        return
+    profile._open.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[name] += time.perf_counter() - started
+        profile._open.discard(name)
+
+
+class ProfilingMiddleware:
+    """
+    Profile a share PROFILING_SAMPLE_RATE of requests, plus requests sent with an X-Profile header
+    equal to PROFILING_TOKEN or by a staff user.
+
+    Profiled responses get a Server-Timing header with the SQL query count and time, the time of
+    each profiled section (serializers, template rendering) and the total time; the slowest
+    PROFILING_SLOWEST of them are kept for the "Slow requests" admin page. Streaming responses
+    are timed up to their first byte.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        profile = request.profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.record_query))
+                started = time.perf_counter()
+                response = self.get_response(request)
+                profile.total = time.perf_counter() - started
+        finally:
+            _current.reset(token)
+
+        response["Server-Timing"] = profile.server_timing()
+        record_request(request, response, profile)
+        return response
+
+    def process_template_response(self, request, response):
+        profile = getattr(request, "profile", None)
+        if profile is not None:
+            # Template and DRF responses are rendered after the view returns
+            started = time.perf_counter()
+
+            def rendered(response):
+                profile.sections["render"] += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def should_profile(self, request):
+        header = request.headers.get("X-Profile")
+        if header:
+            if settings.PROFILING_TOKEN and header == settings.PROFILING_TOKEN:
+                return True
+            user = getattr(request, "user", None)
+            if user is not None and user.is_staff:
+                return True
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def record_request(request, response, profile):
+    """
+    Keep the request in the cached list of the slowest profiled requests if it is slow enough.
+    Requests finishing together read and rewrite the same cache entry, so one of them may
+    be missing from the list; it is a sample for the admin page, not a log.
+    """
+    limit = settings.PROFILING_SLOWEST
+    slowest = cache.get(SLOWEST_KEY, [])
+    if len(slowest) >= limit and profile.total <= slowest[-1]["total_ms"] / 1000:
+        return
+    match = request.resolver_match
+    sql, repeats = profile.statements.most_common(1)[0] if profile.statements else ("", 0)
+    slowest.append({
+        "time": timezone.now(),
+        "method": request.method,
+        "path": request.get_full_path()[:500],
+        "view": match.view_name if match else "",
+        "status": response.status_code,
+        "total_ms": profile.total * 1000,
+        "sql_ms": profile.sql_time * 1000,
+        "queries": profile.queries,
+        "repeated_queries": profile.repeated_queries,
+        "most_repeated_sql": sql[:500] if repeats > 1 else "",
+        "sections_ms": {name: seconds * 1000 for name, seconds in profile.sections.items()},
+    })
+    slowest.sort(key=lambda entry: entry["total_ms"], reverse=True)
+    cache.set(SLOWEST_KEY, slowest[:limit], None)
+
+
+def slow_requests_view(request):
+    """
+    Admin page listing the slowest profiled requests.
+    """
+    if request.method == "POST":
+        cache.delete(SLOWEST_KEY)
+    context = {
+        **admin.site.each_context(request),
+        "title": "Slow requests",
+        "requests": cache.get(SLOWEST_KEY, []),
+        "sample_rate": settings.PROFILING_SAMPLE_RATE,
+    }
+    return render(request, "admin/slow_requests.html", context)
@@ -57,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -109,6 +110,27 @@ else:
     }     
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Shared between web and Celery workers, so production uses Redis
+
+if DEBUG == True:
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': config('CACHE_URL', default=config('REDIS_URL')),
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -161,6 +183,16 @@ REDOC_SETTINGS = {
    'LAZY_RENDERING': False,
 }
 
+API_CACHE_TIMEOUT = config('API_CACHE_TIMEOUT', default=3600, cast=int)  # seconds; pages are invalidated by each sync anyway
+HTML_CACHE_TIMEOUT = config('HTML_CACHE_TIMEOUT', default=3600, cast=int)  # seconds a rendered HTML page is kept, 0 disables
+HTML_CACHE_STALE_WHILE_REVALIDATE = config('HTML_CACHE_STALE_WHILE_REVALIDATE', default=True, cast=bool)  # serve stale pages while a task renders them
+API_BULK_MAX_ITEMS = config('API_BULK_MAX_ITEMS', default=5000, cast=int)  # items per bulk write request
+API_BULK_BATCH_SIZE = config('API_BULK_BATCH_SIZE', default=500, cast=int)  # rows per INSERT / UPDATE of a bulk write
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.0, cast=float)  # share of requests profiled, 0 to 1
+PROFILING_TOKEN = config('PROFILING_TOKEN', default='')  # X-Profile header value that profiles a request; staff users need none
+PROFILING_SLOWEST = config('PROFILING_SLOWEST', default=50, cast=int)  # slowest profiled requests kept for the admin page
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)  # rows fetched and sent at a time by the export views
+
 REST_FRAMEWORK = {
     'NON_FIELD_ERRORS_KEY' : 'error',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -182,3 +214,42 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': crontab(minute=f"*/{CELERY_CRONTAB_MINUTE}"),
     },
 }
+
+
+# Hacker News API
+HN_SYNC_MODE = config('HN_SYNC_MODE', default='latest')  # 'latest' or 'incremental'
+HN_SYNC_MAX_NEW_ITEMS = config('HN_SYNC_MAX_NEW_ITEMS', default=5000, cast=int)  # incremental mode, per run
+HN_API_BASE_URL = config('HN_API_BASE_URL', default='https://hacker-news.firebaseio.com/v0')
+HN_FETCH_CONCURRENCY = config('HN_FETCH_CONCURRENCY', default=200, cast=int)  # max requests in flight per sync subtask
+HN_RATE_LIMIT = config('HN_RATE_LIMIT', default=500, cast=float)  # requests per second per host for a whole sync run, 0 disables
+HN_CONNECT_TIMEOUT = config('HN_CONNECT_TIMEOUT', default=3.0, cast=float)  # seconds
+HN_READ_TIMEOUT = config('HN_READ_TIMEOUT', default=10.0, cast=float)  # seconds
+HN_FETCH_RETRIES = config('HN_FETCH_RETRIES', default=3, cast=int)  # retries for timeouts, 429 and 5xx
+HN_RETRY_BACKOFF = config('HN_RETRY_BACKOFF', default=0.5, cast=float)  # base of the jittered exponential backoff, seconds
+HN_ERROR_BUDGET = config('HN_ERROR_BUDGET', default=200, cast=int)  # failed requests before a run stops, across all its subtasks
+HN_CIRCUIT_BREAKER_THRESHOLD = config('HN_CIRCUIT_BREAKER_THRESHOLD', default=20, cast=int)  # consecutive failures of a subtask that stop the whole run
+HN_CIRCUIT_BREAKER_COOLDOWN = config('HN_CIRCUIT_BREAKER_COOLDOWN', default=30.0, cast=float)  # seconds
+HN_DEAD_LETTER_LIMIT = config('HN_DEAD_LETTER_LIMIT', default=10000, cast=int)  # failed IDs kept for the next run
+HN_CRAWL_FRONTIER_SIZE = config('HN_CRAWL_FRONTIER_SIZE', default=10000, cast=int)  # queued item IDs
+HN_CRAWL_MAX_IN_FLIGHT = config('HN_CRAWL_MAX_IN_FLIGHT', default=1000, cast=int)  # fetched items awaiting a write
+HN_WRITE_BATCH_SIZE = config('HN_WRITE_BATCH_SIZE', default=500, cast=int)  # rows per bulk write
+HN_WRITE_FLUSH_INTERVAL = config('HN_WRITE_FLUSH_INTERVAL', default=2.0, cast=float)  # seconds between flushes
+HN_SYNC_STORIES_PER_TASK = config('HN_SYNC_STORIES_PER_TASK', default=5, cast=int)  # latest mode, stories per subtask
+HN_SYNC_ITEMS_PER_TASK = config('HN_SYNC_ITEMS_PER_TASK', default=500, cast=int)  # incremental mode, items per subtask
+HN_SYNC_CLAIM_TTL = config('HN_SYNC_CLAIM_TTL', default=900, cast=int)  # seconds an item stays claimed by a run
+HN_SYNC_LEASE_URL = config('HN_SYNC_LEASE_URL', default=CELERY_BROKER_URL)  # Redis holding the sync lease
+HN_SYNC_LEASE_TTL = config('HN_SYNC_LEASE_TTL', default=120, cast=int)  # seconds without a heartbeat before takeover
+HN_SYNC_COALESCE = config('HN_SYNC_COALESCE', default='skip')  # 'skip' or 'queue' ticks that overlap a run
+HN_THREAD_MAX_DEPTH = config('HN_THREAD_MAX_DEPTH', default=20, cast=int)  # levels of replies returned by the thread views
+HN_THREAD_MAX_BREADTH = config('HN_THREAD_MAX_BREADTH', default=100, cast=int)  # replies shown per comment
+HN_THREAD_MAX_COMMENTS = config('HN_THREAD_MAX_COMMENTS', default=2000, cast=int)  # rows loaded per thread
+HN_DETAIL_COMMENTS = config('HN_DETAIL_COMMENTS', default=30, cast=int)  # direct replies shown on a story page
+HN_FEED_SIZE = config('HN_FEED_SIZE', default=500, cast=int)  # items kept in each ranked feed
+HN_FEED_GRAVITY = config('HN_FEED_GRAVITY', default=1.8, cast=float)  # how fast stories sink in the hot feed
+HN_FEED_HOT_WINDOW = config('HN_FEED_HOT_WINDOW', default=72, cast=int)  # hours of stories ranked in the hot feed
+HN_WARM_BUDGET = config('HN_WARM_BUDGET', default=20, cast=float)  # seconds spent warming caches after a sync, 0 disables
+HN_WARM_CONCURRENCY = config('HN_WARM_CONCURRENCY', default=4, cast=int)  # pages rendered at once
+HN_WARM_PAGES = config('HN_WARM_PAGES', default=3, cast=int)  # list and feed pages warmed
+HN_WARM_STORIES = config('HN_WARM_STORIES', default=30, cast=int)  # top story pages warmed
+HN_WARM_SEARCHES = config('HN_WARM_SEARCHES', default=10, cast=int)  # popular searches warmed
+HN_WARM_BASE_URL = config('HN_WARM_BASE_URL', default='')  # public scheme and host of the API, e.g. https://news.example.com; API pages are only warmed when set
@@ -22,6 +22,7 @@ from drf_yasg import openapi
 from django.views.generic import RedirectView
 from django.conf import settings
 from django.conf.urls.static import static
+from .profiling import slow_requests_view
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -42,6 +43,7 @@ urlpatterns = [
     path('api/api.json/', schema_view.without_ui(cache_timeout=0), name='schema-swagger-ui'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('admin/profiling/', admin.site.admin_view(slow_requests_view), name='slow_requests'),
     path('admin/', admin.site.urls), 
     path('api/',include('api.urls')),
     path('',include('scraper.urls')),
@@ -1,3 +1,10 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import SyncRun
+
+
+@admin.register(SyncRun)
+class SyncRunAdmin(admin.ModelAdmin):
+    list_display = ('mode', 'started_at', 'wall_time', 'items_fetched', 'created', 'updated', 'failed', 'requests', 'write_time')
+    list_filter = ('mode',)
+    ordering = ('-started_at',)
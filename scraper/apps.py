@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ScraperConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'scraper'
+
+    def ready(self):
+        post_migrate.connect(restore_search_triggers, sender=self)
+
+
+def restore_search_triggers(using, **kwargs):
+    """
+    Restore the SQLite search triggers after migrations, see scraper.search.
+    """
+    from django.db import connections
+    from .search import restore_search_triggers
+    restore_search_triggers(connections[using])
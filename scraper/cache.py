@@ -0,0 +1,30 @@
+import time
+
+from django.core.cache import cache
+
+DATA_VERSION_KEY = "data:version"
+
+
+def get_data_version():
+    """
+    Current version of the scraped data. Cache keys that include it are
+    invalidated all at once when the version is bumped.
+    """
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a version lost to eviction never repeats an older one
+        cache.add(DATA_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(DATA_VERSION_KEY)
+    return version
+
+
+def bump_data_version():
+    """
+    Mark all cached pages as stale. Called whenever News or Comment rows change.
+    """
+    get_data_version()
+    try:
+        return cache.incr(DATA_VERSION_KEY)
+    except ValueError:
+        # Evicted between the two calls
+        return get_data_version()
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import random
+import time
+from urllib.parse import urlsplit
+
+import httpx
+from django.conf import settings
+
+from .metrics import RequestMetrics
+
+logger = logging.getLogger(__name__)
+# httpx logs every request at INFO, which floods the worker log during a sync
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+class RateLimiter:
+    """
+    Token bucket limiting how many requests per second are sent to one host.
+    A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    Token bucket shared by every process of a run through RunLimits. Tokens are taken from
+    Redis a tenth of a second's worth at a time, so most requests do not wait on Redis.
+    """
+
+    def __init__(self, rate, run_limits, host):
+        super().__init__(rate)
+        self.run_limits = run_limits
+        self.host = host
+        self.batch = max(1, int(rate / 10))
+        self.tokens = 0
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self.lock:
+            while self.tokens < 1:
+                self.tokens += self.run_limits.take_tokens(self.host, self.rate, self.capacity, self.batch)
+                if self.tokens < 1:
+                    await asyncio.sleep(self.batch / self.rate)
+            self.tokens -= 1
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request once the upstream is considered degraded.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures. While open, calls are refused
+    until `cooldown` seconds have passed; then trial calls are let through and
+    the first success closes it again.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        return self.opened_at is None or time.monotonic() - self.opened_at >= self.cooldown
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class HackerNewsClient:
+    """
+    Async Hacker News API client.
+
+    All requests share one keep-alive connection pool, at most `concurrency`
+    requests are in flight at once and each host is throttled to `rate_limit`
+    requests per second.
+
+    Timeouts, 429 and 5xx responses are retried with jittered exponential
+    backoff. Response times and statuses of every attempt are recorded in
+    `metrics`. Requests that still fail count against the error budget and are
+    remembered in `failed_ids`. Once the budget is spent or the circuit breaker
+    opens, requests raise CircuitOpenError so the caller can stop early.
+
+    With `run_limits` (a RunLimits) the error budget, the circuit breaker and the
+    rate limit are shared with the other clients of the same run. Failures of the
+    other clients are seen within RUN_LIMITS_REFRESH seconds.
+
+    Use it as an async context manager:
+
+        async with HackerNewsClient() as client:
+            items = await client.fetch_items([1, 2, 3])
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    RUN_LIMITS_REFRESH = 0.5  # seconds
+
+    def __init__(self, base_url=None, concurrency=None, rate_limit=None, retries=None, backoff=None, error_budget=None,
+                 run_limits=None):
+        self.base_url = (base_url or settings.HN_API_BASE_URL).rstrip("/")
+        self.concurrency = concurrency or settings.HN_FETCH_CONCURRENCY
+        self.rate_limit = settings.HN_RATE_LIMIT if rate_limit is None else rate_limit
+        self.retries = settings.HN_FETCH_RETRIES if retries is None else retries
+        self.backoff = settings.HN_RETRY_BACKOFF if backoff is None else backoff
+        self.error_budget = settings.HN_ERROR_BUDGET if error_budget is None else error_budget
+        self.timeout = httpx.Timeout(settings.HN_READ_TIMEOUT, connect=settings.HN_CONNECT_TIMEOUT)
+        self.breaker = CircuitBreaker(settings.HN_CIRCUIT_BREAKER_THRESHOLD, settings.HN_CIRCUIT_BREAKER_COOLDOWN)
+        self.requests_sent = 0
+        self.errors = 0
+        self.failed_ids = []
+        self.metrics = RequestMetrics()
+        self.run_limits = run_limits
+        self._run_errors = 0
+        self._run_circuit_open = False
+        self._run_checked_at = None
+        self._limiters = {}
+        self._semaphore = None
+        self._http = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency,
+            ),
+            timeout=self.timeout,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._http.aclose()
+
+    def _limiter_for(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._limiters:
+            if self.run_limits:
+                self._limiters[host] = SharedRateLimiter(self.rate_limit, self.run_limits, host)
+            else:
+                self._limiters[host] = RateLimiter(self.rate_limit)
+        return self._limiters[host]
+
+    def _check_run_limits(self):
+        now = time.monotonic()
+        if self.run_limits and (self._run_checked_at is None or now - self._run_checked_at >= self.RUN_LIMITS_REFRESH):
+            self._run_errors, self._run_circuit_open = self.run_limits.state()
+            self._run_checked_at = now
+
+    def _record_error(self):
+        self.errors += 1
+        if self.run_limits:
+            self._run_errors = self.run_limits.add_error()
+
+    def _record_failure(self):
+        self.breaker.record_failure()
+        if self.run_limits and self.breaker.failures >= self.breaker.threshold:
+            self.run_limits.open_circuit(self.breaker.cooldown)
+            self._run_circuit_open = True
+
+    async def get_json(self, path):
+        """
+        GET `path` relative to the API base URL and decode the JSON body, retrying transient errors.
+        """
+        url = f"{self.base_url}/{path}"
+        for attempt in range(self.retries + 1):
+            self._check_run_limits()
+            if max(self.errors, self._run_errors) >= self.error_budget:
+                raise CircuitOpenError(f"Error budget of {self.error_budget} failed requests exhausted")
+            if not self.breaker.allow() or self._run_circuit_open:
+                raise CircuitOpenError(f"Circuit breaker open after {self.breaker.failures} consecutive failures")
+            waiting = time.monotonic()
+            try:
+                async with self._semaphore:
+                    await self._limiter_for(url).acquire()
+                    started = time.monotonic()
+                    self.metrics.wait_time += started - waiting
+                    try:
+                        response = await self._http.get(url)
+                    except httpx.TransportError:
+                        self.metrics.observe(path, "error", time.monotonic() - started)
+                        raise
+                    self.metrics.observe(path, response.status_code, time.monotonic() - started)
+                    self.requests_sent += 1
+                response.raise_for_status()
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code not in self.RETRY_STATUSES:
+                    self._record_error()
+                    raise
+                self._record_failure()
+                if attempt == self.retries:
+                    self._record_error()
+                    raise
+                await asyncio.sleep(self._backoff_delay(attempt))
+            else:
+                self.breaker.record_success()
+                return response.json()
+
+    def _backoff_delay(self, attempt):
+        # Full jitter: a random delay up to the exponential backoff, capped at 30s
+        return random.uniform(0, min(30.0, self.backoff * 2 ** attempt))
+
+    async def fetch_story_ids(self, category, limit=100):
+        """
+        Fetch the first `limit` item IDs of a category.
+        :param category: "newstories" for news, "jobstories" for jobs
+        """
+        try:
+            return (await self.get_json(f"{category}.json") or [])[:limit]
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Error fetching {category}: {str(e)}")
+            return []
+
+    async def fetch_item(self, item_id):
+        """
+        Fetch a single item, returning None if it is missing or the request fails.
+        Failed IDs are recorded in `failed_ids`.
+        """
+        try:
+            return await self.get_json(f"item/{item_id}.json")
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Error fetching item {item_id}: {str(e)}")
+            self.failed_ids.append(item_id)
+            return None
+
+    async def fetch_items(self, item_ids):
+        """
+        Fetch many items concurrently, preserving the order of `item_ids`.
+        """
+        return await asyncio.gather(*(self.fetch_item(item_id) for item_id in item_ids))
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .client import CircuitOpenError, HackerNewsClient
+from .metrics import SIZE_BUCKETS, histogram_of
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class CrawlStats:
+    """
+    Counters describing the shape of a crawl.
+    """
+
+    def __init__(self):
+        self.stories = 0
+        self.comments = 0
+        self.skipped = 0
+        self.subtrees_skipped = 0
+        self.failed = 0
+        self.circuit_open = False
+        self.requests = 0
+        self.width = Counter()  # items fetched per depth
+        self.frontier_peak = 0
+        self.in_flight_peak = 0
+        self.comments_per_story = Counter()  # comments fetched per story whose tree was crawled
+        self.request_metrics = {}  # response times and statuses from HackerNewsClient.metrics
+
+    @property
+    def max_depth(self):
+        return max(self.width, default=0)
+
+    @property
+    def max_width(self):
+        return max(self.width.values(), default=0)
+
+    def as_dict(self):
+        return {
+            "stories": self.stories,
+            "comments": self.comments,
+            "skipped": self.skipped,
+            "subtrees_skipped": self.subtrees_skipped,
+            "failed": self.failed,
+            "circuit_open": self.circuit_open,
+            "requests": self.requests,
+            "max_depth": self.max_depth,
+            "max_width": self.max_width,
+            "width": dict(sorted(self.width.items())),
+            "frontier_peak": self.frontier_peak,
+            "in_flight_peak": self.in_flight_peak,
+            "comments_per_story": histogram_of(self.comments_per_story.values(), SIZE_BUCKETS),
+            **self.request_metrics,
+        }
+
+
+class StoryCrawler:
+    """
+    Breadth-first crawler for stories and their whole comment trees.
+
+    One event loop thread runs a fixed set of worker coroutines that pull item
+    IDs from a single bounded frontier queue. Fetched items are handed to the
+    calling thread through `crawl()`, so database writes stay on the caller's
+    connection. Resource use is bounded regardless of tree size:
+
+    * threads: the loop thread plus one resolver thread,
+    * requests in flight: `workers`,
+    * queued IDs: `frontier_size`,
+    * fetched items not yet consumed by the caller: `max_in_flight`.
+
+    When the frontier is full a worker crawls the overflowing kids itself
+    instead of waiting, so producers never block on their own queue.
+
+    If the client's circuit breaker opens the crawl stops early. IDs that
+    failed or were never visited are left in `failed_ids` for a later retry.
+    """
+
+    def __init__(self, workers=None, frontier_size=None, max_in_flight=None, client_kwargs=None):
+        self.workers = workers or settings.HN_FETCH_CONCURRENCY
+        self.frontier_size = frontier_size or settings.HN_CRAWL_FRONTIER_SIZE
+        self.max_in_flight = max_in_flight or settings.HN_CRAWL_MAX_IN_FLIGHT
+        self.client_kwargs = client_kwargs or {}
+        self.stats = CrawlStats()
+
+    def crawl(self, story_ids, follow_kids=True, known_trees=None):
+        """
+        Crawl `story_ids` and yield `(depth, item)` pairs in the calling thread.
+        Stories have depth 0, top-level comments depth 1 and so on. Deleted and
+        dead comments are skipped together with their replies.
+        :param follow_kids: Set to False to fetch only the given items
+        :param known_trees: Stored `{story_id: (descendants, kids)}`; the comments of
+            a story whose descendants count and kids list still match are not crawled
+        """
+        self.stats = CrawlStats()
+        self.failed_ids = []
+        self.unvisited = []
+        self.follow_kids = follow_kids
+        self.known_trees = known_trees or {}
+        results = queue.Queue()
+        loop = asyncio.new_event_loop()
+        # getaddrinfo runs in the default executor; cap it at one thread
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=1, thread_name_prefix="hn-resolver"))
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._held = 0
+        self._cancelled = False
+
+        def run():
+            try:
+                loop.run_until_complete(self._crawl(list(story_ids), results))
+            except BaseException as e:
+                results.put(e)
+            finally:
+                results.put(_DONE)
+                loop.close()
+
+        def release():
+            try:
+                loop.call_soon_threadsafe(self._release)
+            except RuntimeError:
+                pass  # the loop already finished
+
+        thread = threading.Thread(target=run, name="hn-crawler", daemon=True)
+        thread.start()
+        finished = False
+        try:
+            while True:
+                entry = results.get()
+                if entry is _DONE:
+                    finished = True
+                    break
+                if isinstance(entry, BaseException):
+                    raise entry
+                try:
+                    yield entry
+                finally:
+                    release()
+        finally:
+            # If the caller stopped early, stop fetching and drain so the loop can finish
+            self._cancelled = not finished
+            while not finished:
+                entry = results.get()
+                if entry is _DONE:
+                    finished = True
+                elif not isinstance(entry, BaseException):
+                    release()
+            thread.join()
+
+        logger.info(f"Crawl finished: {self.stats.as_dict()}")
+
+    def _release(self):
+        self._held -= 1
+        self._in_flight.release()
+
+    async def _crawl(self, story_ids, results):
+        frontier = asyncio.Queue(maxsize=self.frontier_size)
+        async with HackerNewsClient(concurrency=self.workers, **self.client_kwargs) as client:
+            workers = [
+                asyncio.create_task(self._worker(client, frontier, results))
+                for _ in range(self.workers)
+            ]
+            for story_id in story_ids:
+                await frontier.put((story_id, 0, story_id))
+            await frontier.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self.stats.requests = client.requests_sent
+            self.stats.request_metrics = client.metrics.as_dict()
+            self.failed_ids = client.failed_ids + self.unvisited
+            self.stats.failed = len(self.failed_ids)
+
+    async def _worker(self, client, frontier, results):
+        while True:
+            item_id, depth, story_id = await frontier.get()
+            try:
+                await self._visit(client, frontier, results, item_id, depth, story_id)
+            except Exception as e:
+                logger.error(f"Error crawling item {item_id}: {str(e)}")
+            finally:
+                frontier.task_done()
+
+    async def _visit(self, client, frontier, results, item_id, depth, story_id):
+        if self._cancelled:
+            self.unvisited.append(item_id)
+            return
+        await self._in_flight.acquire()
+        self._held += 1
+        self.stats.in_flight_peak = max(self.stats.in_flight_peak, self._held)
+        try:
+            item = await client.fetch_item(item_id)
+        except CircuitOpenError as e:
+            self._release()
+            if not self._cancelled:
+                logger.warning(f"Stopping crawl early: {str(e)}")
+            self._cancelled = True
+            self.stats.circuit_open = True
+            self.unvisited.append(item_id)
+            return
+        except BaseException:
+            self._release()
+            raise
+        is_comment = depth > 0 or item and item.get("type") == "comment"
+        if not item or (is_comment and (item.get("deleted") or item.get("dead"))):
+            if item:
+                self.stats.skipped += 1
+            self._release()
+            return
+
+        if is_comment:
+            self.stats.comments += 1
+            if depth:
+                self.stats.comments_per_story[story_id] += 1
+        else:
+            self.stats.stories += 1
+        self.stats.width[depth] += 1
+        results.put((depth, item))
+
+        kids = item.get("kids", []) if self.follow_kids else []
+        if kids and not depth and self.known_trees.get(item_id) == (item.get("descendants", 0), kids):
+            self.stats.subtrees_skipped += 1
+            kids = []
+        elif self.follow_kids and not is_comment:
+            self.stats.comments_per_story[item_id] += 0
+
+        overflow = []
+        for kid in kids:
+            try:
+                frontier.put_nowait((kid, depth + 1, story_id))
+            except asyncio.QueueFull:
+                overflow.append(kid)
+        self.stats.frontier_peak = max(self.stats.frontier_peak, frontier.qsize())
+        for kid in overflow:
+            await self._visit(client, frontier, results, kid, depth + 1, story_id)
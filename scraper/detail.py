@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.template.loader import render_to_string
+
+from .cache import get_data_version
+from .models import Comment
+
+
+def load_comment_page(news, limit=None):
+    """
+    Load the first page of a story's direct replies with their counts, in two queries.
+
+    Replies are in Hacker News rank order (the story's kids) when the story has them, and
+    oldest first otherwise. Each returned comment has `reply_count`, its number of stored
+    direct replies, and `news` set to the loaded story. The story's own reply count comes
+    from the same aggregate query.
+    :param news: The story, already loaded
+    :param limit: Most comments returned, capped by HN_DETAIL_COMMENTS
+    :return: (comments, number of direct replies of the story)
+    """
+    limit = min(limit or settings.HN_DETAIL_COMMENTS, settings.HN_DETAIL_COMMENTS)
+    if news.item_id is None:
+        return [], 0
+
+    replies = Comment.objects.filter(parent=news.item_id)
+    if news.kids:
+        ranked = {comment_id: rank for rank, comment_id in enumerate(news.kids[:limit])}
+        comments = sorted(replies.filter(comment_id__in=ranked), key=lambda comment: ranked[comment.comment_id])
+    else:
+        comments = list(replies.order_by('date_posted', 'id')[:limit])
+
+    shown = [comment.comment_id for comment in comments]
+    counts = dict(
+        Comment.objects.filter(Q(parent=news.item_id) | Q(parent__in=shown))
+        .values_list('parent').annotate(replies=Count('id')).order_by()
+    )
+    for comment in comments:
+        if comment.news_id == news.item_id:
+            comment.news = news
+        comment.reply_count = counts.get(comment.comment_id, 0)
+    return comments, counts.get(news.item_id, 0)
+
+
+def render_comment_page(news):
+    """
+    Rendered first page of a story's comments, cached per data version: an edited or deleted
+    comment changes neither the story's kids nor its descendants, but the sync writing it
+    bumps the data version.
+    :return: (HTML fragment, number of direct replies of the story)
+    """
+    key = f"detail:comments:{news.pk}:{get_data_version()}"
+    fragment = cache.get(key)
+    if fragment is None:
+        comments, comment_count = load_comment_page(news)
+        html = render_to_string('news_comments.html', {
+            'comments': comments,
+            'more_comments': max(0, comment_count - len(comments)),
+        })
+        fragment = {'html': html, 'comment_count': comment_count}
+        cache.set(key, fragment, settings.API_CACHE_TIMEOUT)
+    return fragment['html'], fragment['comment_count']
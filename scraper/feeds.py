@@ -0,0 +1,125 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import FeedEntry, News
+
+logger = logging.getLogger(__name__)
+
+RANK_FIELDS = ("id", "score", "descendants", "date_created")
+# Field ranking the incrementally maintained feeds
+FEED_FIELDS = {FeedEntry.TOP: "score", FeedEntry.DISCUSSED: "descendants"}
+
+
+def hot_rank(score, date_created, now):
+    """
+    Hacker News style gravity: (score - 1) / (age in hours + 2) ^ HN_FEED_GRAVITY.
+    """
+    age = max(0.0, (now - date_created).total_seconds() / 3600) if date_created else settings.HN_FEED_HOT_WINDOW
+    return ((score or 0) - 1) / (age + 2) ** settings.HN_FEED_GRAVITY
+
+
+def update_feeds(changed=None):
+    """
+    Recompute the ranked feeds stored as FeedEntry positions.
+
+    The hot feed is reranked from the stories of the last HN_FEED_HOT_WINDOW hours, since
+    every rank decays with age. The top and most discussed feeds are merged incrementally:
+    only the current entries and the changed stories are ranked again. Stories outside a
+    feed rank no higher than its stored last entry, so a feed is refilled from the best
+    stored rows when it is still empty, when the merge leaves it short (a story was deleted)
+    or when its last entry ranks lower than before (a story dropped). A feed is only
+    rewritten when its order changed.
+    :param changed: News queryset of created or updated stories, None to rebuild every feed
+    :return: The names of the rewritten feeds
+    """
+    now = timezone.now()
+    changed_rows = list(changed.values_list(*RANK_FIELDS)) if changed is not None else None
+    rewritten = []
+
+    recent = News.objects.filter(date_created__gte=now - timedelta(hours=settings.HN_FEED_HOT_WINDOW))
+    hot = [(hot_rank(score, date_created, now), pk) for pk, score, _, date_created in recent.values_list(*RANK_FIELDS)]
+    if write_feed(FeedEntry.HOT, hot):
+        rewritten.append(FeedEntry.HOT)
+
+    for feed, field in FEED_FIELDS.items():
+        value = RANK_FIELDS.index(field)
+        entries = list(
+            News.objects.filter(feed_entries__feed=feed).order_by("feed_entries__position")
+            .values_list(*RANK_FIELDS, "feed_entries__rank")
+        )
+        ranked = None
+        if changed_rows is not None and entries:
+            ranked = best_ranked([(row[value] or 0, row[0]) for row in entries + changed_rows])
+            if len(ranked) < settings.HN_FEED_SIZE or ranked[-1] < (entries[-1][-1], entries[-1][0]):
+                ranked = None
+        if ranked is None:
+            ordered = News.objects.order_by(F(field).desc(nulls_last=True), "-id")
+            ranked = [(rank or 0, pk) for pk, rank in ordered.values_list("id", field)[:settings.HN_FEED_SIZE]]
+        if write_feed(feed, ranked, stored=[row[0] for row in entries]):
+            rewritten.append(feed)
+
+    if rewritten:
+        logger.info(f"Updated feeds: {', '.join(rewritten)}")
+    return rewritten
+
+
+def schedule_feed_update(news_ids):
+    """
+    Queue the merge of stories written through the API into the ranked feeds, so the
+    request does not wait for the reranking.
+    :param news_ids: pks of the created or updated stories, none after a delete
+    """
+    # tasks needs update_feeds from here at import time, so the task is looked up per call
+    from .tasks import update_ranked_feeds
+    try:
+        update_ranked_feeds.delay(list(news_ids))
+    except Exception as e:
+        logger.error(f"Error queueing the feed update: {str(e)}")
+
+
+def best_ranked(ranked):
+    """
+    The best HN_FEED_SIZE of (rank, News pk) pairs, highest rank first; ties go to the newer row.
+    A pk ranked twice keeps its last rank.
+    """
+    ranks = {pk: rank for rank, pk in ranked}
+    return sorted(((rank, pk) for pk, rank in ranks.items()), reverse=True)[:settings.HN_FEED_SIZE]
+
+
+def write_feed(feed, ranked, stored=None):
+    """
+    Store the best HN_FEED_SIZE of `ranked` as the positions of a feed, highest rank first.
+    :param ranked: (rank, News pk) pairs, see best_ranked
+    :param stored: News pks of the feed in their stored order, if already loaded
+    :return: Whether the stored order changed
+    """
+    best = best_ranked(ranked)
+    if stored is None:
+        stored = list(FeedEntry.objects.filter(feed=feed).order_by("position").values_list("news_id", flat=True))
+    if stored == [pk for _, pk in best]:
+        return False
+
+    with transaction.atomic():
+        lock_feed(feed)
+        FeedEntry.objects.filter(feed=feed).delete()
+        FeedEntry.objects.bulk_create([
+            FeedEntry(feed=feed, position=position, news_id=pk, rank=rank)
+            for position, (rank, pk) in enumerate(best, start=1)
+        ])
+    return True
+
+
+def lock_feed(feed):
+    """
+    Wait in the current transaction until no other one rewrites `feed`: the sync and the
+    API's feed updates may rewrite the same feed at once, and two interleaved rewrites
+    would both insert its positions. SQLite serializes writers by itself.
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [f"feed:{feed}"])
@@ -0,0 +1,169 @@
+import logging
+import time
+import uuid
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+# Only the holder of the token may extend or drop the lease
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Token bucket refilled by the Redis clock, which every worker of a run shares
+TAKE_TOKENS_SCRIPT = """
+local rate, capacity, count, ttl = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local clock = redis.call('time')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('hmget', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local granted = math.min(count, math.floor(tokens))
+redis.call('hset', KEYS[1], 'tokens', string.format('%.6f', tokens - granted))
+redis.call('hset', KEYS[1], 'updated', string.format('%.6f', now))
+redis.call('expire', KEYS[1], ttl)
+return granted
+"""
+
+
+def redis_client():
+    """
+    Shared Redis client for leases (HN_SYNC_LEASE_URL, the Celery broker by default).
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.HN_SYNC_LEASE_URL)
+    return _client
+
+
+class Lease:
+    """
+    A named, expiring lease held in Redis.
+
+    `acquire()` sets the key only if nobody holds it, with a TTL. The holder
+    keeps it alive with `heartbeat()`; a holder that dies stops renewing, so
+    its lease expires after `ttl` seconds and the next `acquire()` takes it
+    over. The random token can be passed to other processes (e.g. Celery
+    subtasks) which rebuild the lease with `Lease(name, token=token)` to renew
+    or release it.
+    """
+
+    def __init__(self, name, token=None, ttl=None, client=None):
+        self.name = name
+        self.key = f"lease:{name}"
+        self.token = token
+        self.ttl = ttl or settings.HN_SYNC_LEASE_TTL
+        self.client = client or redis_client()
+        self._renewed_at = time.monotonic()
+
+    @property
+    def ttl_ms(self):
+        return int(self.ttl * 1000)
+
+    def acquire(self):
+        """
+        Try to take the lease, returning True on success.
+        """
+        token = uuid.uuid4().hex
+        if self.client.set(self.key, token, nx=True, px=self.ttl_ms):
+            self.token = token
+            self._renewed_at = time.monotonic()
+            return True
+        return False
+
+    def renew(self):
+        """
+        Extend the lease by `ttl`, returning False if it expired or was taken over.
+        """
+        renewed = bool(self.client.eval(RENEW_SCRIPT, 1, self.key, self.token, self.ttl_ms))
+        if renewed:
+            self._renewed_at = time.monotonic()
+        else:
+            logger.warning(f"Lease {self.name} was lost")
+        return renewed
+
+    def heartbeat(self):
+        """
+        Renew the lease if a third of its TTL has passed since the last renewal.
+        Cheap enough to call once per processed item.
+        """
+        if time.monotonic() - self._renewed_at >= self.ttl / 3:
+            return self.renew()
+        return True
+
+    def release(self):
+        """
+        Drop the lease if it is still ours.
+        """
+        return bool(self.client.eval(RELEASE_SCRIPT, 1, self.key, self.token))
+
+    def request_rerun(self):
+        """
+        Ask the current holder to run once more after it releases the lease.
+        Any number of requests while a run is in progress coalesce into one.
+        The request expires so one left behind by a crashed run does not linger.
+        """
+        self.client.set(f"{self.key}:rerun", 1, ex=int(self.ttl) * 10)
+
+    def take_rerun(self):
+        """
+        Consume a pending rerun request, returning True if there was one.
+        """
+        return bool(self.client.delete(f"{self.key}:rerun"))
+
+
+class RunLimits:
+    """
+    Error budget, circuit breaker and rate limits of one run, shared in Redis by all the
+    processes working for it (e.g. the Celery subtasks of a sync), so that HN_ERROR_BUDGET,
+    the circuit breaker and HN_RATE_LIMIT hold for the run rather than for each process.
+    Keys are scoped to the lease token and expire once the run stops using them.
+    """
+
+    def __init__(self, lease):
+        self.prefix = f"{lease.key}:{lease.token}"
+        self.client = lease.client
+        self.ttl = int(lease.ttl) * 10
+
+    def add_error(self):
+        """
+        Count a failed request, returning the number failed so far in the run.
+        """
+        key = f"{self.prefix}:errors"
+        with self.client.pipeline() as pipe:
+            errors, _ = pipe.incr(key).expire(key, self.ttl).execute()
+        return errors
+
+    def open_circuit(self, cooldown):
+        """
+        Refuse requests in every process of the run for `cooldown` seconds.
+        """
+        self.client.set(f"{self.prefix}:circuit", 1, px=max(1, int(cooldown * 1000)))
+
+    def state(self):
+        """
+        (number of failed requests of the run, whether its circuit breaker is open)
+        """
+        errors, circuit = self.client.mget(f"{self.prefix}:errors", f"{self.prefix}:circuit")
+        return int(errors or 0), circuit is not None
+
+    def take_tokens(self, host, rate, capacity, count):
+        """
+        Take up to `count` requests to `host` from the run's token bucket.
+        :return: The number of requests granted, 0 if the bucket is empty
+        """
+        return int(self.client.eval(TAKE_TOKENS_SCRIPT, 1, f"{self.prefix}:rate:{host}", rate, capacity, count, self.ttl))
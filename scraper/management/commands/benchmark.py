@@ -0,0 +1,246 @@
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from core.celery import app as celery_app
+from scraper import lease
+from scraper.cache import bump_data_version
+from scraper.models import News, SyncState
+from scraper.simulator import SHAPES, HackerNewsSimulator, generate_items
+from scraper.tasks import sync_news_to_db
+
+# High enough not to collide with real Hacker News IDs, low enough for a 32 bit column
+FIRST_ITEM_ID = 1_900_000_000
+
+
+class Command(BaseCommand):
+    help = (
+        "Run sync_news_to_db end to end against a local Hacker News simulator, then time the list, detail "
+        "and search API endpoints. Everything runs in one transaction that is rolled back, against a key "
+        "space of the cache of its own, and the results are written as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stories", type=int, default=50)
+        parser.add_argument("--comments", type=int, default=20, help="Comments per story")
+        parser.add_argument("--shape", choices=SHAPES, default="balanced", help="Shape of the comment trees")
+        parser.add_argument("--fanout", type=int, default=4, help="Replies per comment in balanced trees")
+        parser.add_argument("--mode", choices=[SyncState.INCREMENTAL, SyncState.LATEST], default=SyncState.INCREMENTAL,
+                            help="Sync mode; latest mode only fetches the newest 100 stories")
+        parser.add_argument("--latency", type=float, default=0.0, help="Mean simulated API latency in seconds")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Share of API requests failing with 503")
+        parser.add_argument("--concurrency", type=int, default=10,
+                            help="Requests in flight (HN_FETCH_CONCURRENCY); the single-process simulator "
+                                 "becomes the bottleneck well below the production default")
+        parser.add_argument("--api-requests", type=int, default=200, help="Requests per API endpoint")
+        parser.add_argument("--api-cache", action="store_true", help="Let the API serve cached responses")
+        parser.add_argument("--real-redis", action="store_true", help="Take the sync lease in HN_SYNC_LEASE_URL")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="JSON results file, benchmark-<commit>.json by default")
+
+    def handle(self, *args, **options):
+        commit = git_commit()
+        results = {
+            "commit": commit,
+            "started_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "options": {key: options[key] for key in (
+                "stories", "comments", "shape", "fanout", "mode", "latency", "error_rate", "concurrency", "api_requests",
+                "api_cache",
+            )},
+        }
+        # Pages, data version and search tally cached by the run would outlive the rollback
+        with private_cache(), transaction.atomic():
+            results["sync"] = self.benchmark_sync(options)
+            results["api"] = self.benchmark_api(options)
+            transaction.set_rollback(True)
+
+        output = options["output"] or f"benchmark-{(commit or 'unknown')[:8]}.json"
+        with open(output, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+        sync = results["sync"]
+        self.stdout.write(
+            f"Sync: {sync['items']} items in {sync['seconds']:.2f}s ({sync['items_per_sec']:.0f}/s), "
+            f"{sync['requests']} requests, {sync['db_queries']} queries, "
+            f"{sync['peak_threads']} threads, {sync['peak_rss_mb']:.0f} MB RSS"
+        )
+        for name, stats in results["api"].items():
+            self.stdout.write(f"API {name}: p50 {stats['p50_ms']:.1f} ms, p90 {stats['p90_ms']:.1f} ms, "
+                              f"p99 {stats['p99_ms']:.1f} ms")
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+    def benchmark_sync(self, options):
+        mode = options["mode"]
+        items, story_ids = generate_items(
+            options["stories"], options["comments"], options["shape"], options["fanout"], FIRST_ITEM_ID, options["seed"],
+        )
+        simulator = HackerNewsSimulator(items, newstories=story_ids, latency=options["latency"],
+                                        error_rate=options["error_rate"], seed=options["seed"])
+        simulator.httpd.routes["maxitem.json"] = items[-1]["id"]
+        simulator.httpd.routes["updates.json"] = {"items": [], "profiles": []}
+        # Start incremental mode from scratch so it walks exactly the generated items
+        SyncState.objects.filter(name=mode).delete()
+        # Cache warming would run eagerly inside the timed sync
+        overrides = {
+            "HN_API_BASE_URL": simulator.url, "HN_RATE_LIMIT": 0, "HN_SYNC_MAX_NEW_ITEMS": len(items),
+            "HN_FETCH_CONCURRENCY": options["concurrency"], "HN_WARM_BUDGET": 0,
+        }
+
+        queries = QueryCounter()
+        sampler = ResourceSampler()
+        saved_client, saved_eager = lease._client, celery_app.conf.task_always_eager
+        if not options["real_redis"]:
+            import fakeredis
+            lease._client = fakeredis.FakeRedis()
+        celery_app.conf.task_always_eager = True
+        try:
+            with simulator, override_settings(**overrides), sampler, connection.execute_wrapper(queries):
+                started = time.perf_counter()
+                sync_news_to_db(mode)
+                elapsed = time.perf_counter() - started
+        finally:
+            lease._client, celery_app.conf.task_always_eager = saved_client, saved_eager
+
+        state = SyncState.objects.filter(name=mode).first()
+        counts = state.counts if state else {}
+        written = counts.get("stories", 0) + counts.get("comments", 0)
+        return {
+            "items": written,
+            "seconds": elapsed,
+            "items_per_sec": written / elapsed if elapsed else 0.0,
+            "requests": len(simulator.httpd.paths),
+            "db_queries": queries.count,
+            "peak_threads": sampler.peak_threads,
+            "peak_rss_mb": sampler.peak_rss / 2 ** 20,
+            "counts": counts,
+        }
+
+    def benchmark_api(self, options):
+        client = Client()
+        pks = list(News.objects.filter(item_id__gte=FIRST_ITEM_ID).values_list("pk", flat=True)[:100]) or [0]
+        # Every generated story matches the search, so both walk the same first pages
+        generated = News.objects.filter(item_id__gte=FIRST_ITEM_ID).count()
+        pages = min(5, max(1, -(-generated // settings.REST_FRAMEWORK["PAGE_SIZE"])))
+        endpoints = {
+            "list": lambda i: f"/api/item/?page={i % pages + 1}",
+            "detail": lambda i: f"/api/item/detail/{pks[i % len(pks)]}/",
+            "search": lambda i: f"/api/item/?search=story&page={i % pages + 1}",
+        }
+        results = {}
+        for name, url in endpoints.items():
+            timings, errors = [], 0
+            for i in range(options["api_requests"]):
+                if not options["api_cache"]:
+                    bump_data_version()
+                started = time.perf_counter()
+                response = client.get(url(i), HTTP_ACCEPT="application/json")
+                timings.append((time.perf_counter() - started) * 1000)
+                errors += response.status_code >= 400
+            results[name] = {**latency_percentiles(timings), "errors": errors}
+        return results
+
+
+def private_cache():
+    """
+    Settings override prefixing every key of the configured caches, so the benchmark measures the same
+    backends without serving or reading anything cached outside of it.
+    """
+    return override_settings(CACHES={
+        alias: {**options, "KEY_PREFIX": f"benchmark:{options.get('KEY_PREFIX', '')}"}
+        for alias, options in settings.CACHES.items()
+    })
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting queries, without keeping them like connection.queries does.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class ResourceSampler:
+    """
+    Sample the thread count and resident memory of this process every `interval` seconds while in use.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.sample()
+        self._thread = threading.Thread(target=self.run, name="benchmark-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        # Neither the sampler nor the simulator's threads are counted
+        threads = sum(
+            thread is not self._thread and thread.name != "simulator" and "process_request" not in thread.name
+            for thread in threading.enumerate()
+        )
+        self.peak_threads = max(self.peak_threads, threads)
+        self.peak_rss = max(self.peak_rss, current_rss())
+
+
+def current_rss():
+    """
+    Resident memory of this process in bytes, or its peak where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def latency_percentiles(timings):
+    timings = sorted(timings)
+
+    def percentile(q):
+        return timings[min(len(timings) - 1, int(q * len(timings)))] if timings else 0.0
+
+    return {
+        "requests": len(timings),
+        "p50_ms": percentile(0.5),
+        "p90_ms": percentile(0.9),
+        "p99_ms": percentile(0.99),
+        "max_ms": timings[-1] if timings else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,225 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from scraper.cache import bump_data_version
+from scraper.feeds import update_feeds
+from scraper.models import SyncState
+from scraper.metrics import merge_counts
+from scraper.tasks import item_row
+from scraper.tree import place_unplaced_comments
+from scraper.writer import BulkWriter
+
+# Whitespace and comma between the items of a JSON array
+ITEM_SEPARATOR = re.compile(r"[\s,]*")
+# Text up to the next bracket, skipping whole strings, and up to the next comma for top-level values
+JSON_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+NESTED_CONTENT = re.compile(rf'(?:[^"\[\]{{}}]+|{JSON_STRING})*', re.S)
+SCALAR_CONTENT = re.compile(rf'(?:[^"\[\]{{}},]+|{JSON_STRING})*', re.S)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load Hacker News items from JSONL or JSON array dumps (optionally gzipped) into the database. "
+        "Progress is saved after every chunk, so an interrupted import resumes where it stopped. "
+        "Comments are placed in their threads and the ranked feeds rebuilt once at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Dump files, one item per line or a JSON array of items")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Parser processes")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Items per parse task and checkpoint")
+        parser.add_argument("--batch-size", type=int, default=settings.HN_WRITE_BATCH_SIZE, help="Rows per bulk write")
+        parser.add_argument("--restart", action="store_true", help="Ignore saved progress and import from the start")
+
+    def handle(self, *args, **options):
+        totals = []
+        with ProcessPoolExecutor(max_workers=options["workers"]) as pool:
+            for path in options["paths"]:
+                if not os.path.exists(path):
+                    raise CommandError(f"{path} does not exist")
+                totals.append(self.import_file(pool, path, options))
+
+        # Once for the whole import: comments dumped before their parent, and the feeds of the new stories
+        counts = merge_counts(totals)
+        counts["placed"] = place_unplaced_comments()
+        feeds = update_feeds() if counts.get("created") or counts.get("updated") else []
+        if counts.get("created") or counts.get("updated") or counts["placed"] or feeds:
+            bump_data_version()
+        self.stdout.write(self.style.SUCCESS(f"Imported {len(options['paths'])} files: {counts}"))
+
+    def import_file(self, pool, path, options):
+        """
+        Import one dump, resuming from its saved progress.
+        Chunks are parsed in the pool while earlier chunks are written, at most two per worker in flight.
+        """
+        state = load_import_state(path)
+        if options["restart"]:
+            state.cursor, state.counts = 0, {}
+        skip = state.cursor
+        if skip:
+            self.stdout.write(f"{path}: resuming after {skip} items")
+
+        counts = merge_counts([state.counts])
+        started = last_report = time.monotonic()
+        pending = deque()
+        chunks = chunked(islice(read_items(path), skip, None), options["chunk_size"])
+
+        with BulkWriter(batch_size=options["batch_size"], flush_interval=float("inf")) as writer:
+            for chunk in chunks:
+                pending.append(pool.submit(parse_items, chunk))
+                if len(pending) < options["workers"] * 2:
+                    continue
+                self.write_chunk(writer, pending.popleft().result(), state, counts)
+                if time.monotonic() - last_report >= 5:
+                    last_report = time.monotonic()
+                    self.report(path, state.cursor - skip, started)
+
+            while pending:
+                self.write_chunk(writer, pending.popleft().result(), state, counts)
+
+        self.report(path, state.cursor - skip, started)
+        return counts
+
+    def write_chunk(self, writer, parsed, state, counts):
+        """
+        Write a parsed chunk and save the progress, so no item is counted done before it is stored.
+        """
+        rows, chunk_counts = parsed
+        created, updated, unchanged = writer.created, writer.updated, writer.unchanged
+        for row in rows:
+            writer.add(*row)
+        writer.flush()
+
+        chunk_counts.update(
+            created=writer.created - created,
+            updated=writer.updated - updated,
+            unchanged=writer.unchanged - unchanged,
+        )
+        counts.update(merge_counts([counts, chunk_counts]))
+        state.cursor += chunk_counts["items"]
+        state.counts = counts
+        state.last_run_at = timezone.now()
+        state.save(update_fields=["cursor", "counts", "last_run_at"])
+
+    def report(self, path, items, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{path}: {items} items in {elapsed:.1f}s ({items / max(elapsed, 1e-9):.0f} items/s)")
+
+
+def parse_items(chunk):
+    """
+    Parse and map a chunk of dump entries in a worker process.
+    :param chunk: Raw JSON text of the entries: JSON lines or the items of a JSON array
+    :return: ([(model, Hacker News ID, field values)], counts)
+    """
+    rows = []
+    counts = {"items": len(chunk), "invalid": 0, "skipped": 0}
+    for entry in chunk:
+        try:
+            item_data = json.loads(entry)
+            row = item_row(item_data) if isinstance(item_data, dict) and "id" in item_data else False
+        except (ValueError, TypeError):
+            row = False
+        if row is False:
+            counts["invalid"] += 1
+        elif row is None:
+            counts["skipped"] += 1
+        else:
+            rows.append(row)
+    return rows, counts
+
+
+def read_items(path):
+    """
+    Yield the raw text of the entries of a dump: its lines for JSONL, its items for a JSON array.
+    Blank lines count as (invalid) entries so positions stay stable across runs.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as dump:
+        head = dump.read(1)
+        while head.isspace():
+            head = dump.read(1)
+        if head == "[":
+            yield from iter_json_array(dump)
+        else:
+            first = head + dump.readline()
+            yield first.rstrip("\n")
+            for line in dump:
+                yield line.rstrip("\n")
+
+
+def iter_json_array(dump, buffer_size=1 << 20, max_item_size=1 << 20):
+    """
+    Yield the raw text of the items of a JSON array one by one, without loading the whole file.
+    Items are only delimited here, see item_end; the parser workers decode them.
+    :param dump: Text file positioned just after the opening bracket
+    :param max_item_size: Characters an item may span before the array is taken as malformed
+    """
+    buffer, idx, eof = "", 0, False
+    while True:
+        idx = ITEM_SEPARATOR.match(buffer, idx).end()
+        if buffer.startswith("]", idx):
+            return
+        end = item_end(buffer, idx) if idx < len(buffer) else None
+        if end is not None:
+            yield buffer[idx:end].rstrip()
+            idx = end
+            continue
+        if eof:
+            if idx == len(buffer):
+                return
+            raise CommandError(f"Truncated JSON array near: {buffer[idx:idx + 80]}")
+        if len(buffer) - idx > max_item_size:
+            raise CommandError(f"JSON array item longer than {max_item_size} characters near: {buffer[idx:idx + 80]}")
+        more = dump.read(buffer_size)
+        eof = not more
+        buffer, idx = buffer[idx:] + more, 0
+
+
+def item_end(buffer, start):
+    """
+    Index just past the JSON value starting at `start`, found by counting brackets outside
+    strings rather than decoding it. A value that is not an object or array ends at the next
+    comma or bracket. Malformed values are delimited as well as possible and left to the parser.
+    :return: The index, or None when the value goes on past the end of `buffer`
+    """
+    if buffer[start] not in "[{":
+        end = SCALAR_CONTENT.match(buffer, start).end()
+        return None if end == len(buffer) or buffer[end] == '"' else end
+    depth, pos = 0, start
+    while True:
+        pos = NESTED_CONTENT.match(buffer, pos).end()
+        # At the end of the buffer, or at a string not closed in it
+        if pos == len(buffer) or buffer[pos] == '"':
+            return None
+        depth += 1 if buffer[pos] in "[{" else -1
+        pos += 1
+        if not depth:
+            return pos
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def load_import_state(path):
+    """
+    SyncState row holding the progress of a dump, named after its file name and absolute path.
+    """
+    digest = hashlib.blake2b(os.path.abspath(path).encode(), digest_size=6).hexdigest()
+    name = f"import:{digest}:{os.path.basename(path)}"[:100]
+    state, _ = SyncState.objects.get_or_create(name=name)
+    return state
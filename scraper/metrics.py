@@ -0,0 +1,196 @@
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.db.models import Count, Sum
+
+from .models import SyncRun
+
+# Upper bounds of the histogram buckets, an implicit +Inf bucket follows
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Counters merged with max() instead of summed
+PEAK_COUNTS = ("max_depth", "max_width", "frontier_peak", "in_flight_peak", "circuit_open")
+
+
+def new_histogram(buckets):
+    return {"buckets": [0] * (len(buckets) + 1), "sum": 0, "count": 0}
+
+
+def observe(histogram, buckets, value):
+    histogram["buckets"][bisect_left(buckets, value)] += 1
+    histogram["sum"] += value
+    histogram["count"] += 1
+
+
+def histogram_of(values, buckets):
+    histogram = new_histogram(buckets)
+    for value in values:
+        observe(histogram, buckets, value)
+    return histogram
+
+
+class RequestMetrics:
+    """
+    Response times and status counts of Hacker News API requests, per endpoint
+    ("item", "maxitem", "newstories", ...). A status of "error" means no response.
+    """
+
+    def __init__(self):
+        self.latency = {}
+        self.statuses = Counter()
+        self.wait_time = 0.0
+
+    def observe(self, path, status, seconds):
+        endpoint = path.split("/")[0].removesuffix(".json")
+        if endpoint not in self.latency:
+            self.latency[endpoint] = new_histogram(LATENCY_BUCKETS)
+        observe(self.latency[endpoint], LATENCY_BUCKETS, seconds)
+        self.statuses[f"{endpoint}:{status}"] += 1
+
+    @property
+    def requests(self):
+        return sum(count for key, count in self.statuses.items() if not key.endswith(":error"))
+
+    def as_dict(self):
+        return {"latency": self.latency, "statuses": dict(self.statuses), "request_wait": self.wait_time}
+
+
+def merge_counts(all_counts):
+    """
+    Combine the counters of several subtasks: totals are summed, peaks use the maximum,
+    nested counters and histograms are merged key by key.
+    """
+    merged = {}
+    for counts in all_counts:
+        _merge_into(merged, counts)
+    return merged
+
+
+def _merge_into(merged, counts):
+    for key, value in counts.items():
+        if isinstance(value, dict):
+            _merge_into(merged.setdefault(key, {}), value)
+        elif isinstance(value, list):
+            merged[key] = [a + b for a, b in zip(merged[key], value)] if key in merged else list(value)
+        elif key in PEAK_COUNTS:
+            merged[key] = max(merged.get(key, value), value)
+        else:
+            merged[key] = merged.get(key, 0) + value
+
+
+def record_sync_run(mode, started_at, counts):
+    """
+    Save a finished sync run.
+    :param started_at: Unix time the coordinator started
+    """
+    finished_at = datetime.now(dt_timezone.utc)
+    started = datetime.fromtimestamp(started_at, tz=dt_timezone.utc) if started_at else finished_at
+    return SyncRun.objects.create(
+        mode=mode,
+        started_at=started,
+        finished_at=finished_at,
+        wall_time=(finished_at - started).total_seconds(),
+        items_fetched=counts.get("stories", 0) + counts.get("comments", 0),
+        created=counts.get("created", 0),
+        updated=counts.get("updated", 0),
+        failed=counts.get("failed", 0),
+        requests=counts.get("requests", 0),
+        write_time=counts.get("write_time", 0.0),
+        counts=counts,
+    )
+
+
+TOTALS = (
+    ("runs", "hn_sync_runs_total", "Finished sync runs"),
+    ("items_fetched", "hn_sync_items_fetched_total", "Stories and comments fetched"),
+    ("created", "hn_sync_rows_created_total", "Rows inserted"),
+    ("updated", "hn_sync_rows_updated_total", "Rows updated"),
+    ("failed", "hn_sync_items_failed_total", "Items that could not be fetched"),
+    ("requests", "hn_sync_requests_total", "Hacker News API requests"),
+    ("wall_time", "hn_sync_duration_seconds_total", "Wall time of sync runs"),
+    ("write_time", "hn_sync_write_seconds_total", "Time spent writing to the database"),
+)
+LAST_RUN_COUNTS = (
+    "stories", "comments", "created", "updated", "unchanged", "skipped", "subtrees_skipped", "failed", "requests",
+)
+LAST_RUN_GAUGES = (
+    ("frontier_peak", "hn_sync_last_run_frontier_peak", "Most item IDs queued in a crawl frontier"),
+    ("in_flight_peak", "hn_sync_last_run_in_flight_peak", "Most fetched items waiting to be written"),
+    ("write_time", "hn_sync_last_run_write_seconds", "Time spent writing to the database"),
+    ("request_wait", "hn_sync_last_run_request_wait_seconds", "Time requests waited for a connection slot or the rate limiter"),
+)
+
+
+def render_prometheus():
+    """
+    Render the sync metrics in the Prometheus text exposition format.
+    Totals cover every recorded run; last_run metrics and histograms describe the latest run of each mode.
+    """
+    lines = []
+    totals = list(SyncRun.objects.values("mode").annotate(
+        runs=Count("id"), **{field: Sum(field) for field, _, _ in TOTALS[1:]}
+    ).order_by("mode"))
+    for field, name, help_text in TOTALS:
+        _metric(lines, name, "counter", help_text, [(name, {"mode": row["mode"]}, row[field] or 0) for row in totals])
+
+    last_runs = [SyncRun.objects.filter(mode=row["mode"]).latest("started_at") for row in totals]
+    _metric(lines, "hn_sync_last_run_timestamp_seconds", "gauge", "Time the latest run finished", [
+        ("hn_sync_last_run_timestamp_seconds", {"mode": run.mode}, run.finished_at.timestamp()) for run in last_runs
+    ])
+    _metric(lines, "hn_sync_last_run_duration_seconds", "gauge", "Wall time of the latest run", [
+        ("hn_sync_last_run_duration_seconds", {"mode": run.mode}, run.wall_time) for run in last_runs
+    ])
+    _metric(lines, "hn_sync_last_run_items", "gauge", "Items handled by the latest run, by outcome", [
+        ("hn_sync_last_run_items", {"mode": run.mode, "kind": kind}, run.counts.get(kind, 0))
+        for run in last_runs for kind in LAST_RUN_COUNTS
+    ])
+    for key, name, help_text in LAST_RUN_GAUGES:
+        _metric(lines, name, "gauge", help_text, [(name, {"mode": run.mode}, run.counts.get(key, 0)) for run in last_runs])
+    _metric(lines, "hn_sync_last_run_responses", "gauge", "API responses of the latest run by endpoint and status", [
+        ("hn_sync_last_run_responses", {"mode": run.mode, **dict(zip(("endpoint", "status"), key.split(":")))}, count)
+        for run in last_runs for key, count in sorted(run.counts.get("statuses", {}).items())
+    ])
+    _histogram(lines, "hn_sync_last_run_request_duration_seconds", "API response times of the latest run",
+               LATENCY_BUCKETS, [
+                   ({"mode": run.mode, "endpoint": endpoint}, histogram)
+                   for run in last_runs for endpoint, histogram in sorted(run.counts.get("latency", {}).items())
+               ])
+    _histogram(lines, "hn_sync_last_run_comments_per_story", "Comments fetched per crawled story in the latest run",
+               SIZE_BUCKETS, [
+                   ({"mode": run.mode}, run.counts["comments_per_story"])
+                   for run in last_runs if run.counts.get("comments_per_story", {}).get("count")
+               ])
+    return "\n".join(lines) + "\n"
+
+
+def _metric(lines, name, kind, help_text, samples):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for sample_name, labels, value in samples:
+        label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+        lines.append(f"{sample_name}{{{label_text}}} {_number(value)}")
+
+
+def _histogram(lines, name, help_text, buckets, histograms):
+    """
+    Render stored histograms, whose bucket counts are not cumulative, as Prometheus histograms.
+    """
+    samples = []
+    for labels, histogram in histograms:
+        cumulative = 0
+        for bound, count in zip([*buckets, "+Inf"], histogram["buckets"]):
+            cumulative += count
+            samples.append((f"{name}_bucket", {**labels, "le": bound}, cumulative))
+        samples.append((f"{name}_sum", labels, histogram["sum"]))
+        samples.append((f"{name}_count", labels, histogram["count"]))
+    _metric(lines, name, "histogram", help_text, samples)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    return str(int(value)) if isinstance(value, (int, bool)) else repr(float(value))
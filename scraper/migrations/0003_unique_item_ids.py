@@ -0,0 +1,54 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:03
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_items(apps, schema_editor):
+    """
+    Keep only the most recently written row for every item_id / comment_id.
+    """
+    for model_name, key in (('News', 'item_id'), ('Comment', 'comment_id')):
+        model = apps.get_model('scraper', model_name)
+        duplicates = (
+            model.objects.filter(**{f'{key}__isnull': False})
+            .values(key)
+            .annotate(keep=Max('id'), rows=Count('id'))
+            .filter(rows__gt=1)
+            .values_list(key, 'keep')
+        )
+        batch = list(duplicates[:1000])
+        while batch:
+            keys, keep = zip(*batch)
+            model.objects.filter(**{f'{key}__in': keys}).exclude(id__in=keep).delete()
+            batch = list(duplicates[:1000])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0002_comment_comment_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_items, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='comment',
+            name='comment_id',
+            field=models.PositiveIntegerField(null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='parent',
+            field=models.IntegerField(blank=True, db_index=True, null=True, verbose_name='Comment Parent'),
+        ),
+        migrations.AlterField(
+            model_name='news',
+            name='item_id',
+            field=models.PositiveIntegerField(null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(fields=['type', 'date_created'], name='news_type_created_idx'),
+        ),
+    ]
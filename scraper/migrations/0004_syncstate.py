@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0003_unique_item_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Sync Name')),
+                ('cursor', models.PositiveBigIntegerField(default=0, verbose_name='Last Fetched Item ID')),
+                ('last_run_at', models.DateTimeField(blank=True, null=True, verbose_name='Last Run Time')),
+                ('counts', models.JSONField(blank=True, default=dict, verbose_name='Last Run Counts')),
+            ],
+        ),
+    ]
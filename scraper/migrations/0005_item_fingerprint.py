@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0004_syncstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='Content Fingerprint'),
+        ),
+        migrations.AddField(
+            model_name='news',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='Content Fingerprint'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0005_item_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncstate',
+            name='dead_letters',
+            field=models.JSONField(blank=True, default=list, verbose_name='Failed Item IDs'),
+        ),
+    ]
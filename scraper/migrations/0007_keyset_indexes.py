@@ -0,0 +1,21 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0006_syncstate_dead_letters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(models.F('date_posted').desc(), models.F('id').desc(), name='comment_posted_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(models.F('date_created').desc(), models.F('id').desc(), name='news_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0007_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Depth in Thread'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, default='', max_length=2000, verbose_name='Thread Path'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Story ID'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['root', 'path'], name='comment_root_path_idx'),
+        ),
+        # The stored comments are placed by the SQL walk of 0011_comment_news
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0008_comment_tree'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mode', models.CharField(max_length=100, verbose_name='Sync Name')),
+                ('started_at', models.DateTimeField(verbose_name='Start Time')),
+                ('finished_at', models.DateTimeField(verbose_name='Finish Time')),
+                ('wall_time', models.FloatField(default=0, verbose_name='Wall Time (s)')),
+                ('items_fetched', models.PositiveIntegerField(default=0, verbose_name='Items Fetched')),
+                ('created', models.PositiveIntegerField(default=0, verbose_name='Rows Created')),
+                ('updated', models.PositiveIntegerField(default=0, verbose_name='Rows Updated')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='Items Failed')),
+                ('requests', models.PositiveIntegerField(default=0, verbose_name='API Requests')),
+                ('write_time', models.FloatField(default=0, verbose_name='Database Write Time (s)')),
+                ('counts', models.JSONField(blank=True, default=dict, verbose_name='Counters and Histograms')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['mode', '-started_at'], name='syncrun_mode_started_idx')],
+            },
+        ),
+    ]
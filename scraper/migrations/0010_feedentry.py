@@ -0,0 +1,27 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0009_syncrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feed', models.CharField(choices=[('hot', 'Hot'), ('top', 'Top'), ('discussed', 'Most Discussed')], max_length=20, verbose_name='Feed')),
+                ('position', models.PositiveIntegerField(verbose_name='Position')),
+                ('rank', models.FloatField(default=0, verbose_name='Rank')),
+                ('news', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='scraper.news')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('feed', 'position'), name='feed_position_unique'), models.UniqueConstraint(fields=('feed', 'news'), name='feed_news_unique')],
+            },
+        ),
+    ]
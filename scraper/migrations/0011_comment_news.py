@@ -0,0 +1,67 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import CharField, F, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat, LPad
+
+
+def place_unplaced_comments(apps, schema_editor):
+    """
+    Link the comments that have no story yet by walking their parent chains one level per
+    UPDATE: replies to stored stories first, then replies to comments placed in the round before.
+    """
+    News = apps.get_model('scraper', 'News')
+    Comment = apps.get_model('scraper', 'Comment')
+    unplaced = Comment.objects.filter(news__isnull=True, comment_id__isnull=False)
+    own_path = LPad(Cast('comment_id', CharField()), 10, Value('0'))
+
+    unplaced.filter(parent__in=News.objects.filter(item_id__isnull=False).values('item_id')).update(
+        news=F('parent'), depth=1, path=own_path,
+    )
+    parents = Comment.objects.filter(comment_id=OuterRef('parent'))
+    placed_parents = Comment.objects.filter(news__isnull=False, depth__lt=200).values('comment_id')
+    while unplaced.filter(parent__in=placed_parents).update(
+        news=Subquery(parents.values('news')[:1]),
+        depth=Subquery(parents.values('depth')[:1]) + 1,
+        path=Concat(Subquery(parents.values('path')[:1]), own_path),
+    ):
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0010_feedentry'),
+    ]
+
+    operations = [
+        # The "root" column already holds the story's Hacker News ID and is indexed with the path,
+        # so only the model state changes: root becomes a foreign key to News.item_id
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveIndex(
+                    model_name='comment',
+                    name='comment_root_path_idx',
+                ),
+                migrations.RemoveField(
+                    model_name='comment',
+                    name='root',
+                ),
+                migrations.AddField(
+                    model_name='comment',
+                    name='news',
+                    field=models.ForeignKey(blank=True, db_column='root', db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='scraper.news', to_field='item_id', verbose_name='Story'),
+                ),
+                migrations.AddIndex(
+                    model_name='comment',
+                    index=models.Index(fields=['news', 'path'], name='comment_root_path_idx'),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(models.F('news'), models.F('date_posted').desc(), models.F('id').desc(), name='comment_news_posted_id_idx'),
+        ),
+        migrations.RunPython(place_unplaced_comments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+from django.db import OperationalError, migrations
+
+from scraper.search import SEARCH_CONFIG, SEARCH_FIELDS, SEARCH_TOKENIZER, sqlite_triggers
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Create the full-text search index. Searches match every word as a prefix, so words are
+    indexed as written: a stemmed token does not start with every prefix of its word.
+
+    On PostgreSQL, adding the generated column rewrites each table under an exclusive lock:
+    on large tables, run this migration in a maintenance window.
+    """
+    connection = schema_editor.connection
+    if connection.vendor == "postgresql":
+        for table, fields in SEARCH_FIELDS.items():
+            vector = " || ".join(
+                f"setweight(to_tsvector('{SEARCH_CONFIG}'::regconfig, coalesce({field}, '')), '{weight}')"
+                for field, weight in zip(fields, "ABCD")
+            )
+            schema_editor.execute(
+                f"ALTER TABLE {table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({vector}) STORED"
+            )
+            schema_editor.execute(f"CREATE INDEX {table}_search_idx ON {table} USING GIN (search_vector)")
+    elif connection.vendor == "sqlite":
+        try:
+            # Probe for FTS5 outside the migration's own statements
+            with connection.cursor() as cursor:
+                cursor.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+                cursor.execute("DROP TABLE temp.fts5_probe")
+        except OperationalError:
+            # Searches fall back to icontains
+            return
+        for table, fields in SEARCH_FIELDS.items():
+            fts = f"{table}_fts"
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5({', '.join(fields)}, content='{table}', "
+                f"content_rowid='id', tokenize='{SEARCH_TOKENIZER}')"
+            )
+            for name, body in sqlite_triggers(table, fields).items():
+                schema_editor.execute(f"CREATE TRIGGER {name} {body}")
+            schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    for table, fields in SEARCH_FIELDS.items():
+        if connection.vendor == "postgresql":
+            schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_idx")
+            schema_editor.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector")
+        elif connection.vendor == "sqlite":
+            for name in sqlite_triggers(table, fields):
+                schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            schema_editor.execute(f"DROP TABLE IF EXISTS {table}_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0011_comment_news'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
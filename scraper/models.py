@@ -2,7 +2,7 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 
 class News(models.Model):
-    item_id = models.PositiveIntegerField(null=True)
+    item_id = models.PositiveIntegerField(null=True, unique=True)
     type = models.CharField(_('Item Type'), max_length=255)
     author = models.CharField(_('Item Author'), max_length=255)
     date_created = models.DateTimeField(_('Creation Time'), null=True)
@@ -13,17 +13,93 @@ class News(models.Model):
     score = models.IntegerField(_('Item Score'), blank=True, null=True)
     url = models.CharField(_('Item url'), max_length=255, null=True, blank=True)
     title = models.CharField(_('Item Title'), blank=True, max_length=255)
+    fingerprint = models.CharField(_('Content Fingerprint'), max_length=32, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['type', 'date_created'], name='news_type_created_idx'),
+            models.Index(models.F('date_created').desc(), models.F('id').desc(), name='news_created_id_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
 
 
 class Comment(models.Model):
-    comment_id = models.PositiveIntegerField(null=True)
-    parent = models.IntegerField(_('Comment Parent'), blank=True, null=True)
+    comment_id = models.PositiveIntegerField(null=True, unique=True)
+    parent = models.IntegerField(_('Comment Parent'), blank=True, null=True, db_index=True)
     text = models.TextField(_('Item Text'), max_length=255, blank=True, null=True)
     date_posted = models.DateTimeField(_('Creation Time'), null=True)
     kids = models.JSONField(_('Kids'), blank=True, null=True)  
     type = models.CharField(_('Item Type'), max_length=255)
     author = models.CharField(_('Item Author'), max_length=255, null=True, blank=True)
+    fingerprint = models.CharField(_('Content Fingerprint'), max_length=32, blank=True, default='')
+    # The story at the root of the thread, by its Hacker News ID; stored in the original "root" column
+    news = models.ForeignKey(
+        News, on_delete=models.CASCADE, to_field='item_id', db_column='root', db_constraint=False, db_index=False,
+        related_name='comments', blank=True, null=True, verbose_name=_('Story'),
+    )
+    depth = models.PositiveSmallIntegerField(_('Depth in Thread'), default=0)
+    path = models.CharField(_('Thread Path'), max_length=2000, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(models.F('date_posted').desc(), models.F('id').desc(), name='comment_posted_id_idx'),
+            models.Index(fields=['news', 'path'], name='comment_root_path_idx'),
+            models.Index(models.F('news'), models.F('date_posted').desc(), models.F('id').desc(), name='comment_news_posted_id_idx'),
+        ]
+
+
+class FeedEntry(models.Model):
+    HOT = 'hot'
+    TOP = 'top'
+    DISCUSSED = 'discussed'
+    FEEDS = [(HOT, _('Hot')), (TOP, _('Top')), (DISCUSSED, _('Most Discussed'))]
+
+    feed = models.CharField(_('Feed'), max_length=20, choices=FEEDS)
+    position = models.PositiveIntegerField(_('Position'))
+    news = models.ForeignKey(News, on_delete=models.CASCADE, related_name='feed_entries')
+    rank = models.FloatField(_('Rank'), default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['feed', 'position'], name='feed_position_unique'),
+            models.UniqueConstraint(fields=['feed', 'news'], name='feed_news_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.feed} #{self.position}"
+
 
+class SyncState(models.Model):
+    LATEST = 'latest'
+    INCREMENTAL = 'incremental'
+
+    name = models.CharField(_('Sync Name'), max_length=100, unique=True)
+    cursor = models.PositiveBigIntegerField(_('Last Fetched Item ID'), default=0)
+    last_run_at = models.DateTimeField(_('Last Run Time'), null=True, blank=True)
+    counts = models.JSONField(_('Last Run Counts'), default=dict, blank=True)
+    dead_letters = models.JSONField(_('Failed Item IDs'), default=list, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
+class SyncRun(models.Model):
+    mode = models.CharField(_('Sync Name'), max_length=100)
+    started_at = models.DateTimeField(_('Start Time'))
+    finished_at = models.DateTimeField(_('Finish Time'))
+    wall_time = models.FloatField(_('Wall Time (s)'), default=0)
+    items_fetched = models.PositiveIntegerField(_('Items Fetched'), default=0)
+    created = models.PositiveIntegerField(_('Rows Created'), default=0)
+    updated = models.PositiveIntegerField(_('Rows Updated'), default=0)
+    failed = models.PositiveIntegerField(_('Items Failed'), default=0)
+    requests = models.PositiveIntegerField(_('API Requests'), default=0)
+    write_time = models.FloatField(_('Database Write Time (s)'), default=0)
+    counts = models.JSONField(_('Counters and Histograms'), default=dict, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['mode', '-started_at'], name='syncrun_mode_started_idx')]
+
+    def __str__(self):
+        return f"{self.mode} {self.started_at:%Y-%m-%d %H:%M:%S}"
@@ -0,0 +1,108 @@
+import hashlib
+import logging
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.test import RequestFactory
+from django.urls import resolve
+from core.profiling import profile_section
+
+from .cache import get_data_version
+
+logger = logging.getLogger(__name__)
+
+REFRESH_CLAIM_TIMEOUT = 60  # seconds before a stale page can be queued for a refresh again
+
+
+class CachedPageMixin:
+    """
+    Full-page cache for the server-rendered views.
+
+    A rendered page is cached under its path and query parameters together with the data
+    version it was rendered at. While the version is current the page is served from the
+    cache. Once a sync bumps the version the page is stale: with
+    HTML_CACHE_STALE_WHILE_REVALIDATE it is still served while a `refresh_page` task renders
+    the new version, so no visitor waits for the render; otherwise it is rendered in the
+    request. Responses carry an ETag and a matching If-None-Match gets a 304.
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not settings.HTML_CACHE_TIMEOUT:
+            return super().get(request, *args, **kwargs)
+
+        key = page_cache_key(request)
+        version = get_data_version()
+        entry = None if getattr(request, 'refresh_page', False) else cache.get(key)
+        if entry is not None and entry['version'] != version:
+            if settings.HTML_CACHE_STALE_WHILE_REVALIDATE:
+                schedule_refresh(key, request.get_full_path(), version)
+            else:
+                entry = None
+
+        if entry is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            with profile_section('render'):
+                response.render()
+            entry = {
+                'version': version,
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'etag': f'"{hashlib.blake2b(response.content, digest_size=16).hexdigest()}"',
+            }
+            cache.set(key, entry, settings.HTML_CACHE_TIMEOUT)
+
+        if entry['etag'] in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        response['ETag'] = entry['etag']
+        return response
+
+
+def page_cache_key(request):
+    # Empty parameters, as sent by the search form and the pagination links, change nothing
+    params = sorted((name, values) for name, values in request.GET.lists() if any(values))
+    digest = hashlib.blake2b(repr((request.path, params)).encode(), digest_size=16).hexdigest()
+    return f"page:{digest}"
+
+
+def schedule_refresh(key, path, version):
+    """
+    Queue one re-render of a stale page per data version. The claim expires so a lost
+    task is queued again by a later visitor.
+    """
+    if cache.add(f"{key}:refresh:{version}", 1, REFRESH_CLAIM_TIMEOUT):
+        # refresh_page wraps render_page, so tasks imports this module first
+        from .tasks import refresh_page
+        try:
+            refresh_page.delay(path)
+        except Exception as e:
+            logger.error(f"Error queueing the refresh of {path}: {str(e)}")
+
+
+def render_page(path):
+    """
+    Render a page and store it in the page cache, whatever is cached for it now. API list
+    paths go through their read-through cache, for the origin set in HN_WARM_BASE_URL.
+    :param path: Path with its query string, e.g. "/?page=2"
+    :return: The status code of the rendered page
+    """
+    base_url = urlsplit(settings.HN_WARM_BASE_URL)
+    if base_url.netloc:
+        request = RequestFactory().get(path, HTTP_HOST=base_url.netloc, secure=base_url.scheme == 'https')
+    else:
+        request = RequestFactory().get(path)
+    request.refresh_page = True
+    match = resolve(urlsplit(path).path)
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+    except Http404:
+        logger.info(f"Page {path} no longer exists")
+        return 404
+    if response.status_code != 200:
+        logger.warning(f"Page {path} rendered with status {response.status_code}, not cached")
+    return response.status_code
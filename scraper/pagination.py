@@ -0,0 +1,95 @@
+import base64
+import json
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset newest first by seeking past the last row of the previous
+    page, instead of using OFFSET.
+
+    Rows are ordered by `field` descending, with NULLs last, and the primary key
+    breaks ties. A page is one range scan of `per_page + 1` rows on a descending
+    (field, pk) index however deep it is, plus one on the NULL tail for the pages
+    that reach it; no COUNT(*) is run. `.values()` querysets must include the field
+    and the primary key. The cursor is an opaque token holding the
+    (field, pk) of the last row of a page:
+
+        page = KeysetPaginator(News.objects.all(), 10, "date_created").page(cursor)
+        page.object_list, page.next_cursor
+    """
+
+    def __init__(self, queryset, per_page, field):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.field = field
+
+    def page(self, cursor=None):
+        """
+        Return the page following `cursor`, or the first page when it is empty.
+        :raises InvalidCursor: If the cursor was not produced by this paginator
+        """
+        value, pk = self.decode_cursor(cursor) if cursor else (None, None)
+        limit = self.per_page + 1
+        rows = []
+        if not cursor or value is not None:
+            # Rows with a value, walked down the (field, pk) index. The inclusive bound is the
+            # range of the scan; the OR only drops the rows at `value` already shown.
+            dated = self.queryset.filter(**{f"{self.field}__isnull": False})
+            if cursor:
+                dated = dated.filter(
+                    Q(**{f"{self.field}__lt": value}) | Q(**{self.field: value, "pk__lt": pk}),
+                    **{f"{self.field}__lte": value},
+                )
+            rows = list(dated.order_by(f"-{self.field}", "-pk")[:limit])
+        if len(rows) < limit:
+            # The NULL tail, once the dated rows run out
+            undated = self.queryset.filter(**{f"{self.field}__isnull": True})
+            if cursor and value is None:
+                undated = undated.filter(pk__lt=pk)
+            rows += list(undated.order_by("-pk")[:limit - len(rows)])
+
+        next_cursor = self.encode_cursor(rows[self.per_page - 1]) if len(rows) > self.per_page else None
+        return KeysetPage(rows[:self.per_page], next_cursor)
+
+    def encode_cursor(self, row):
+        """
+        :param row: A model instance, or a `.values()` dict holding the field and the primary key
+        """
+        if isinstance(row, dict):
+            value, pk = row[self.field], row[self.queryset.model._meta.pk.attname]
+        else:
+            value, pk = getattr(row, self.field), row.pk
+        # str() keeps the full precision of datetimes, which DjangoJSONEncoder truncates to milliseconds
+        position = json.dumps([value, pk], default=str)
+        return base64.urlsafe_b64encode(position.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        try:
+            position = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            value, pk = json.loads(position)
+            field = self.queryset.model._meta.get_field(self.field)
+            return field.to_python(value), int(pk)
+        except Exception:
+            raise InvalidCursor(f"Invalid cursor: {cursor}")
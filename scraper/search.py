@@ -0,0 +1,161 @@
+import logging
+import re
+import time
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import OperationalError, connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger(__name__)
+
+# Searchable columns per table, most important first
+SEARCH_FIELDS = {
+    "scraper_news": ("title", "text"),
+    "scraper_comment": ("text",),
+}
+# Words are indexed unstemmed, so a prefix of a word matches it; see migration 0012_search_index
+SEARCH_CONFIG = "simple"  # PostgreSQL text search configuration
+SEARCH_TOKENIZER = "unicode61"  # SQLite FTS5 tokenizer
+MAX_TERMS = 8
+SEARCHES_KEY = "search:popular"
+SEARCHES_KEPT = 1000
+
+_installed = {}
+
+
+def search(queryset, query):
+    """
+    Full-text search over a News or Comment queryset.
+
+    Every word of `query` must match, as a prefix, one of the searchable columns
+    (title weighs more than text). Results are annotated with `search_rank`,
+    higher is better, and ordered by it. On PostgreSQL the match runs on a GIN
+    index over a generated tsvector column, on SQLite on an FTS5 table kept in
+    sync by triggers; both are created by migration 0012_search_index and index
+    the words unstemmed, so any prefix of a word matches it. Other
+    databases, and SQLite builds without FTS5, fall back to an unranked icontains scan.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    fields = SEARCH_FIELDS[table]
+
+    if connection.vendor == "postgresql":
+        tsquery = " & ".join(f"{term}:*" for term in terms)
+        queryset = queryset.filter(RawSQL(
+            f"{table}.search_vector @@ to_tsquery(%s, %s)", [SEARCH_CONFIG, tsquery], output_field=BooleanField()
+        )).annotate(search_rank=RawSQL(
+            f"ts_rank({table}.search_vector, to_tsquery(%s, %s))", [SEARCH_CONFIG, tsquery], output_field=FloatField()
+        ))
+    elif connection.vendor == "sqlite" and is_search_index_installed(connection):
+        fts = f"{table}_fts"
+        match = " ".join(f'"{term}"*' for term in terms)
+        weights = ", ".join(["10.0"] + ["1.0"] * (len(fields) - 1))
+        queryset = queryset.filter(RawSQL(
+            f"{table}.id IN (SELECT rowid FROM {fts} WHERE {fts} MATCH %s)", [match], output_field=BooleanField()
+        )).annotate(search_rank=RawSQL(
+            # bm25() is lower for better matches
+            f"(SELECT -bm25({fts}, {weights}) FROM {fts} WHERE {fts} MATCH %s AND rowid = {table}.id)",
+            [match], output_field=FloatField(),
+        ))
+    else:
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{f"{field}__icontains": query})
+        queryset = queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    return queryset.order_by("-search_rank", "-id")
+
+
+def search_terms(query):
+    """
+    Split a search query into lowercase words, dropping operators and punctuation.
+    """
+    return re.findall(r"\w+", query.lower())[:MAX_TERMS]
+
+
+def record_search(query):
+    """
+    Count a search in the cached tally of the current hour, used to warm the pages of popular
+    searches. Two searches counted at the same moment can both read the old tally and
+    one of them is lost, which is fine for picking the popular ones.
+    """
+    query = query.strip()
+    if not search_terms(query) or len(query) > 200:
+        return
+    key = f"{SEARCHES_KEY}:{int(time.time() // 3600)}"
+    counts = cache.get(key, Counter())
+    counts[query] += 1
+    if len(counts) > SEARCHES_KEPT:
+        counts = Counter(dict(counts.most_common(SEARCHES_KEPT // 2)))
+    cache.set(key, counts, 2 * 3600)
+
+
+def popular_searches(limit):
+    """
+    The most frequent search queries of the current and the previous hour.
+    """
+    hour = int(time.time() // 3600)
+    counts = Counter()
+    for tally in cache.get_many([f"{SEARCHES_KEY}:{hour - 1}", f"{SEARCHES_KEY}:{hour}"]).values():
+        counts.update(tally)
+    return [query for query, _ in counts.most_common(limit)]
+
+
+def is_search_index_installed(connection):
+    if connection.alias not in _installed:
+        _installed[connection.alias] = all(
+            f"{table}_fts" in connection.introspection.table_names() for table in SEARCH_FIELDS
+        )
+    return _installed[connection.alias]
+
+
+def restore_search_triggers(connection):
+    """
+    Recreate the SQLite triggers that keep the FTS5 tables in sync, which SQLite drops when a
+    migration rebuilds a table, and reindex the rows written without them. The search index
+    itself is created by migration 0012_search_index.
+    """
+    # Migrations may have just created or dropped the index
+    _installed.pop(connection.alias, None)
+    if connection.vendor != "sqlite" or not is_search_index_installed(connection):
+        return
+    try:
+        with connection.cursor() as cursor:
+            for table, fields in SEARCH_FIELDS.items():
+                fts = f"{table}_fts"
+                triggers = sqlite_triggers(table, fields)
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN (%s)"
+                               % ", ".join(["%s"] * len(triggers)), list(triggers))
+                existing = {row[0] for row in cursor.fetchall()}
+                if existing == set(triggers):
+                    continue
+                for name, body in triggers.items():
+                    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+                cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    except OperationalError as e:
+        logger.warning(f"Could not restore the full-text search triggers: {str(e)}")
+
+
+def sqlite_triggers(table, fields):
+    """
+    Bodies of the triggers keeping the external-content FTS5 table of `table` in sync, by name.
+    """
+    fts = f"{table}_fts"
+    columns = ", ".join(fields)
+    old_values = ", ".join(f"old.{field}" for field in fields)
+    new_values = ", ".join(f"new.{field}" for field in fields)
+    return {
+        f"{fts}_insert": f"AFTER INSERT ON {table} BEGIN "
+                         f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+        f"{fts}_delete": f"AFTER DELETE ON {table} BEGIN "
+                         f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END",
+        f"{fts}_update": f"AFTER UPDATE OF {columns} ON {table} BEGIN "
+                         f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+                         f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+    }
@@ -0,0 +1,126 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; with Nagle on, each keep-alive response stalls on a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0].strip("/")
+        with server.lock:
+            server.paths.append(path)
+            server.connections.add(self.client_address)
+            failures = server.failures.get(path)
+            if failures:
+                status = failures.pop(0)
+            elif server.error_rate and server.random.random() < server.error_rate:
+                status = 503
+            else:
+                status = 200
+        if server.latency:
+            time.sleep(server.latency * (0.5 + server.random.random()))
+
+        body = json.dumps(server.routes.get(path) if status == 200 else {"error": status}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for the client's whole connection pool to connect at once
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up on a slow response are expected under injected latency
+        pass
+
+
+class HackerNewsSimulator:
+    """
+    Local stand-in for the Hacker News Firebase API, serving items from a dict.
+
+    `httpd.routes` maps paths (e.g. "item/1.json", "maxitem.json") to responses and
+    `httpd.failures` maps a path to the error statuses it returns before succeeding.
+    Every response is delayed by about `latency` seconds (50-150%), and a share
+    `error_rate` of them fails with a 503. Requested paths are recorded in
+    `httpd.paths` and client connections in `httpd.connections`.
+
+        with HackerNewsSimulator(items, newstories=[1]) as simulator:
+            with override_settings(HN_API_BASE_URL=simulator.url):
+                ...
+    """
+
+    def __init__(self, items, newstories=None, jobstories=None, latency=0.0, error_rate=0.0, seed=0):
+        self.httpd = SimulatorServer(("127.0.0.1", 0), SimulatorHandler)
+        self.httpd.lock = threading.Lock()
+        self.httpd.random = random.Random(seed)
+        self.httpd.latency = latency
+        self.httpd.error_rate = error_rate
+        self.httpd.paths = []
+        self.httpd.connections = set()
+        self.httpd.failures = {}
+        self.httpd.routes = {f"item/{item['id']}.json": item for item in items}
+        self.httpd.routes["newstories.json"] = newstories or []
+        self.httpd.routes["jobstories.json"] = jobstories or []
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, name="simulator", daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+SHAPES = ("flat", "balanced", "deep", "random")
+
+
+def generate_items(stories, comments_per_story, shape="balanced", fanout=4, first_id=1, seed=0):
+    """
+    Build stories with comment trees of a given shape.
+    :param shape: "flat" (every comment replies to the story), "balanced" (`fanout` replies per comment),
+                  "deep" (one chain of replies) or "random" (each comment replies to a random earlier one)
+    :return: (items, story IDs newest first)
+    """
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown shape {shape}, expected one of {', '.join(SHAPES)}")
+    rng = random.Random(seed)
+    items, story_ids = [], []
+    item_id = first_id
+    for _ in range(stories):
+        story = {"id": item_id, "type": "story", "by": f"user{item_id % 997}", "time": 1700000000 + item_id,
+                 "title": f"Story {item_id}", "url": f"https://example.com/{item_id}", "score": rng.randint(1, 500),
+                 "descendants": comments_per_story}
+        items.append(story)
+        story_ids.append(item_id)
+        thread = [story]
+        for index in range(comments_per_story):
+            item_id += 1
+            if shape == "flat":
+                parent = story
+            elif shape == "balanced":
+                parent = thread[index // fanout]
+            elif shape == "deep":
+                parent = thread[-1]
+            else:
+                parent = rng.choice(thread)
+            comment = {"id": item_id, "type": "comment", "by": f"user{item_id % 997}", "time": 1700000000 + item_id,
+                       "parent": parent["id"], "text": f"Comment {item_id} on {story['id']}"}
+            parent.setdefault("kids", []).append(item_id)
+            items.append(comment)
+            thread.append(comment)
+        item_id += 1
+    return items, story_ids[::-1]
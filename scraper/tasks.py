@@ -1,170 +1,378 @@
-import requests
-from datetime import datetime
-from celery import shared_task
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+from datetime import datetime, timezone as dt_timezone
+from celery import chord, shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
 import logging
-from .models import News, Comment
-
-HACKER_NEWS_BASE_URL = "https://hacker-news.firebaseio.com/v0"
-MAX_WORKERS = 5  # Number of threads for parallel API requests
+from .cache import bump_data_version
+from .client import HackerNewsClient
+from .crawler import StoryCrawler
+from .feeds import update_feeds
+from .lease import Lease, RunLimits
+from .metrics import RequestMetrics, merge_counts, record_sync_run
+from .models import News, Comment, SyncRun, SyncState
+from .pages import render_page
+from .tree import place_unplaced_comments
+from .warming import hot_paths, warm_pages
+from .writer import BulkWriter, item_fingerprint
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 @shared_task(name="sync_news_to_db")
-def sync_news_to_db():
-    """
-    Fetch the latest stories and job postings from Hacker News and save them to the database.
-    Uses threading to fetch data in parallel.
+def sync_news_to_db(mode=None):
     """
-    try:
-        # Fetch the latest 100 stories and job postings
-        news_ids = fetch_initial_story_ids("newstories")
-        job_ids = fetch_initial_story_ids("jobstories")
+    Coordinate a sync of new items from Hacker News into the database.
 
-        # Merge both lists to remove duplicates
-        all_item_ids = list(set(news_ids + job_ids))
+    In "latest" mode the newest 100 stories and job postings are fetched, and their comment trees are
+    crawled unless the stored descendants count and kids list show the tree has not changed.
+    In "incremental" mode only items created since the last run (up to `maxitem`) and items listed in
+    `updates.json` are fetched, so a run costs about one request per new or changed item.
 
-        # Ensure we are only processing the top 100 stories (latest first)
-        all_item_ids = all_item_ids[:100]
+    The item IDs are split into `sync_items` subtasks that run in parallel across workers, and a
+    chord runs `finalize_sync` once they are all done. Items already claimed by an overlapping run
+    are left to that run.
 
-        # Get the last fetched item_id from the database
-        last_fetched_item_id = get_last_fetched_item_id()
+    Only one run per mode is active at a time: the run holds a Redis lease that its subtasks keep
+    alive and finalize_sync releases. A tick that finds the lease held is skipped, or with
+    HN_SYNC_COALESCE = "queue" it is run once more after the current run finishes.
+
+    finalize_sync records the run's timings and counters as a SyncRun, served at /metrics.
+    :param mode: SyncState.LATEST or SyncState.INCREMENTAL, defaults to settings.HN_SYNC_MODE
+    """
+    mode = mode or settings.HN_SYNC_MODE
+    lease = Lease(f"sync:{mode}")
+    if not lease.acquire():
+        if settings.HN_SYNC_COALESCE == "queue":
+            lease.request_rerun()
+            logger.info(f"Sync {mode} already running, queued one more run")
+        else:
+            logger.info(f"Sync {mode} already running, skipping this tick")
+        return
+
+    claimed = []
+    try:
+        started_at = time.time()
+        state = load_sync_state(mode)
+        metrics = RequestMetrics()
 
-        # Filter out stories that are already in the database
-        new_item_ids = [item_id for item_id in all_item_ids if item_id > last_fetched_item_id]
+        if mode == SyncState.INCREMENTAL:
+            item_ids, cursor = asyncio.run(fetch_changed_item_ids(state.cursor, metrics))
+            batch_size = settings.HN_SYNC_ITEMS_PER_TASK
+        else:
+            item_ids = asyncio.run(fetch_latest_story_ids(metrics))
+            cursor = max(item_ids + [state.cursor])
+            batch_size = settings.HN_SYNC_STORIES_PER_TASK
 
-        # Fetch and save all items using threading
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            executor.map(fetch_and_save_story, new_item_ids)
+        # Items that failed last time are retried first
+        item_ids = claimed = claim_items(dict.fromkeys(state.dead_letters + item_ids))
 
-        # Update the last fetched story ID after syncing
-        if new_item_ids:
-            set_last_fetched_story_id(new_item_ids[-1])
+        retried = set(state.dead_letters)
+        subtasks = [
+            sync_items.s(batch, mode, lease.token, [item_id for item_id in batch if item_id in retried])
+            for batch in (item_ids[i:i + batch_size] for i in range(0, len(item_ids), batch_size))
+        ]
+        logger.info(f"Dispatching {len(item_ids)} items to {len(subtasks)} sync subtasks")
+        run = {
+            "started_at": started_at,
+            "counts": {**metrics.as_dict(), "requests": metrics.requests, "subtasks": len(subtasks), "coordinator_time": time.time() - started_at},
+        }
+        if subtasks:
+            chord(subtasks)(finalize_sync.s(mode, cursor, lease.token, run))
+        else:
+            finalize_sync([], mode, cursor, lease.token, run)
 
     except Exception as e:
         logger.error(f"Error syncing stories and jobs: {str(e)}")
+        # Nothing will sync the claimed items, so the next run can take them at once
+        release_items(claimed)
+        lease.release()
 
 
-def fetch_initial_story_ids(category):
+@shared_task(name="sync_items")
+def sync_items(item_ids, mode=SyncState.LATEST, lease_token=None, retried_ids=()):
     """
-    Fetch the first 100 item IDs from Hacker News based on category.
-    :param category: "newstories" for news, "jobstories" for jobs
+    Fetch and save a batch of items. In latest mode their comment trees are crawled too.
+    :param lease_token: Token of the coordinator's lease, renewed while the batch is processed
+    :param retried_ids: IDs retried from the dead letters; their comment trees are crawled even
+        when the stored story looks unchanged, since the story may be stored without them
+    :return: {"counts": crawl and write counters, "failed_ids": IDs to retry on the next run,
+              "changed_stories": IDs of the stories written}
     """
+    follow_kids = mode != SyncState.INCREMENTAL
+    started = time.monotonic()
     try:
-        response = requests.get(f"{HACKER_NEWS_BASE_URL}/{category}.json?print=pretty")
-        response.raise_for_status()
-        # Ensure we only select the top 100 stories, in descending order
-        return response.json()[:100]
+        lease = Lease(f"sync:{mode}", token=lease_token) if lease_token else None
+        retried_ids = set(retried_ids)
+        known_trees = load_known_trees([item_id for item_id in item_ids if item_id not in retried_ids]) if follow_kids else None
+        # The subtasks of a run share its error budget, circuit breaker and rate limit
+        crawler = StoryCrawler(client_kwargs={"run_limits": RunLimits(lease)} if lease else None)
+        with BulkWriter() as writer:
+            for depth, item_data in crawler.crawl(item_ids, follow_kids=follow_kids, known_trees=known_trees):
+                write_item(writer, item_data)
+                if lease:
+                    lease.heartbeat()
+
+        logger.info(f"Wrote {writer.created} new and {writer.updated} updated rows in {writer.flushes} batches "
+                    f"({writer.write_time:.2f}s), {writer.unchanged} rows unchanged")
+
+        counts = {
+            **crawler.stats.as_dict(),
+            "created": writer.created,
+            "updated": writer.updated,
+            "unchanged": writer.unchanged,
+            "write_time": writer.write_time,
+            "task_time": time.monotonic() - started,
+        }
+        return {"counts": counts, "failed_ids": crawler.failed_ids, "changed_stories": writer.changed_stories}
+
     except Exception as e:
-        logger.error(f"Error fetching {category}: {str(e)}")
-        return []
+        logger.error(f"Error syncing items {item_ids[:1]}..{item_ids[-1:]}: {str(e)}")
+        return {"counts": {}, "failed_ids": item_ids}
+    finally:
+        release_items(item_ids)
 
 
-def fetch_and_save_story(item_id):
+@shared_task(name="finalize_sync")
+def finalize_sync(results, mode, cursor, lease_token=None, run=None):
     """
-    Fetches story/job details and saves them to the database.
-    Runs in parallel using ThreadPoolExecutor.
+    Chord callback of sync_news_to_db: merge the subtask results, place comments whose parent
+    arrived after them, save the sync state, update the ranked feeds, record the run, queue the
+    cache warming and release the lease.
+    :param run: {"started_at": Unix time the coordinator started, "counts": the coordinator's own counters}
     """
+    run = run or {}
+    counts = merge_counts([run.get("counts", {})] + [result["counts"] for result in results])
+    feeds, changed = [], None
     try:
-        # Fetch story/job details
-        response = requests.get(f"{HACKER_NEWS_BASE_URL}/item/{item_id}.json?print=pretty")
-        response.raise_for_status()
-        item_data = response.json()
-
-        # Save or update the item in the database
-        news_item, created = News.objects.update_or_create(
-            item_id=item_data.get("id"),
-            defaults={
-                "type": item_data.get("type", "unknown"),
-                "author": item_data.get("by", "unknown"),
-                "date_created": datetime.fromtimestamp(item_data.get("time", datetime.now().timestamp())),
-                "is_posted": False,
-                "kids": item_data.get("kids", []),
-                "text": item_data.get("text", ""),
-                "descendants": item_data.get("descendants", 0),
-                "score": item_data.get("score", 0),
-                "url": item_data.get("url", ""),
-                "title": item_data.get("title", ""),
-            }
-        )
+        failed_ids = [item_id for result in results for item_id in result["failed_ids"]]
+        counts["placed"] = place_unplaced_comments()
+        save_sync_state(load_sync_state(mode), cursor, counts, failed_ids)
+        changed_stories = [item_id for result in results for item_id in result.get("changed_stories", [])]
+        feeds = update_feeds(News.objects.filter(item_id__in=changed_stories))
+        changed = data_changed(counts, feeds)
+        if changed:
+            bump_data_version()
+        sync_run = record_sync_run(mode, run.get("started_at"), counts)
+        logger.info(f"Sync {mode} took {sync_run.wall_time:.2f}s, {sync_run.write_time:.2f}s of it writing")
+        if changed and settings.HN_WARM_BUDGET:
+            try:
+                warm_caches.delay(sync_run.pk)
+            except Exception as e:
+                logger.error(f"Error queueing the cache warming: {str(e)}")
+    finally:
+        # The subtasks' rows are written even when finalizing them failed
+        if changed is None and data_changed(counts, feeds):
+            bump_data_version()
+        if lease_token:
+            lease = Lease(f"sync:{mode}", token=lease_token)
+            lease.release()
+            if lease.take_rerun():
+                logger.info(f"Starting the sync {mode} run queued while this one was running")
+                sync_news_to_db.delay(mode)
+    return counts
 
-        # Fetch and save comments if the story has any
-        if item_data.get("kids"):
-            fetch_and_save_comments(item_data.get("kids"), news_item)
 
-    except Exception as e:
-        logger.error(f"Error syncing story {item_id}: {str(e)}")
+def data_changed(counts, feeds):
+    """
+    Whether a sync changed what the cached pages show: rows written or placed, or feeds rewritten.
+    """
+    return bool(counts.get("created") or counts.get("updated") or counts.get("placed") or feeds)
 
 
-def fetch_and_save_comments(comment_ids, parent_news=None, parent_comment_id=None):
+@shared_task(name="update_ranked_feeds")
+def update_ranked_feeds(news_ids):
     """
-    Recursively fetch and save comments to the database.
-    :param comment_ids: List of comment IDs to fetch
-    :param parent_news: The News object to associate with the comment
-    :param parent_comment_id: The Hacker News ID of the parent comment
+    Merge stories written through the API into the ranked feeds, queued by schedule_feed_update.
+    Cached pages are invalidated when a feed changed.
+    :param news_ids: pks of the created or updated stories, none after a delete
     """
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        executor.map(lambda cid: fetch_and_save_single_comment(cid, parent_news, parent_comment_id), comment_ids)
+    feeds = update_feeds(News.objects.filter(pk__in=news_ids))
+    if feeds:
+        bump_data_version()
+    return feeds
 
 
-def fetch_and_save_single_comment(comment_id, parent_news, parent_comment_id):
+@shared_task(name="refresh_page")
+def refresh_page(path):
     """
-    Fetches a single comment and saves it to the database.
-    Runs in parallel using ThreadPoolExecutor.
+    Render a stale server-side page again and store it in the page cache.
+    :param path: Path with its query string
     """
-    try:
-        # Fetch comment details
-        response = requests.get(f"{HACKER_NEWS_BASE_URL}/item/{comment_id}.json?print=pretty")
-        response.raise_for_status()
-        comment_data = response.json()
-
-        # Skip deleted or dead comments
-        if comment_data.get("deleted") or comment_data.get("dead"):
-            logger.info(f"Skipping deleted/dead comment {comment_id}")
-            return
-
-        # Use the parent field from the Hacker News API response
-        parent_id = comment_data.get("parent")  # Directly from API
-
-        # Add the comment to the database
-        comment, created = Comment.objects.update_or_create(
-            comment_id=comment_data.get("id"),
-            defaults={
-                "text": comment_data.get("text", ""),
-                "date_posted": datetime.fromtimestamp(comment_data.get("time", datetime.now().timestamp())),
-                "kids": comment_data.get("kids", []),
-                "type": comment_data.get("type", "comment"),
-                "author": comment_data.get("by", "unknown"),
-                "parent": parent_id,  # Now using the actual Hacker News parent field
-            }
+    return render_page(path)
+
+
+@shared_task(name="warm_caches")
+def warm_caches(sync_run_id=None):
+    """
+    Render the hot pages of the new data version into the page and API caches, so the first
+    visitors after a sync are not the ones paying for it. The coverage report is logged and
+    stored in the counts of the sync run.
+    """
+    report = warm_pages(hot_paths())
+    logger.info(
+        f"Warmed {report['warmed']} of {report['planned']} pages in {report['time']:.2f}s "
+        f"({report['failed']} failed, {report['skipped']} over budget)"
+    )
+    if sync_run_id is not None:
+        sync_run = SyncRun.objects.filter(pk=sync_run_id).first()
+        if sync_run is not None:
+            sync_run.counts["warming"] = report
+            sync_run.save(update_fields=["counts"])
+    return report
+
+
+def claim_items(item_ids):
+    """
+    Claim items for this run and return the ones not already claimed by an overlapping run.
+    Claims expire after HN_SYNC_CLAIM_TTL seconds in case a subtask never finishes.
+    """
+    return [
+        item_id for item_id in item_ids
+        if cache.add(f"sync:claim:{item_id}", True, timeout=settings.HN_SYNC_CLAIM_TTL)
+    ]
+
+
+def release_items(item_ids):
+    cache.delete_many([f"sync:claim:{item_id}" for item_id in item_ids])
+
+
+async def fetch_latest_story_ids(metrics=None):
+    """
+    Fetch the IDs of the latest 100 stories and job postings, newest first.
+    :param metrics: RequestMetrics to record the requests in
+    """
+    async with HackerNewsClient() as client:
+        client.metrics = metrics or client.metrics
+        # Fetch the latest 100 stories and job postings
+        news_ids, job_ids = await asyncio.gather(
+            client.fetch_story_ids("newstories"),
+            client.fetch_story_ids("jobstories"),
         )
 
-        # Fetch nested comments if any
-        if comment_data.get("kids"):
-            fetch_and_save_comments(comment_data.get("kids"), parent_news, comment.comment_id)
+    # Merge both lists to remove duplicates and keep the newest 100
+    return sorted(set(news_ids + job_ids), reverse=True)[:100]
 
-    except Exception as e:
-        logger.error(f"Error syncing comment {comment_id}: {str(e)}")
+
+def load_known_trees(item_ids):
+    """
+    Return the stored `{item_id: (descendants, kids)}` of the given stories.
+    """
+    return {
+        item_id: (descendants or 0, kids or [])
+        for item_id, descendants, kids in News.objects.filter(item_id__in=item_ids).values_list("item_id", "descendants", "kids")
+    }
 
 
-def set_last_fetched_story_id(story_id):
+async def fetch_changed_item_ids(cursor, metrics=None):
     """
-    Store the last fetched story ID (this should ideally be stored in a database or a persistent file).
+    Work out which items to fetch in incremental mode.
+    New items are walked upwards from the cursor, at most HN_SYNC_MAX_NEW_ITEMS per run, so a
+    worker that fell behind catches up over several runs. On the first run (cursor 0) only the
+    last HN_SYNC_MAX_NEW_ITEMS items are fetched.
+    :param cursor: The highest item ID already fetched
+    :param metrics: RequestMetrics to record the requests in
+    :return: (item IDs to fetch, new cursor)
     """
-    # For now, we are just logging it, but ideally, this should be saved to a persistent storage
-    logger.info(f"Last fetched story ID: {story_id}")
-    # Save this ID to the database or a file for future reference.
+    async with HackerNewsClient() as client:
+        client.metrics = metrics or client.metrics
+        max_item, updates = await asyncio.gather(
+            client.get_json("maxitem.json"),
+            client.get_json("updates.json"),
+        )
+
+    limit = settings.HN_SYNC_MAX_NEW_ITEMS
+    start = cursor or max(0, max_item - limit)
+    end = min(max_item, start + limit)
+
+    # Updated items above `start` are fetched as new items anyway
+    changed_ids = [item_id for item_id in (updates or {}).get("items", []) if item_id <= start]
+    return changed_ids + list(range(start + 1, end + 1)), end
 
 
-def get_last_fetched_item_id():
+def write_item(writer, item_data):
     """
-    Retrieve the last fetched story ID from the database.
+    Queue a fetched item on the writer, routing comments and stories/jobs/polls to their models.
     """
-    try:
-        last_story = News.objects.order_by('-item_id').first()
-        return last_story.item_id if last_story else 0  # If no stories exist, return 0
-    except Exception as e:
-        logger.error(f"Error fetching last fetched item ID: {str(e)}")
-        return 0
+    row = item_row(item_data)
+    if row:
+        writer.add(*row)
+
+
+def item_row(item_data):
+    """
+    Map a Hacker News item to (model, Hacker News ID, field values), or None for poll options.
+    """
+    item_type = item_data.get("type")
+    if item_type == "comment":
+        return Comment, item_data["id"], comment_defaults(item_data)
+    elif item_type != "pollopt":
+        return News, item_data["id"], story_defaults(item_data)
+    return None
+
+
+def story_defaults(item_data):
+    """
+    Map a Hacker News story/job item to News field values.
+    """
+    return {
+        "type": item_data.get("type", "unknown"),
+        "author": item_data.get("by", "unknown"),
+        "date_created": datetime.fromtimestamp(item_data.get("time", datetime.now().timestamp()), tz=dt_timezone.utc),
+        "is_posted": False,
+        "kids": item_data.get("kids", []),
+        "text": item_data.get("text", ""),
+        "descendants": item_data.get("descendants", 0),
+        "score": item_data.get("score", 0),
+        "url": item_data.get("url", ""),
+        "title": item_data.get("title", ""),
+        "fingerprint": item_fingerprint(item_data),
+    }
+
+
+def comment_defaults(comment_data):
+    """
+    Map a Hacker News comment item to Comment field values.
+    """
+    return {
+        "text": comment_data.get("text", ""),
+        "date_posted": datetime.fromtimestamp(comment_data.get("time", datetime.now().timestamp()), tz=dt_timezone.utc),
+        "kids": comment_data.get("kids", []),
+        "type": comment_data.get("type", "comment"),
+        "author": comment_data.get("by", "unknown"),
+        "parent": comment_data.get("parent"),  # Directly from the Hacker News API
+        "fingerprint": item_fingerprint(comment_data),
+        # Story and position in the thread, filled in by the writer
+        "news_id": None,
+        "depth": 0,
+        "path": "",
+    }
+
+
+def load_sync_state(mode):
+    """
+    Load the persisted state of a sync mode.
+    A new "latest" state starts from the newest story already in the database.
+    """
+    state, created = SyncState.objects.get_or_create(name=mode)
+    if created and mode == SyncState.LATEST:
+        state.cursor = News.objects.aggregate(cursor=Max("item_id"))["cursor"] or 0
+    return state
+
+
+def save_sync_state(state, cursor, counts, dead_letters=()):
+    """
+    Persist the cursor, counts and failed item IDs of a finished sync run.
+    """
+    state.cursor = cursor
+    state.last_run_at = timezone.now()
+    state.counts = counts
+    state.dead_letters = list(dict.fromkeys(dead_letters))[:settings.HN_DEAD_LETTER_LIMIT]
+    state.save()
+    if state.dead_letters:
+        logger.warning(f"Sync {state.name} left {len(state.dead_letters)} failed items for the next run")
+    logger.info(f"Sync {state.name} finished at item {cursor}: {counts}")
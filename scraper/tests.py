@@ -1,10 +1,46 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
+import fakeredis
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from .models import News, Comment
+from django.utils import timezone
+from .models import News, Comment, FeedEntry, SyncRun, SyncState
+from core.celery import app as celery_app
+from .cache import bump_data_version, get_data_version
+from .client import CircuitOpenError, HackerNewsClient
+from .crawler import StoryCrawler
+from .detail import load_comment_page
+from .feeds import update_feeds
+from .lease import Lease, RunLimits
+from .management.commands.import_items import iter_json_array
+from .pagination import KeysetPaginator
+from .search import is_search_index_installed, popular_searches, record_search, restore_search_triggers, search
+from .simulator import HackerNewsSimulator
+from .tree import build_thread, place_unplaced_comments
+from .warming import hot_paths, warm_pages
+from .tasks import (comment_defaults, finalize_sync, refresh_page, story_defaults, sync_news_to_db,
+                    update_ranked_feeds)
+from .writer import BulkWriter
 
 
 class NewsViewTests(TestCase):
 
+    def setUp(self):
+        # Rendered pages are cached per data version, which plain model writes do not bump
+        cache.clear()
+
     @classmethod
     def setUpTestData(cls):
         """Set up test data for News and Comments"""
@@ -61,3 +97,988 @@ class NewsViewTests(TestCase):
         self.assertContains(response, "Breaking News")
         self.assertContains(response, "This is a test news article")
         self.assertContains(response, "This is a test comment")  # Should show related comment
+
+
+class EagerCeleryMixin:
+    """
+    Run Celery tasks, groups and chords in-process against an empty cache and an in-process fake Redis.
+    Cache warming renders pages in the test thread, whose connection holds the test transaction.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        warming = override_settings(HN_WARM_CONCURRENCY=1)
+        warming.enable()
+        self.addCleanup(warming.disable)
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, "task_always_eager", False)
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("scraper.lease.redis_client", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+def hn_item(item_id, kids=(), **fields):
+    item = {"id": item_id, "type": "comment", "by": f"user{item_id}", "time": 1700000000 + item_id, "text": f"item {item_id}"}
+    if kids:
+        item["kids"] = list(kids)
+    item.update(fields)
+    return item
+
+
+class SyncNewsToDbTests(EagerCeleryMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.items = [
+            hn_item(1000, kids=[1001, 1002], type="story", title="Stub story", descendants=4, score=10),
+            hn_item(1001, kids=[1003], parent=1000),
+            hn_item(1002, parent=1000, dead=True),
+            hn_item(1003, kids=[1004], parent=1001),
+            hn_item(1004, parent=1003),
+            hn_item(2000, type="job", title="Stub job"),
+        ]
+
+    def sync(self, server, **overrides):
+        overrides = {"HN_FETCH_CONCURRENCY": 50, **overrides}
+        with override_settings(HN_API_BASE_URL=server.url, HN_RATE_LIMIT=0, HN_RETRY_BACKOFF=0, **overrides):
+            sync_news_to_db()
+        state = SyncState.objects.filter(name=SyncState.LATEST).first()
+        return state and state.counts
+
+    def test_sync_saves_stories_and_comment_trees(self):
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            self.sync(server)
+        self.assertEqual(set(News.objects.values_list("item_id", flat=True)), {1000, 2000})
+        self.assertEqual(News.objects.get(item_id=1000).title, "Stub story")
+        # Dead comments are skipped, nested replies are followed
+        self.assertEqual(set(Comment.objects.values_list("comment_id", flat=True)), {1001, 1003, 1004})
+        self.assertEqual(Comment.objects.get(comment_id=1004).parent, 1003)
+
+    def test_sync_reuses_pooled_connections(self):
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            self.sync(server)
+        self.assertEqual(len(server.httpd.paths), 8)
+        self.assertLess(len(server.httpd.connections), len(server.httpd.paths))
+
+    def test_sync_skips_unchanged_comment_trees(self):
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            self.sync(server)
+
+            # The second run refetches the stories but not their unchanged comment trees
+            server.httpd.paths.clear()
+            counts = self.sync(server)
+        self.assertEqual(sorted(server.httpd.paths), ["item/1000.json", "item/2000.json", "jobstories.json", "newstories.json"])
+        self.assertEqual(counts["subtrees_skipped"], 1)
+        self.assertEqual((counts["created"], counts["updated"], counts["unchanged"]), (0, 0, 2))
+
+    def test_retried_stories_crawl_their_unchanged_trees(self):
+        """A story written before its comment crawl failed is crawled again when retried"""
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            self.sync(server)
+            Comment.objects.all().delete()
+            SyncState.objects.filter(name=SyncState.LATEST).update(dead_letters=[1000])
+            counts = self.sync(server)
+        self.assertEqual(counts["subtrees_skipped"], 0)
+        self.assertEqual(set(Comment.objects.values_list("comment_id", flat=True)), {1001, 1003, 1004})
+
+    def test_sync_rewrites_only_changed_items(self):
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            self.sync(server)
+
+            # A new reply changes the story's descendants count and its parent's kids
+            server.httpd.routes["item/1000.json"]["descendants"] = 5
+            server.httpd.routes["item/1004.json"]["kids"] = [1005]
+            server.httpd.routes["item/1005.json"] = hn_item(1005, parent=1004)
+            counts = self.sync(server)
+        self.assertEqual(counts["subtrees_skipped"], 0)
+        self.assertEqual((counts["created"], counts["updated"], counts["unchanged"]), (1, 2, 3))
+        self.assertEqual(Comment.objects.get(comment_id=1004).kids, [1005])
+        self.assertNotEqual(News.objects.get(item_id=1000).fingerprint, "")
+
+    def test_sync_retries_transient_errors(self):
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            server.httpd.failures = {"item/1001.json": [503, 502], "item/1003.json": [404]}
+            counts = self.sync(server)
+        self.assertEqual(server.httpd.paths.count("item/1001.json"), 3)
+        # 404 is not retried, so the reply below it is not reached
+        self.assertEqual(server.httpd.paths.count("item/1003.json"), 1)
+        self.assertEqual(set(Comment.objects.values_list("comment_id", flat=True)), {1001})
+        self.assertEqual(SyncState.objects.get(name=SyncState.LATEST).dead_letters, [1003])
+        self.assertEqual(counts["failed"], 1)
+
+    def test_circuit_breaker_stops_sync_and_dead_letters_are_retried(self):
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            server.httpd.failures = {f"item/{item_id}.json": [503] * 10 for item_id in (1001, 1002)}
+            counts = self.sync(server, HN_FETCH_CONCURRENCY=1, HN_FETCH_RETRIES=1, HN_CIRCUIT_BREAKER_THRESHOLD=2)
+            self.assertTrue(counts["circuit_open"])
+            self.assertEqual(sorted(SyncState.objects.get(name=SyncState.LATEST).dead_letters), [1001, 1002])
+
+            server.httpd.failures = {}
+            server.httpd.paths.clear()
+            counts = self.sync(server, HN_FETCH_CONCURRENCY=1)
+        self.assertEqual(server.httpd.paths[2:4], ["item/1001.json", "item/1002.json"])
+        self.assertFalse(counts["circuit_open"])
+        self.assertEqual(SyncState.objects.get(name=SyncState.LATEST).dead_letters, [])
+        self.assertEqual(set(Comment.objects.values_list("comment_id", flat=True)), {1001, 1003, 1004})
+
+    def test_sync_fans_out_and_merges_subtask_counts(self):
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            counts = self.sync(server, HN_SYNC_STORIES_PER_TASK=1)
+        # One subtask per story, each with its own crawl
+        self.assertEqual(counts["stories"], 2)
+        self.assertEqual(counts["comments"], 3)
+        self.assertEqual(counts["width"], {"0": 2, "1": 1, "2": 1, "3": 1})
+        self.assertEqual(counts["created"], 5)
+
+    def test_sync_skips_items_claimed_by_an_overlapping_run(self):
+        cache.add("sync:claim:1000", True)
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            self.sync(server)
+        self.assertNotIn("item/1000.json", server.httpd.paths)
+        self.assertEqual(list(News.objects.values_list("item_id", flat=True)), [2000])
+        # Claims of the finished run are released
+        self.assertIsNone(cache.get("sync:claim:2000"))
+
+    def test_failed_dispatch_releases_the_claims(self):
+        """Items claimed by a run whose subtasks could not be dispatched are left to the next run"""
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            with mock.patch("scraper.tasks.chord", side_effect=ConnectionError("broker down")):
+                self.sync(server)
+            self.assertIsNone(cache.get("sync:claim:1000"))
+            self.assertIsNone(self.redis.get("lease:sync:latest"))
+            self.sync(server)
+        self.assertEqual(set(News.objects.values_list("item_id", flat=True)), {1000, 2000})
+
+    def test_failed_finalize_still_releases_the_lease(self):
+        """A sync whose finalizing fails invalidates the pages of its written rows and lets the queued run start"""
+        running = Lease("sync:latest", client=self.redis)
+        running.acquire()
+        running.request_rerun()
+        version = bump_data_version()
+        with mock.patch("scraper.tasks.update_feeds", side_effect=RuntimeError("feeds")), \
+                mock.patch("scraper.tasks.sync_news_to_db.delay") as rerun:
+            with self.assertRaises(RuntimeError):
+                finalize_sync([{"counts": {"created": 1}, "failed_ids": [], "changed_stories": []}],
+                              SyncState.LATEST, 0, running.token)
+        self.assertIsNone(self.redis.get("lease:sync:latest"))
+        rerun.assert_called_once_with(SyncState.LATEST)
+        self.assertGreater(get_data_version(), version)
+
+    def test_sync_is_skipped_while_another_run_holds_the_lease(self):
+        Lease("sync:latest", client=self.redis).acquire()
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            self.sync(server)
+        self.assertEqual(server.httpd.paths, [])
+        self.assertFalse(SyncState.objects.exists())
+
+    def test_overlapping_ticks_coalesce_into_one_rerun(self):
+        running = Lease("sync:latest", client=self.redis)
+        running.acquire()
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            with override_settings(HN_SYNC_COALESCE="queue"):
+                self.sync(server)
+                self.sync(server)
+            self.assertEqual(server.httpd.paths, [])
+
+            # The running sync finishes and starts the queued run exactly once
+            with override_settings(HN_API_BASE_URL=server.url, HN_RATE_LIMIT=0):
+                finalize_sync([], SyncState.LATEST, 0, running.token)
+        self.assertEqual(server.httpd.paths.count("newstories.json"), 1)
+        self.assertEqual(News.objects.count(), 2)
+        self.assertIsNone(self.redis.get("lease:sync:latest"))
+
+    def test_sync_persists_cursor_and_counts(self):
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            self.sync(server)
+        state = SyncState.objects.get(name=SyncState.LATEST)
+        self.assertEqual(state.cursor, 2000)
+        self.assertIsNotNone(state.last_run_at)
+        self.assertEqual(state.counts["created"], 5)
+
+
+class SyncMetricsTests(EagerCeleryMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.items = [
+            hn_item(1000, kids=[1001, 1002], type="story", title="Stub story", descendants=3),
+            hn_item(1001, kids=[1003], parent=1000),
+            hn_item(1002, parent=1000),
+            hn_item(1003, parent=1001),
+            hn_item(2000, type="job", title="Stub job"),
+        ]
+
+    def sync(self, **overrides):
+        with HackerNewsSimulator(self.items, newstories=[1000], jobstories=[2000]) as server:
+            server.httpd.failures = {"item/1002.json": [503]}
+            with override_settings(HN_API_BASE_URL=server.url, HN_RATE_LIMIT=0, HN_RETRY_BACKOFF=0, **overrides):
+                sync_news_to_db()
+        return SyncRun.objects.latest("started_at")
+
+    def test_sync_run_records_timings_and_counters(self):
+        run = self.sync(HN_SYNC_STORIES_PER_TASK=1)
+        self.assertEqual((run.mode, run.items_fetched, run.created, run.failed), (SyncState.LATEST, 5, 5, 0))
+        # Both list requests of the coordinator and every item request including the retry
+        self.assertEqual(run.requests, 8)
+        self.assertGreaterEqual(run.wall_time, run.write_time)
+        self.assertEqual(run.counts["subtasks"], 2)
+        self.assertEqual(run.counts["statuses"], {"newstories:200": 1, "jobstories:200": 1, "item:200": 5, "item:503": 1})
+        self.assertEqual(run.counts["latency"]["item"]["count"], 6)
+        self.assertEqual(sum(run.counts["latency"]["item"]["buckets"]), 6)
+        # The job has no comments, the story three
+        comments = run.counts["comments_per_story"]
+        self.assertEqual((comments["count"], comments["sum"]), (2, 3))
+
+    def test_metrics_endpoint_renders_prometheus_text(self):
+        self.sync()
+        self.sync()
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn("# TYPE hn_sync_runs_total counter", body)
+        self.assertIn('hn_sync_runs_total{mode="latest"} 2', body)
+        self.assertIn('hn_sync_rows_created_total{mode="latest"} 5', body)
+        # The second run only refetches the story and the job, the story's comments are unchanged
+        self.assertIn('hn_sync_last_run_items{mode="latest",kind="unchanged"} 2', body)
+        self.assertIn('hn_sync_last_run_responses{mode="latest",endpoint="item",status="200"} 2', body)
+        self.assertIn('hn_sync_last_run_request_duration_seconds_bucket{mode="latest",endpoint="item",le="+Inf"} 2', body)
+        self.assertIn('hn_sync_last_run_request_duration_seconds_count{mode="latest",endpoint="item"} 2', body)
+
+    def test_metrics_endpoint_without_runs(self):
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("# TYPE hn_sync_runs_total counter", response.content.decode())
+
+
+class IncrementalSyncTests(EagerCeleryMixin, TestCase):
+
+    def sync(self, server):
+        with override_settings(HN_API_BASE_URL=server.url, HN_RATE_LIMIT=0, HN_SYNC_MAX_NEW_ITEMS=3):
+            sync_news_to_db(mode=SyncState.INCREMENTAL)
+        return SyncState.objects.get(name=SyncState.INCREMENTAL).counts
+
+    def test_walks_new_and_updated_items(self):
+        items = [
+            hn_item(1, type="story", title="Old story", kids=[2]),
+            hn_item(2, parent=1),
+            hn_item(3, parent=1, dead=True),
+            hn_item(4, type="job", title="Job"),
+            hn_item(5, parent=2),
+            hn_item(6, type="pollopt"),
+        ]
+        with HackerNewsSimulator(items) as server:
+            server.httpd.routes["maxitem.json"] = 4
+            server.httpd.routes["updates.json"] = {"items": [], "profiles": []}
+            self.sync(server)
+            # The first run only looks at the last HN_SYNC_MAX_NEW_ITEMS items
+            self.assertEqual(SyncState.objects.get(name=SyncState.INCREMENTAL).cursor, 4)
+            self.assertEqual(list(Comment.objects.values_list("comment_id", flat=True)), [2])
+            self.assertEqual(set(News.objects.values_list("item_id", flat=True)), {4})
+
+            server.httpd.routes["maxitem.json"] = 6
+            server.httpd.routes["updates.json"] = {"items": [1, 5], "profiles": []}
+            server.httpd.paths.clear()
+            self.sync(server)
+
+        self.assertEqual(sorted(server.httpd.paths), sorted([
+            "maxitem.json", "updates.json", "item/1.json", "item/5.json", "item/6.json",
+        ]))
+        self.assertEqual(set(News.objects.values_list("item_id", flat=True)), {1, 4})
+        self.assertEqual(set(Comment.objects.values_list("comment_id", flat=True)), {2, 5})
+        self.assertEqual(SyncState.objects.get(name=SyncState.INCREMENTAL).cursor, 6)
+
+
+class StoryCrawlerTests(TestCase):
+
+    def setUp(self):
+        # A story with 3 top-level comments, each with 2 replies
+        self.items = [hn_item(1, kids=[10, 20, 30], type="story")]
+        for top in (10, 20, 30):
+            self.items.append(hn_item(top, kids=[top + 1, top + 2], parent=1))
+            self.items += [hn_item(top + 1, parent=top), hn_item(top + 2, parent=top)]
+
+    def test_crawl_is_bounded_and_reports_shape(self):
+        peak_threads = []
+        with HackerNewsSimulator(self.items) as server:
+            crawler = StoryCrawler(workers=4, frontier_size=2, max_in_flight=3,
+                                   client_kwargs={"base_url": server.url, "rate_limit": 0})
+            items = []
+            for depth, item in crawler.crawl([1]):
+                peak_threads.append(sum(t.name.startswith("hn-") for t in threading.enumerate()))
+                items.append((depth, item["id"]))
+
+        self.assertEqual(sorted(items), sorted([(0, 1)] + [(1, t) for t in (10, 20, 30)]
+                                               + [(2, t + n) for t in (10, 20, 30) for n in (1, 2)]))
+        self.assertLessEqual(max(peak_threads), 2)
+        stats = crawler.stats.as_dict()
+        self.assertEqual(stats["max_depth"], 2)
+        self.assertEqual(stats["width"], {0: 1, 1: 3, 2: 6})
+        self.assertEqual(stats["requests"], 10)
+        self.assertLessEqual(stats["frontier_peak"], 2)
+        self.assertLessEqual(stats["in_flight_peak"], 3)
+
+    def test_crawl_stops_when_caller_stops(self):
+        with HackerNewsSimulator(self.items) as server:
+            crawler = StoryCrawler(workers=1, frontier_size=1, max_in_flight=1,
+                                   client_kwargs={"base_url": server.url, "rate_limit": 0})
+            for depth, item in crawler.crawl([1]):
+                break
+        self.assertLess(crawler.stats.requests, 10)
+
+
+class BulkWriterTests(TestCase):
+
+    def test_batch_is_written_in_constant_queries(self):
+        News.objects.create(item_id=1, type="story", author="old", title="Old title")
+        with CaptureQueriesContext(connection) as queries:
+            with BulkWriter(batch_size=1000, flush_interval=60) as writer:
+                for item_id in range(1, 51):
+                    writer.add(News, item_id, story_defaults(hn_item(item_id, type="story", title=f"Story {item_id}")))
+                for comment_id in range(100, 180):
+                    writer.add(Comment, comment_id, comment_defaults(hn_item(comment_id, parent=1)))
+                self.assertEqual(len(queries), 0)
+
+        # SELECT + upsert per model, plus savepoints
+        self.assertLessEqual(len([q for q in queries if "SAVEPOINT" not in q["sql"]]), 4)
+        self.assertEqual((writer.created, writer.updated), (129, 1))
+        self.assertEqual(News.objects.count(), 50)
+        self.assertEqual(News.objects.get(item_id=1).title, "Story 1")
+        self.assertEqual(Comment.objects.count(), 80)
+
+    def test_flushes_when_batch_is_full(self):
+        writer = BulkWriter(batch_size=10, flush_interval=60)
+        for comment_id in range(25):
+            writer.add(Comment, comment_id, comment_defaults(hn_item(comment_id)))
+        self.assertEqual(writer.flushes, 2)
+        self.assertEqual(writer.pending, 5)
+        writer.flush()
+        self.assertEqual(Comment.objects.count(), 25)
+
+
+class LeaseTests(TestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+
+    def test_only_one_holder(self):
+        first = Lease("sync", ttl=5, client=self.redis)
+        second = Lease("sync", ttl=5, client=self.redis)
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        # Only the holder can renew or release
+        self.assertFalse(Lease("sync", token="other", client=self.redis).release())
+        self.assertTrue(first.renew())
+        self.assertTrue(first.release())
+        self.assertTrue(second.acquire())
+
+    def test_stale_lease_is_taken_over(self):
+        stale = Lease("sync", ttl=0.1, client=self.redis)
+        stale.acquire()
+        time.sleep(0.15)
+        fresh = Lease("sync", ttl=5, client=self.redis)
+        self.assertTrue(fresh.acquire())
+        self.assertFalse(stale.renew())
+        self.assertFalse(stale.release())
+        self.assertEqual(self.redis.get("lease:sync").decode(), fresh.token)
+
+    def test_heartbeat_keeps_the_lease_alive(self):
+        lease = Lease("sync", ttl=0.3, client=self.redis)
+        lease.acquire()
+        for _ in range(5):
+            time.sleep(0.1)
+            self.assertTrue(lease.heartbeat())
+        self.assertFalse(Lease("sync", client=self.redis).acquire())
+
+    def test_run_limits_are_shared_by_its_clients(self):
+        """Failures of one client spend the error budget of every client of the run"""
+        lease = Lease("sync", client=self.redis)
+        lease.acquire()
+
+        async def fetch(client, item_id):
+            async with client:
+                return await client.fetch_item(item_id)
+
+        with HackerNewsSimulator([hn_item(1), hn_item(2)]) as server:
+            server.httpd.failures = {"item/1.json": [404]}
+            first, second = (HackerNewsClient(base_url=server.url, rate_limit=0, error_budget=1,
+                                              run_limits=RunLimits(lease)) for _ in range(2))
+            asyncio.run(fetch(first, 1))
+            with self.assertRaises(CircuitOpenError):
+                asyncio.run(fetch(second, 2))
+        self.assertEqual(server.httpd.paths, ["item/1.json"])
+
+    def test_run_rate_limit_is_one_bucket(self):
+        limits = RunLimits(Lease("sync", token="run", client=self.redis))
+        self.assertEqual(limits.take_tokens("host", 10, 10, 6), 6)
+        self.assertEqual(limits.take_tokens("host", 10, 10, 6), 4)
+        self.assertEqual(limits.take_tokens("other", 10, 10, 6), 6)
+
+
+class KeysetPaginatorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        created = timezone.now()
+        # Two items share each timestamp and two have none, to exercise the tie-breaker and NULLs
+        for item_id in range(1, 24):
+            date_created = created - timezone.timedelta(minutes=item_id // 2) if item_id <= 21 else None
+            News.objects.create(item_id=item_id, type="story", author="a", title=f"Item {item_id}", date_created=date_created)
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, per_page):
+        paginator = KeysetPaginator(News.objects.all(), per_page, "date_created")
+        pages, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            pages.append([news.item_id for news in page])
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_row_once_in_order(self):
+        """Walking the cursors visits each row exactly once, newest first, NULLs last"""
+        for per_page in (1, 4, 10, 23, 50):
+            pages = self.walk(per_page)
+            item_ids = [item_id for page in pages for item_id in page]
+            self.assertEqual(len(item_ids), 23)
+            self.assertEqual(set(item_ids), set(range(1, 24)))
+            self.assertEqual(item_ids[-2:], [23, 22])
+            self.assertTrue(all(len(page) == per_page for page in pages[:-1]))
+
+    def test_deep_page_is_one_query(self):
+        """A page of dated rows costs one query without OFFSET or COUNT, however deep it is"""
+        paginator = KeysetPaginator(News.objects.all(), 5, "date_created")
+        cursor = paginator.page().next_cursor
+        for _ in range(2):
+            cursor = paginator.page(cursor).next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            paginator.page(cursor)
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]["sql"].upper()
+        self.assertNotIn("OFFSET", sql)
+        self.assertNotIn("COUNT(", sql)
+
+    @skipUnless(connection.vendor == "sqlite", "Checks an SQLite query plan")
+    def test_deep_page_is_an_index_range_scan(self):
+        """Pages seek into the descending (date_created, id) index instead of scanning or sorting"""
+        paginator = KeysetPaginator(News.objects.all(), 5, "date_created")
+        cursor = paginator.page(paginator.page().next_cursor).next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            paginator.page(cursor)
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {queries[0]['sql']}")
+            plan = " ".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("SEARCH scraper_news USING INDEX news_created_id_idx (", plan)
+        self.assertIn("date_created<?)", plan)
+        self.assertNotIn("SCAN", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+        # The NULL tail is a range of the same index
+        cursor = paginator.encode_cursor(News.objects.get(item_id=23))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual([news.item_id for news in paginator.page(cursor)], [22])
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {queries[0]['sql']}")
+            plan = " ".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("USING INDEX news_created_id_idx (date_created=? AND id<?)", plan)
+
+    def test_html_list_cursor_mode(self):
+        """The HTML list follows ?after= links when cursor pagination is requested"""
+        response = self.client.get(reverse("item_list"), {"pagination": "cursor"})
+        self.assertEqual(len(response.context["news_items"]), 10)
+        self.assertContains(response, "after=")
+
+        response = self.client.get(reverse("item_list"), {"after": response.context["next_cursor"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["news_items"]), 10)
+
+        response = self.client.get(reverse("item_list"), {"after": "not-a-cursor"})
+        self.assertEqual(response.status_code, 200)
+
+
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.title_match = News.objects.create(item_id=1, type="story", author="a", title="Postgres performance tuning",
+                                              text="Notes")
+        cls.text_match = News.objects.create(item_id=2, type="story", author="a", title="Weekly links",
+                                             text="A post about postgres internals")
+        News.objects.create(item_id=3, type="job", author="a", title="Hiring engineers", text="Remote")
+
+    def search_ids(self, query):
+        return [news.item_id for news in search(News.objects.all(), query)]
+
+    def test_ranked_prefix_search(self):
+        """Prefixes match and title hits rank above text hits"""
+        self.assertEqual(self.search_ids("postg"), [1, 2])
+        self.assertEqual(self.search_ids("postgres perf"), [1])
+        self.assertEqual(self.search_ids("hiring"), [3])
+
+    def test_mid_word_prefixes(self):
+        """Any prefix of a word matches it, as with the icontains scan the index replaced"""
+        News.objects.create(item_id=4, type="story", author="a", title="Breaking changes in programming languages")
+        for query in ("Break", "Breaki", "Breakin", "Breaking", "programm", "programmi", "langu", "chan"):
+            self.assertEqual(self.search_ids(query), [4], query)
+        self.assertEqual(self.search_ids("performance tun"), [1])
+        self.assertEqual(self.search_ids("programs"), [])
+
+    def test_operators_are_ignored(self):
+        """Query syntax characters are dropped instead of raising"""
+        self.assertEqual(self.search_ids('"postgres" OR ) *'), [])
+        self.assertEqual(self.search_ids('postgres*'), [1, 2])
+        self.assertEqual(self.search_ids("!!"), [])
+
+    def test_index_follows_writes(self):
+        """Bulk upserts, updates and deletes are reflected in the index"""
+        with BulkWriter() as writer:
+            writer.add(News, 4, story_defaults({"id": 4, "type": "story", "title": "Sqlite tricks", "time": 0}))
+            writer.add(News, 2, story_defaults({"id": 2, "type": "story", "title": "Weekly links", "time": 0}))
+        self.assertEqual(self.search_ids("sqlite"), [4])
+        self.assertEqual(self.search_ids("postgres"), [1])
+
+        News.objects.filter(item_id=1).update(title="Tuning")
+        self.assertEqual(self.search_ids("postgres"), [])
+        News.objects.filter(item_id=4).delete()
+        self.assertEqual(self.search_ids("sqlite"), [])
+
+    def test_comment_search(self):
+        """Comments are searchable through the API"""
+        Comment.objects.create(comment_id=10, parent=1, text="Try partial indexes")
+        Comment.objects.create(comment_id=11, parent=1, text="Looks good")
+        response = self.client.get("/api/item/comment/", {"text": "index"}, HTTP_ACCEPT="application/json")
+        self.assertEqual([comment["comment_id"] for comment in response.json()["results"]], [10])
+
+
+    @skipUnless(connection.vendor == "sqlite", "Checks the SQLite triggers")
+    def test_lost_triggers_are_restored(self):
+        """The migrated index is used, and triggers dropped by a table rebuild come back after migrate"""
+        self.assertTrue(is_search_index_installed(connection))
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER scraper_news_fts_insert")
+        News.objects.create(item_id=5, type="story", author="a", title="Written without triggers")
+        restore_search_triggers(connection)
+        self.assertEqual(self.search_ids("triggers"), [5])
+        News.objects.create(item_id=6, type="story", author="a", title="Triggers again")
+        self.assertEqual(self.search_ids("triggers"), [6, 5])
+
+@override_settings(HN_FEED_SIZE=3, HN_FEED_HOT_WINDOW=72)
+class FeedTests(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        self.news = {
+            item_id: News.objects.create(item_id=item_id, type="story", author="a", title=f"Story {item_id}",
+                                         score=score, descendants=descendants, date_created=now - timedelta(hours=age))
+            for item_id, score, descendants, age in [
+                (1, 100, 5, 48), (2, 50, 40, 1), (3, 10, 0, 0), (4, 80, 10, 100), (5, 5, 60, 2),
+            ]
+        }
+
+    def feed(self, feed):
+        return list(FeedEntry.objects.filter(feed=feed).order_by("position").values_list("news__item_id", flat=True))
+
+    def test_rebuild_ranks_every_feed(self):
+        self.assertEqual(sorted(update_feeds()), ["discussed", "hot", "top"])
+        self.assertEqual(self.feed("top"), [1, 4, 2])
+        self.assertEqual(self.feed("discussed"), [5, 2, 4])
+        # Fresh stories beat older ones with more points; story 4 is outside the hot window
+        self.assertEqual(self.feed("hot"), [2, 3, 5])
+        self.assertEqual(list(FeedEntry.objects.filter(feed="top").values_list("position", flat=True)), [1, 2, 3])
+
+    def test_changed_stories_are_merged_into_the_feeds(self):
+        update_feeds()
+        News.objects.filter(item_id=3).update(score=90)
+        # The changed story, the hot window, then each feed's entries and the rewrites of the changed feeds
+        with self.assertNumQueries(13):
+            rewritten = update_feeds(News.objects.filter(item_id=3))
+        self.assertEqual(rewritten, ["hot", "top"])
+        self.assertEqual(self.feed("top"), [1, 3, 4])
+
+    def test_unchanged_feeds_are_not_rewritten(self):
+        update_feeds()
+        self.assertEqual(update_feeds(News.objects.none()), [])
+
+    def test_deleted_stories_are_replaced_in_the_feeds(self):
+        update_feeds()
+        self.news[1].delete()
+        update_feeds(News.objects.none())
+        self.assertEqual(self.feed("top"), [4, 2, 3])
+
+    def test_dropped_stories_make_way_for_the_next_best(self):
+        """A story ranked below the feed is promoted when an entry drops under it"""
+        update_feeds()
+        News.objects.filter(item_id=1).update(score=1)
+        self.assertEqual(update_feeds(News.objects.filter(item_id=1)), ["top"])
+        self.assertEqual(self.feed("top"), [4, 2, 3])
+
+    def test_api_writes_are_merged_by_a_task(self):
+        update_feeds()
+        News.objects.filter(item_id=5).update(score=500)
+        self.assertEqual(update_ranked_feeds.apply(args=[[self.news[5].pk]]).get(), ["hot", "top"])
+        self.assertEqual(self.feed("top"), [5, 1, 4])
+
+    @skipUnless(connection.vendor == "postgresql", "Checks a PostgreSQL advisory lock")
+    def test_feed_rewrites_are_serialized(self):
+        with CaptureQueriesContext(connection) as queries:
+            update_feeds()
+        self.assertEqual(sum("pg_advisory_xact_lock" in query["sql"] for query in queries), 3)
+
+    @override_settings(HN_WARM_BUDGET=0)
+    def test_finalize_sync_updates_the_feeds(self):
+        update_feeds()
+        News.objects.filter(item_id=3).update(descendants=100)
+        finalize_sync([{"counts": {"updated": 1}, "failed_ids": [], "changed_stories": [3]}], SyncState.LATEST, 0)
+        self.assertEqual(self.feed("discussed"), [3, 5, 2])
+
+
+class CommentTreeTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def write(self, *items):
+        with BulkWriter(batch_size=1000, flush_interval=60) as writer:
+            for item in items:
+                if item["type"] == "comment":
+                    writer.add(Comment, item["id"], comment_defaults(item))
+                else:
+                    writer.add(News, item["id"], story_defaults(item))
+
+    def position(self, comment_id):
+        return Comment.objects.filter(comment_id=comment_id).values_list("news_id", "depth", "path").get()
+
+    def test_writer_places_comments(self):
+        """Root, depth and path are set whether the parent is in the batch, an earlier batch or the database"""
+        self.write(hn_item(1, type="story", kids=[10, 11]), hn_item(10, parent=1, kids=[12]), hn_item(11, parent=1))
+        self.write(hn_item(12, parent=10, kids=[13]), hn_item(13, parent=12), hn_item(99, parent=50))
+        self.assertEqual(self.position(10), (1, 1, "0000000010"))
+        self.assertEqual(self.position(11), (1, 1, "0000000011"))
+        self.assertEqual(self.position(13), (1, 3, "000000001000000000120000000013"))
+        # The parent of 99 is unknown: it is left unplaced and rewritten on the next sync
+        self.assertEqual(self.position(99), (None, 0, ""))
+        self.assertEqual(Comment.objects.get(comment_id=99).fingerprint, "")
+
+    def test_place_unplaced_comments(self):
+        """Replies written before their parents are linked to the story once the chain is stored"""
+        self.write(hn_item(30, parent=20), hn_item(40, parent=30))
+        self.write(hn_item(1, type="story"))
+        Comment.objects.create(comment_id=20, parent=1, author="a")
+        self.assertEqual(self.position(30), (None, 0, ""))
+
+        with self.assertNumQueries(4):
+            self.assertEqual(place_unplaced_comments(), 3)
+        self.assertEqual(self.position(20), (1, 1, "0000000020"))
+        self.assertEqual(self.position(40), (1, 3, "000000002000000000300000000040"))
+        self.assertEqual(list(News.objects.get(item_id=1).comments.order_by("path").values_list("comment_id", flat=True)),
+                         [20, 30, 40])
+
+    def test_build_thread_in_two_queries(self):
+        """The thread is nested from two queries and trimmed to the depth and breadth limits"""
+        self.write(
+            hn_item(1, type="story"),
+            *(hn_item(comment_id, parent=1) for comment_id in (10, 11, 12)),
+            *(hn_item(comment_id, parent=10) for comment_id in (20, 21, 22)),
+            hn_item(30, parent=20),
+            hn_item(40, parent=22),
+        )
+        with self.assertNumQueries(2):
+            comments, more_replies = build_thread(1, max_depth=2, max_breadth=2)
+        self.assertEqual([comment.comment_id for comment in comments], [10, 11])
+        self.assertEqual(more_replies, 1)
+        self.assertEqual([reply.comment_id for reply in comments[0].replies], [20, 21])
+        self.assertEqual(comments[0].more_replies, 1)
+        self.assertEqual(comments[0].replies[0].replies, [])
+
+        comments, _ = build_thread(1)
+        self.assertEqual([reply.comment_id for reply in comments[0].replies[2].replies], [40])
+
+    def test_truncated_thread_counts_what_was_left_out(self):
+        """Comments past HN_THREAD_MAX_COMMENTS are counted in more_replies, at every level"""
+        self.write(
+            hn_item(1, type="story"),
+            *(hn_item(comment_id, parent=1) for comment_id in (10, 11, 12)),
+            *(hn_item(comment_id, parent=10) for comment_id in (20, 21, 22)),
+        )
+        with self.settings(HN_THREAD_MAX_COMMENTS=3):
+            comments, more_replies = build_thread(1)
+        self.assertEqual([comment.comment_id for comment in comments], [10])
+        self.assertEqual(more_replies, 2)
+        self.assertEqual([reply.comment_id for reply in comments[0].replies], [20, 21])
+        self.assertEqual(comments[0].more_replies, 1)
+
+        comments, more_replies = build_thread(1, max_breadth=1)
+        self.assertEqual([comment.comment_id for comment in comments], [10])
+        self.assertEqual(more_replies, 2)
+        self.assertEqual([reply.comment_id for reply in comments[0].replies], [20])
+        self.assertEqual(comments[0].more_replies, 2)
+
+    def test_thread_views(self):
+        """The API and the HTML detail view return the nested thread"""
+        self.write(hn_item(1, type="story", title="Thread"), hn_item(10, parent=1), hn_item(20, parent=10))
+        news = News.objects.get(item_id=1)
+
+        data = self.client.get(reverse("item_thread", args=[news.pk]), HTTP_ACCEPT="application/json").json()
+        self.assertEqual(data["item"]["item_id"], 1)
+        self.assertEqual(data["comments"][0]["comment_id"], 10)
+        self.assertEqual(data["comments"][0]["replies"][0]["comment_id"], 20)
+
+        response = self.client.get(reverse("item_detail", args=[news.pk]), {"view": "thread"})
+        self.assertContains(response, "item 20")
+
+
+class StoryDetailTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        with BulkWriter(batch_size=1000, flush_interval=60) as writer:
+            # Hacker News ranks 12 above 10; 13 is a direct reply missing from the kids
+            writer.add(News, 1, story_defaults(hn_item(1, type="story", title="Detail", kids=[12, 10, 11])))
+            for item in (hn_item(10, parent=1), hn_item(11, parent=1), hn_item(12, parent=1), hn_item(13, parent=1),
+                         hn_item(20, parent=10), hn_item(21, parent=10), hn_item(30, parent=20)):
+                writer.add(Comment, item["id"], comment_defaults(item))
+        self.news = News.objects.get(item_id=1)
+
+    @override_settings(HN_DETAIL_COMMENTS=2)
+    def test_load_comment_page(self):
+        """The first page follows the story's kids, with reply counts from one aggregate query"""
+        with self.assertNumQueries(2):
+            comments, comment_count = load_comment_page(self.news)
+        self.assertEqual([comment.comment_id for comment in comments], [12, 10])
+        self.assertEqual([comment.reply_count for comment in comments], [0, 2])
+        self.assertEqual(comment_count, 4)
+
+        News.objects.filter(pk=self.news.pk).update(kids=None)
+        self.news.refresh_from_db()
+        comments, _ = load_comment_page(self.news, limit=3)
+        self.assertEqual([comment.comment_id for comment in comments], [10, 11])
+
+    @override_settings(HN_DETAIL_COMMENTS=2, HTML_CACHE_TIMEOUT=0)
+    def test_detail_view_queries(self):
+        """Without the page cache, the story page costs three queries, then one while its rendered comments are cached"""
+        url = reverse("item_detail", args=[self.news.pk])
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertContains(response, "Comments (4)")
+        self.assertContains(response, "item 12")
+        self.assertContains(response, "2 replies")
+        self.assertContains(response, "2 more comments")
+        self.assertNotContains(response, "item 11")
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).content, response.content)
+
+        # An edited comment is rendered again once the sync writing it bumps the data version
+        with BulkWriter(batch_size=1000, flush_interval=60) as writer:
+            writer.add(Comment, 12, comment_defaults(hn_item(12, parent=1, text="edited")))
+        bump_data_version()
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertContains(response, "edited")
+        self.assertNotContains(response, "item 12")
+
+
+class PageCacheTests(EagerCeleryMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.news = News.objects.create(item_id=1, type="story", title="Cached story", date_created=timezone.now())
+
+    def test_pages_served_from_cache(self):
+        """Pages are rendered once per data version and parameters, and revalidated with an ETag"""
+        url = reverse("item_list")
+        response = self.client.get(url)
+        self.assertContains(response, "Cached story")
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=cached["ETag"]).status_code, 304)
+        self.assertContains(self.client.get(url, {"search": "nothing"}), "No news items found")
+
+    def test_stale_while_revalidate(self):
+        """After a sync the stale page is served once while a task renders the new version"""
+        url = reverse("item_list")
+        self.client.get(url)
+        News.objects.filter(pk=self.news.pk).update(title="Renamed story")
+        bump_data_version()
+
+        with override_settings(HTML_CACHE_STALE_WHILE_REVALIDATE=False):
+            self.assertContains(self.client.get(url, {"type": "story"}), "Renamed story")
+
+        with mock.patch("scraper.tasks.refresh_page.delay", wraps=refresh_page.delay) as delay:
+            self.assertContains(self.client.get(url), "Cached story")
+            self.assertContains(self.client.get(url), "Renamed story")
+        delay.assert_called_once_with("/")
+
+
+@override_settings(HN_WARM_PAGES=1, HN_WARM_STORIES=1, HN_WARM_SEARCHES=1, HN_WARM_BASE_URL="http://testserver")
+class CacheWarmingTests(EagerCeleryMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        News.objects.create(item_id=1, type="story", title="Popular", score=50, date_created=timezone.now())
+        News.objects.create(item_id=2, type="job", title="Hiring", score=5, date_created=timezone.now())
+        update_feeds()
+        self.top = News.objects.get(item_id=1)
+
+    def test_hot_paths(self):
+        """The first pages per type and feed, the top stories and the popular searches are warmed"""
+        for query in ("rust", "rust", "go"):
+            record_search(query)
+        self.assertEqual(hot_paths(), [
+            "/", "/api/item/", "/?type=job", "/api/item/?type=job", "/?type=story", "/api/item/?type=story",
+            "/api/item/feed/hot/", "/api/item/feed/top/", "/api/item/feed/discussed/",
+            f"/detail/{self.top.pk}/", "/?search=rust", "/api/item/?search=rust",
+        ])
+
+    @override_settings(HN_WARM_BASE_URL="")
+    def test_api_pages_need_their_origin(self):
+        """API pages hold absolute links, so they are not warmed for an unknown origin"""
+        self.assertEqual(hot_paths(), ["/", "/?type=job", "/?type=story", f"/detail/{self.top.pk}/"])
+
+    def test_warmed_pages_are_served_from_cache(self):
+        """Warmed pages cost no queries, and paths left over when the budget runs out are reported"""
+        report = warm_pages(hot_paths(), concurrency=1)
+        self.assertEqual((report["planned"], report["warmed"], report["coverage"]), (10, 10, 1.0))
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get("/?type=story&search="), "Popular")
+            self.assertEqual(self.client.get("/api/item/feed/top/").json()["results"][0]["item_id"], 1)
+        # Other origins get pages with their own links
+        with self.assertNumQueries(1):
+            other = self.client.get("/api/item/feed/top/", HTTP_HOST="news.example.com").json()
+        self.assertEqual(other["results"][0]["item_id"], 1)
+
+        report = warm_pages(hot_paths(), budget=0)
+        self.assertEqual((report["warmed"], report["skipped"], report["coverage"]), (0, 10, 0.0))
+
+    def test_sync_warms_caches(self):
+        """A sync that changed data warms the caches and stores the coverage in its run"""
+        with mock.patch("scraper.tasks.warm_pages", wraps=warm_pages) as warm:
+            finalize_sync([{"counts": {"updated": 1}, "failed_ids": [], "changed_stories": []}], SyncState.LATEST, 0,
+                          run={"started_at": time.time(), "counts": {}})
+        warm.assert_called_once()
+        self.assertEqual(SyncRun.objects.get().counts["warming"]["coverage"], 1.0)
+
+
+class ImportItemsTests(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.items = [
+            hn_item(1, type="story", title="Story", kids=[2]),
+            hn_item(2, parent=1, kids=[3]),
+            hn_item(3, parent=2),
+            hn_item(4, type="pollopt"),
+            hn_item(5, type="job", title="Job"),
+        ]
+
+    def dump(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "wt", encoding="utf-8") as dump:
+            dump.write(content)
+        return path
+
+    def run_import(self, *paths, **options):
+        out = io.StringIO()
+        call_command("import_items", *paths, workers=2, chunk_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_import_jsonl_and_json_array(self):
+        """Gzipped JSONL and JSON arrays are mapped like synced items"""
+        jsonl = self.dump("items.jsonl.gz", "\n".join(json.dumps(item) for item in self.items[:3]) + "\nnot json\n")
+        array = self.dump("items.json", json.dumps(self.items[3:], indent=2))
+        self.run_import(jsonl, array)
+
+        self.assertEqual(sorted(News.objects.values_list("item_id", "type")), [(1, "story"), (5, "job")])
+        comment = Comment.objects.get(comment_id=3)
+        self.assertEqual((comment.parent, comment.news_id, comment.depth), (2, 1, 2))
+        self.assertEqual(comment.fingerprint, comment_defaults(self.items[2])["fingerprint"])
+        state = SyncState.objects.get(name__startswith="import:", name__endswith="items.jsonl.gz")
+        self.assertEqual(state.cursor, 4)
+        self.assertEqual((state.counts["created"], state.counts["invalid"]), (3, 1))
+
+    def test_resumes_after_saved_progress(self):
+        """A second run only reads the items added since the first one"""
+        path = self.dump("items.jsonl", "\n".join(json.dumps(item) for item in self.items[:2]) + "\n")
+        self.run_import(path)
+        with open(path, "a") as dump:
+            dump.write(json.dumps(self.items[2]) + "\n")
+
+        self.run_import(path)
+        state = SyncState.objects.get(name__startswith="import:")
+        self.assertEqual(state.cursor, 3)
+        self.assertEqual(state.counts["items"], 3)
+        self.assertEqual(state.counts["unchanged"], 0)
+        self.assertTrue(Comment.objects.filter(comment_id=3, news_id=1).exists())
+
+        self.run_import(path, restart=True)
+        state.refresh_from_db()
+        self.assertEqual((state.cursor, state.counts["unchanged"]), (3, 3))
+
+    def test_import_places_comments_and_ranks_feeds(self):
+        """Comments dumped before their story are placed and the story is ranked, once the import is done"""
+        path = self.dump("items.jsonl", "\n".join(json.dumps(item) for item in reversed(self.items[:3])) + "\n")
+        self.run_import(path)
+
+        comment = Comment.objects.get(comment_id=3)
+        self.assertEqual((comment.news_id, comment.depth), (1, 2))
+        story = News.objects.get(item_id=1)
+        self.assertEqual(list(FeedEntry.objects.filter(feed=FeedEntry.TOP).values_list("news_id", flat=True)),
+                         [story.pk])
+
+    def test_json_array_items_are_split_by_brackets(self):
+        """Array items are yielded as raw text, whatever the buffer boundaries and the brackets in strings"""
+        items = ['{"id": 1, "kids": [2, 3], "text": "a ] } \\" [ {"}', "12345", '"text, ]"', "[]"]
+        for buffer_size in (1, 4, 1 << 20):
+            dump = io.StringIO(" " + " ,\n".join(items) + " ]")
+            self.assertEqual(list(iter_json_array(dump, buffer_size=buffer_size)), items)
+        self.assertEqual([json.loads(item) for item in items][0]["text"], 'a ] } " [ {')
+
+    def test_malformed_json_array_fails_fast(self):
+        """An unclosed item stops the import without reading the rest of the array"""
+        dump = io.StringIO('{"id": 1}, {"id": 2, "kids": [3, ' + ", ".join(['{"id": 3}'] * 10000) + "]")
+        items = iter_json_array(dump, buffer_size=64, max_item_size=256)
+        self.assertEqual(next(items), '{"id": 1}')
+        with self.assertRaises(CommandError):
+            next(items)
+        self.assertLess(dump.tell(), 1024)
+
+        with self.assertRaises(CommandError):
+            list(iter_json_array(io.StringIO('{"id": 1}, {"id": 2')))
+
+
+class BenchmarkTests(TestCase):
+
+    def test_benchmark_writes_results_and_rolls_back(self):
+        """The benchmark syncs the simulated items, times the API and leaves the database as it was"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, "results.json")
+            cache.clear()
+            version = get_data_version()
+            with mock.patch("scraper.tasks.warm_caches.delay") as warm:
+                call_command("benchmark", stories=3, comments=5, shape="random", api_requests=5, concurrency=4,
+                             output=output, stdout=io.StringIO())
+            with open(output) as results_file:
+                results = json.load(results_file)
+
+        # Cache warming is not part of the timed sync
+        warm.assert_not_called()
+        self.assertEqual(results["options"]["concurrency"], 4)
+        self.assertEqual(results["sync"]["items"], 18)
+        self.assertEqual(results["sync"]["requests"], 20)
+        self.assertGreater(results["sync"]["db_queries"], 0)
+        self.assertGreater(results["sync"]["peak_threads"], 1)
+        self.assertEqual(set(results["api"]), {"list", "detail", "search"})
+        self.assertTrue(all(stats["errors"] == 0 and stats["requests"] == 5 for stats in results["api"].values()))
+        self.assertFalse(News.objects.exists())
+        self.assertFalse(SyncState.objects.exists())
+        # Nothing the benchmark cached is seen outside of it
+        self.assertEqual(get_data_version(), version)
+        self.assertEqual(popular_searches(10), [])
@@ -0,0 +1,132 @@
+from django.conf import settings
+from django.db.models import CharField, Count, F, OuterRef, Subquery, Value, Window
+from django.db.models.functions import Cast, Concat, LPad, RowNumber
+
+from .models import News, Comment
+
+# Digits of one Hacker News ID in a materialized path
+PATH_WIDTH = 10
+MAX_DEPTH = Comment._meta.get_field("path").max_length // PATH_WIDTH
+
+
+class TreePositions:
+    """
+    Work out where comments sit in their thread.
+
+    A position is (news_id, depth, path): the item ID of the story, the number of
+    comments from the story down to this one, and the zero-padded IDs of those
+    comments concatenated. Sorting a thread by path lists it depth first, with
+    replies in the order they were posted.
+
+    Positions of parents seen earlier are cached; the others are loaded from the
+    database once per batch.
+    """
+
+    def __init__(self):
+        self.known = {}
+
+    def add_story(self, item_id):
+        self.known[item_id] = (item_id, 0, "")
+
+    def resolve(self, rows):
+        """
+        Fill in the story (news_id), depth and path of Comment rows.
+        Comments whose parent is unknown keep an empty fingerprint, so they are
+        written again (and placed) on a later sync.
+        :param rows: {comment_id: values} as built by comment_defaults
+        """
+        missing = {values["parent"] for values in rows.values()} - self.known.keys() - rows.keys()
+        missing.discard(None)
+        if missing:
+            self.known.update(
+                (item_id, (item_id, 0, ""))
+                for item_id in News.objects.filter(item_id__in=missing).values_list("item_id", flat=True)
+            )
+            self.known.update(
+                (comment_id, (root, depth, path))
+                for comment_id, root, depth, path in Comment.objects.filter(
+                    comment_id__in=missing, news__isnull=False
+                ).values_list("comment_id", "news_id", "depth", "path")
+            )
+
+        # Replies have higher IDs than their parents, so parents in the same batch come first
+        for comment_id in sorted(rows):
+            values = rows[comment_id]
+            parent = self.known.get(values["parent"])
+            if parent is None or parent[1] >= MAX_DEPTH:
+                values.update(news_id=None, depth=0, path="", fingerprint="")
+                continue
+            root, depth, path = parent
+            position = (root, depth + 1, path + f"{comment_id:0{PATH_WIDTH}d}")
+            values.update(news_id=position[0], depth=position[1], path=position[2])
+            self.known[comment_id] = position
+
+
+def place_unplaced_comments():
+    """
+    Place stored comments that have no story yet, typically replies written before their parent.
+    Parent chains are walked one level per UPDATE: replies to stored stories first, then replies
+    to the comments placed in the round before.
+    :return: The number of comments placed
+    """
+    unplaced = Comment.objects.filter(news__isnull=True, comment_id__isnull=False)
+    own_path = LPad(Cast("comment_id", CharField()), PATH_WIDTH, Value("0"))
+
+    placed = unplaced.filter(parent__in=News.objects.filter(item_id__isnull=False).values("item_id")).update(
+        news=F("parent"), depth=1, path=own_path,
+    )
+    parents = Comment.objects.filter(comment_id=OuterRef("parent"))
+    placed_parents = Comment.objects.filter(news__isnull=False, depth__lt=MAX_DEPTH).values("comment_id")
+    while level := unplaced.filter(parent__in=placed_parents).update(
+        news=Subquery(parents.values("news")[:1]),
+        depth=Subquery(parents.values("depth")[:1]) + 1,
+        path=Concat(Subquery(parents.values("path")[:1]), own_path),
+    ):
+        placed += level
+    return placed
+
+
+def build_thread(item_id, max_depth=None, max_breadth=None):
+    """
+    Load the comment thread of a story as a tree, in two queries on (news, path).
+
+    Only comments within the breadth limit among their siblings are loaded, at most
+    HN_THREAD_MAX_COMMENTS of them. Each returned comment has `replies`, its shown child
+    comments, and `more_replies`, the number of its stored children left out, by the
+    breadth limit or by the HN_THREAD_MAX_COMMENTS cap. The left out children are counted
+    by a second, aggregate query. Replies of left out comments are left out too.
+    :param item_id: Hacker News ID of the story
+    :param max_depth: Deepest level to load, capped by HN_THREAD_MAX_DEPTH
+    :param max_breadth: Most replies shown per comment, capped by HN_THREAD_MAX_BREADTH
+    :return: (top level comments, number of top level comments left out)
+    """
+    max_depth = min(max_depth or settings.HN_THREAD_MAX_DEPTH, settings.HN_THREAD_MAX_DEPTH)
+    max_breadth = min(max_breadth or settings.HN_THREAD_MAX_BREADTH, settings.HN_THREAD_MAX_BREADTH)
+    thread = Comment.objects.filter(news_id=item_id)
+    comments = thread.filter(depth__lte=max_depth).annotate(
+        sibling=Window(RowNumber(), partition_by=[F("parent")], order_by=F("path").asc()),
+    ).filter(sibling__lte=max_breadth).order_by("path")
+
+    top_level = []
+    shown = {}
+    for comment in comments[:settings.HN_THREAD_MAX_COMMENTS]:
+        if comment.depth == 1:
+            siblings = top_level
+        else:
+            parent = shown.get(comment.parent)
+            if parent is None:
+                continue
+            siblings = parent.replies
+        comment.replies = []
+        siblings.append(comment)
+        shown[comment.comment_id] = comment
+
+    # Children of the deepest loaded level are beyond the depth limit, not left out
+    parents = [comment_id for comment_id, comment in shown.items() if comment.depth < max_depth]
+    counts = dict(
+        thread.filter(parent__in=[item_id, *parents])
+        .values_list("parent").annotate(replies=Count("id")).order_by()
+    )
+    for comment in shown.values():
+        comment.more_replies = counts.get(comment.comment_id, 0) - len(comment.replies)
+    return top_level, counts.get(item_id, 0) - len(top_level)
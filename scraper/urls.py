@@ -4,4 +4,5 @@ from .import views
 urlpatterns = [
   path('', views.NewsListView.as_view(), name='item_list'),
   path('detail/<int:pk>/', views.NewsDetailView.as_view(), name='item_detail'),
+  path('metrics', views.MetricsView.as_view(), name='metrics'),
 ]
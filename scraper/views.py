@@ -1,47 +1,87 @@
 from django.views.generic import ListView
-from .models import News, Comment
+from .models import News
 from django.views.generic import DetailView
-from django.db.models import Q
-from django.core.paginator import Paginator
 from django.shortcuts import render
+from django.http import HttpResponse
+from django.views import View
+from .detail import render_comment_page
+from .metrics import render_prometheus
+from .pages import CachedPageMixin
+from .pagination import InvalidCursor, KeysetPaginator
+from .search import record_search, search
+from .tree import build_thread
 
 
-class NewsListView(ListView):
+class NewsListView(CachedPageMixin, ListView):
     model = News
     template_name = 'news_list.html'
     context_object_name = 'news_items'
     paginate_by = 10
 
+    def get(self, request, *args, **kwargs):
+        # Counted before the page cache, so searches served from it count too
+        if request.GET.get('search'):
+            record_search(request.GET['search'])
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
         search_query = self.request.GET.get('search', '')
         type_query = self.request.GET.get('type', '')
         queryset = News.objects.all()
 
-        if search_query:
-            queryset = queryset.filter(title__icontains=search_query)
-
         if type_query:
             queryset = queryset.filter(type=type_query)
 
-        return queryset
+        if search_query:
+            return search(queryset, search_query)
+
+        return queryset.order_by('-date_created', '-id')
+
+    def use_cursor(self):
+        """
+        Keyset pagination is opt-in with ?pagination=cursor, and kept on by the ?after= links.
+        """
+        return self.request.GET.get('pagination') == 'cursor' or 'after' in self.request.GET
+
+    def get_paginate_by(self, queryset):
+        # Keyset pages are built in get_context_data instead
+        return None if self.use_cursor() else self.paginate_by
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        paginator = Paginator(self.get_queryset(), self.paginate_by)
-        page_number = self.request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
-        context['news_items'] = page_obj
+        if self.use_cursor():
+            paginator = KeysetPaginator(self.object_list, self.paginate_by, 'date_created')
+            try:
+                page = paginator.page(self.request.GET.get('after'))
+            except InvalidCursor:
+                page = paginator.page()
+            context['news_items'] = page
+            context['next_cursor'] = page.next_cursor
+            context['cursor_pagination'] = True
+        else:
+            context['news_items'] = context['page_obj']
         return context
 
 
-class NewsDetailView(DetailView):
+class NewsDetailView(CachedPageMixin, DetailView):
     model = News
     template_name = 'news_detail.html'
     context_object_name = 'details'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        news = self.get_object()
-        context['comments'] = Comment.objects.filter(parent=news.item_id)  # Ensure this is correct
+        # DetailView already loaded the story; the comment page is rendered once per story version
+        news = self.object
+        context['comments_html'], context['comment_count'] = render_comment_page(news)
+        if self.request.GET.get('view') == 'thread':
+            context['thread'], context['more_replies'] = build_thread(news.item_id)
         return context
 
+
+class MetricsView(View):
+    """
+    Sync metrics in the Prometheus text exposition format, for scraping.
+    """
+
+    def get(self, request):
+        return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
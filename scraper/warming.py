@@ -0,0 +1,104 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+
+from .models import FeedEntry, News
+from .pages import render_page
+from .search import popular_searches
+
+logger = logging.getLogger(__name__)
+
+
+def hot_paths():
+    """
+    Pages most requested right after a sync, most important first: the first HN_WARM_PAGES
+    pages of the HTML and API lists for each item type and of the ranked feeds, the pages
+    of the HN_WARM_STORIES top stories and the lists of the HN_WARM_SEARCHES most popular
+    recent searches. API pages are cached per origin, so they are only warmed for the one
+    set in HN_WARM_BASE_URL.
+    """
+    types = [''] + sorted(News.objects.order_by().values_list('type', flat=True).distinct())
+    top_stories = FeedEntry.objects.filter(
+        feed=FeedEntry.TOP, position__lte=settings.HN_WARM_STORIES,
+    ).order_by('position').values_list('news_id', flat=True)
+    html_list = reverse('item_list')
+    api_list = '/api/item/'
+    warm_api = bool(settings.HN_WARM_BASE_URL)
+
+    paths = []
+    for page in range(1, settings.HN_WARM_PAGES + 1):
+        for item_type in types:
+            params = {'type': item_type, 'page': page if page > 1 else ''}
+            paths.append(with_query(html_list, params))
+            if warm_api:
+                paths.append(with_query(api_list, params))
+        if warm_api:
+            for feed, _ in FeedEntry.FEEDS:
+                paths.append(with_query(reverse('item_feed', args=[feed]), {'page': page if page > 1 else ''}))
+    paths.extend(reverse('item_detail', args=[pk]) for pk in top_stories)
+    for query in popular_searches(settings.HN_WARM_SEARCHES):
+        paths.append(with_query(html_list, {'search': query}))
+        if warm_api:
+            paths.append(with_query(api_list, {'search': query}))
+    return paths
+
+
+def with_query(path, params):
+    query = urlencode({name: value for name, value in params.items() if value})
+    return f"{path}?{query}" if query else path
+
+
+def warm_pages(paths, budget=None, concurrency=None):
+    """
+    Render `paths` into the page and API caches within a time budget. Paths are shared
+    round-robin between the workers so the first ones are rendered first; paths not
+    started when the budget runs out are skipped.
+    :param budget: Seconds available, HN_WARM_BUDGET by default
+    :param concurrency: Pages rendered at once, HN_WARM_CONCURRENCY by default
+    :return: Coverage report: paths planned, warmed, failed and skipped, and the time taken
+    """
+    budget = settings.HN_WARM_BUDGET if budget is None else budget
+    concurrency = max(1, min(concurrency or settings.HN_WARM_CONCURRENCY, len(paths) or 1))
+    started = time.monotonic()
+    deadline = started + budget
+
+    def warm(lane):
+        results = []
+        for path in lane:
+            if time.monotonic() >= deadline:
+                results.append("skipped")
+                continue
+            try:
+                results.append("warmed" if render_page(path) == 200 else "failed")
+            except Exception as e:
+                logger.error(f"Error warming {path}: {str(e)}")
+                results.append("failed")
+        return results
+
+    def warm_in_thread(lane):
+        try:
+            return warm(lane)
+        finally:
+            connections.close_all()
+
+    lanes = [paths[worker::concurrency] for worker in range(concurrency)]
+    if concurrency == 1:
+        results = warm(paths)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = [result for lane in pool.map(warm_in_thread, lanes) for result in lane]
+
+    report = {
+        "planned": len(paths),
+        "warmed": results.count("warmed"),
+        "failed": results.count("failed"),
+        "skipped": results.count("skipped"),
+        "time": time.monotonic() - started,
+    }
+    report["coverage"] = report["warmed"] / report["planned"] if paths else 1.0
+    return report
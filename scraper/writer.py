@@ -0,0 +1,146 @@
+import hashlib
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import News, Comment
+from .tree import TreePositions
+
+logger = logging.getLogger(__name__)
+
+
+class BulkWriter:
+    """
+    Buffer parsed Hacker News items and write them to the database in batches.
+
+    Each batch is written in one transaction: one SELECT for the stored
+    fingerprints, then one INSERT ... ON CONFLICT DO UPDATE per model for the
+    rows whose fingerprint changed. Unchanged rows are counted in `unchanged`
+    and not written at all; the Hacker News IDs of written stories are kept in
+    `changed_stories`. Comments are placed in their thread (story, depth,
+    path) before they are written. A batch is flushed when `batch_size` rows are buffered or `flush_interval` seconds
+    have passed since the last flush. Use it as a context manager so the tail
+    is flushed on exit:
+
+        with BulkWriter() as writer:
+            writer.add(News, item_id, story_defaults(item_data))
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None):
+        self.batch_size = batch_size or settings.HN_WRITE_BATCH_SIZE
+        self.flush_interval = settings.HN_WRITE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.buffers = {News: {}, Comment: {}}
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.changed_stories = []
+        self.flushes = 0
+        self.write_time = 0.0
+        self.tree = TreePositions()
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add(self, model, key, values):
+        """
+        Queue one row for writing.
+        :param model: News or Comment
+        :param key: The Hacker News ID (item_id / comment_id)
+        :param values: Field values for the row, as built by story_defaults / comment_defaults
+        """
+        # Later versions of the same item replace earlier ones in the batch
+        self.buffers[model][key] = values
+        if self.pending >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    @property
+    def pending(self):
+        return sum(len(rows) for rows in self.buffers.values())
+
+    def flush(self):
+        """
+        Write all buffered rows.
+        """
+        started = time.monotonic()
+        for model, rows in self.buffers.items():
+            if not rows:
+                continue
+            try:
+                with transaction.atomic():
+                    self._write(model, rows)
+            except Exception as e:
+                logger.error(f"Error writing {len(rows)} {model.__name__} rows in bulk, retrying one by one: {str(e)}")
+                self._write_one_by_one(model, rows)
+            self.buffers[model] = {}
+        self.flushes += 1
+        self._last_flush = time.monotonic()
+        self.write_time += self._last_flush - started
+
+    def _write(self, model, rows):
+        key_field = key_field_for(model)
+        stored = dict(
+            model.objects.filter(**{f"{key_field}__in": list(rows)}).values_list(key_field, "fingerprint")
+        )
+        changed = {
+            key: values for key, values in rows.items()
+            if not values.get("fingerprint") or stored.get(key) != values["fingerprint"]
+        }
+        self.unchanged += len(rows) - len(changed)
+        if model is News:
+            for key in rows:
+                self.tree.add_story(key)
+        if not changed:
+            return
+        if model is Comment:
+            self.tree.resolve(changed)
+
+        objs = [model(**{key_field: key}, **values) for key, values in changed.items()]
+        model.objects.bulk_create(
+            objs,
+            batch_size=self.batch_size,
+            update_conflicts=True,
+            unique_fields=[key_field],
+            update_fields=list(next(iter(changed.values()))),
+        )
+        if model is News:
+            self.changed_stories.extend(changed)
+        updated = sum(key in stored for key in changed)
+        self.updated += updated
+        self.created += len(changed) - updated
+
+    def _write_one_by_one(self, model, rows):
+        key_field = key_field_for(model)
+        for key, values in rows.items():
+            try:
+                _, created = model.objects.update_or_create(**{key_field: key}, defaults=values)
+            except Exception as e:
+                logger.error(f"Error saving {model.__name__} {key}: {str(e)}")
+                continue
+            if model is News:
+                self.changed_stories.append(key)
+            if created:
+                self.created += 1
+            else:
+                self.updated += 1
+
+
+def key_field_for(model):
+    """
+    Name of the field holding the Hacker News ID of `model`.
+    """
+    return "item_id" if model is News else "comment_id"
+
+
+def item_fingerprint(item_data):
+    """
+    Compact hash of the canonical JSON of a Hacker News item.
+    """
+    canonical = json.dumps(item_data, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()